@@ -0,0 +1,123 @@
+ALTER TABLE core_filemeta ADD COLUMN "digest" varchar(64) NOT NULL DEFAULT '';
+ALTER TABLE core_filemeta ADD COLUMN "crc32" bigint NULL;
+
+CREATE TABLE "core_searchtoken" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "content_type_id" integer NOT NULL REFERENCES "django_content_type" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "object_id" integer CHECK ("object_id" >= 0) NOT NULL,
+    "fieldname" varchar(200) NOT NULL,
+    "token" varchar(50) NOT NULL
+);
+CREATE INDEX "core_searchtoken_content_type_id" ON "core_searchtoken" ("content_type_id");
+CREATE INDEX "core_searchtoken_object_id" ON "core_searchtoken" ("object_id");
+CREATE INDEX "core_searchtoken_token" ON "core_searchtoken" ("token");
+CREATE INDEX "core_searchtoken_token_like" ON "core_searchtoken" ("token" varchar_pattern_ops);
+
+CREATE TABLE "core_nodeclosure" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "ancestor_id" integer NOT NULL REFERENCES "core_node" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "descendant_id" integer NOT NULL REFERENCES "core_node" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "depth" integer CHECK ("depth" >= 0) NOT NULL,
+    UNIQUE ("ancestor_id", "descendant_id")
+);
+CREATE INDEX "core_nodeclosure_ancestor_id" ON "core_nodeclosure" ("ancestor_id");
+CREATE INDEX "core_nodeclosure_descendant_id" ON "core_nodeclosure" ("descendant_id");
+INSERT INTO "core_nodeclosure" ("ancestor_id", "descendant_id", "depth")
+    WITH RECURSIVE closure(ancestor_id, descendant_id, depth) AS (
+        SELECT id, id, 0 FROM core_node
+        UNION ALL
+        SELECT node.parentnode_id, closure.descendant_id, closure.depth + 1
+        FROM closure JOIN core_node node ON node.id = closure.ancestor_id
+        WHERE node.parentnode_id IS NOT NULL
+    )
+    SELECT ancestor_id, descendant_id, depth FROM closure;
+
+-- Populated from the admins, examiners and candidates below. Rebuild with:
+-- python manage.py devilry_rebuild_effective_roles
+CREATE TABLE "core_effectiverole" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "user_id" integer NOT NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "role" varchar(10) NOT NULL,
+    "subject_id" integer NULL REFERENCES "core_subject" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "period_id" integer NULL REFERENCES "core_period" ("id") DEFERRABLE INITIALLY DEFERRED,
+    "assignment_id" integer NULL REFERENCES "core_assignment" ("id") DEFERRABLE INITIALLY DEFERRED,
+    UNIQUE ("user_id", "role", "subject_id", "period_id", "assignment_id")
+);
+CREATE INDEX "core_effectiverole_user_id" ON "core_effectiverole" ("user_id");
+CREATE INDEX "core_effectiverole_user_id_role" ON "core_effectiverole" ("user_id", "role");
+-- NULLs are distinct in the UNIQUE constraint, and only one of the foreign
+-- keys is set on each row, so each of them needs its own unique index.
+CREATE UNIQUE INDEX "core_effectiverole_unique_subject" ON "core_effectiverole" ("user_id", "role", "subject_id") WHERE "subject_id" IS NOT NULL;
+CREATE UNIQUE INDEX "core_effectiverole_unique_period" ON "core_effectiverole" ("user_id", "role", "period_id") WHERE "period_id" IS NOT NULL;
+CREATE UNIQUE INDEX "core_effectiverole_unique_assignment" ON "core_effectiverole" ("user_id", "role", "assignment_id") WHERE "assignment_id" IS NOT NULL;
+CREATE INDEX "core_effectiverole_subject_id" ON "core_effectiverole" ("subject_id");
+CREATE INDEX "core_effectiverole_period_id" ON "core_effectiverole" ("period_id");
+CREATE INDEX "core_effectiverole_assignment_id" ON "core_effectiverole" ("assignment_id");
+-- Admins of each subject, period and assignment, on the object itself or
+-- on any of its parents (node admins through core_nodeclosure).
+INSERT INTO "core_effectiverole" ("user_id", "role", "subject_id")
+    SELECT admins.user_id, 'admin', admins.subject_id
+    FROM core_subject_admins admins
+    UNION
+    SELECT admins.user_id, 'admin', subject.id
+    FROM core_subject subject
+    JOIN core_nodeclosure closure ON closure.descendant_id = subject.parentnode_id
+    JOIN core_node_admins admins ON admins.node_id = closure.ancestor_id;
+INSERT INTO "core_effectiverole" ("user_id", "role", "period_id")
+    SELECT admins.user_id, 'admin', admins.period_id
+    FROM core_period_admins admins
+    UNION
+    SELECT admins.user_id, 'admin', period.id
+    FROM core_period period
+    JOIN core_subject_admins admins ON admins.subject_id = period.parentnode_id
+    UNION
+    SELECT admins.user_id, 'admin', period.id
+    FROM core_period period
+    JOIN core_subject subject ON subject.id = period.parentnode_id
+    JOIN core_nodeclosure closure ON closure.descendant_id = subject.parentnode_id
+    JOIN core_node_admins admins ON admins.node_id = closure.ancestor_id;
+INSERT INTO "core_effectiverole" ("user_id", "role", "assignment_id")
+    SELECT admins.user_id, 'admin', admins.assignment_id
+    FROM core_assignment_admins admins
+    UNION
+    SELECT admins.user_id, 'admin', assignment.id
+    FROM core_assignment assignment
+    JOIN core_period_admins admins ON admins.period_id = assignment.parentnode_id
+    UNION
+    SELECT admins.user_id, 'admin', assignment.id
+    FROM core_assignment assignment
+    JOIN core_period period ON period.id = assignment.parentnode_id
+    JOIN core_subject_admins admins ON admins.subject_id = period.parentnode_id
+    UNION
+    SELECT admins.user_id, 'admin', assignment.id
+    FROM core_assignment assignment
+    JOIN core_period period ON period.id = assignment.parentnode_id
+    JOIN core_subject subject ON subject.id = period.parentnode_id
+    JOIN core_nodeclosure closure ON closure.descendant_id = subject.parentnode_id
+    JOIN core_node_admins admins ON admins.node_id = closure.ancestor_id;
+-- Examiners and candidates on each assignment
+INSERT INTO "core_effectiverole" ("user_id", "role", "assignment_id")
+    SELECT DISTINCT examiners.user_id, 'examiner', assignmentgroup.parentnode_id
+    FROM core_assignmentgroup_examiners examiners
+    JOIN core_assignmentgroup assignmentgroup ON assignmentgroup.id = examiners.assignmentgroup_id;
+INSERT INTO "core_effectiverole" ("user_id", "role", "assignment_id")
+    SELECT DISTINCT candidates.student_id, 'candidate', assignmentgroup.parentnode_id
+    FROM core_candidate candidates
+    JOIN core_assignmentgroup assignmentgroup ON assignmentgroup.id = candidates.assignment_group_id;
+
+-- Recalculate with: python manage.py devilry_rebuild_delivery_summaries
+ALTER TABLE "core_assignmentgroup" ADD COLUMN "latest_delivery_id" integer NULL;
+ALTER TABLE "core_assignmentgroup" ADD COLUMN "latest_deadline_id" integer NULL;
+ALTER TABLE "core_assignmentgroup" ADD COLUMN "latest_deadline_deadline" timestamp with time zone NULL;
+ALTER TABLE "core_assignmentgroup" ADD COLUMN "number_of_deliveries" integer NOT NULL DEFAULT 0 CHECK ("number_of_deliveries" >= 0);
+CREATE INDEX "core_assignmentgroup_latest_deadline_deadline" ON "core_assignmentgroup" ("latest_deadline_deadline");
+CREATE INDEX "core_assignmentgroup_number_of_deliveries" ON "core_assignmentgroup" ("number_of_deliveries");
+UPDATE "core_assignmentgroup" SET
+    "latest_delivery_id" = (SELECT MAX(delivery.id)
+                            FROM core_delivery delivery JOIN core_deadline deadline ON deadline.id = delivery.deadline_id
+                            WHERE deadline.assignment_group_id = core_assignmentgroup.id),
+    "latest_deadline_id" = (SELECT MAX(id) FROM core_deadline WHERE assignment_group_id = core_assignmentgroup.id),
+    "latest_deadline_deadline" = (SELECT MAX(deadline) FROM core_deadline WHERE assignment_group_id = core_assignmentgroup.id),
+    "number_of_deliveries" = (SELECT COUNT(delivery.id)
+                              FROM core_delivery delivery JOIN core_deadline deadline ON deadline.id = delivery.deadline_id
+                              WHERE deadline.assignment_group_id = core_assignmentgroup.id);
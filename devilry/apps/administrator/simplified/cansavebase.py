@@ -1,4 +1,5 @@
 from devilry.simplified import (SimplifiedModelApi, PermissionDenied)
+from devilry.apps.core.authcontext import get_authcontext
 
 
 class CanSaveBase(SimplifiedModelApi):
@@ -26,7 +27,7 @@ class CanSaveBase(SimplifiedModelApi):
         :param obj: An object of the type this method is used in.
         :throws PermissionDenied:
         """
-        if not obj.can_save(user):
+        if not get_authcontext(user).can_save(obj):
             raise PermissionDenied()
 
     @classmethod
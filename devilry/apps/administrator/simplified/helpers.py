@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 
-from devilry.simplified import InvalidUsername
+from devilry.simplified import InvalidUsername, PermissionDenied
 
 
 def _convert_list_of_usernames_to_userobjects(usernames):
@@ -17,3 +17,18 @@ def _convert_list_of_usernames_to_userobjects(usernames):
             raise InvalidUsername(username)
         users.append(user)
     return users
+
+
+def _authorize_admin_on_all(user, modelcls, pks):
+    """
+    Raise ``PermissionDenied`` unless ``user`` is superadmin, or admin on all
+    the ``modelcls`` objects with the given primary keys. The number of
+    queries does not depend on the number of primary keys.
+    """
+    if user.is_superuser:
+        return
+    pks = set(pks)
+    if None in pks:
+        raise PermissionDenied()
+    if modelcls.where_is_admin(user).filter(pk__in=pks).count() != len(pks):
+        raise PermissionDenied()
@@ -1,5 +1,4 @@
 from django.contrib.auth.models import User
-from django.db.models import Count, Max
 
 from devilry.simplified import (simplified_modelapi, PermissionDenied,
                                 InvalidUsername, FieldSpec, FilterSpecs,
@@ -7,7 +6,7 @@ from devilry.simplified import (simplified_modelapi, PermissionDenied,
 from devilry.apps.core import models
 from devilry.coreutils.simplified.metabases import SimplifiedAssignmentGroupMetaMixin
 
-from helpers import _convert_list_of_usernames_to_userobjects
+from helpers import _convert_list_of_usernames_to_userobjects, _authorize_admin_on_all
 from cansavebase import CanSaveBase
 
 
@@ -42,10 +41,19 @@ class SimplifiedAssignmentGroup(CanSaveBase):
         :param user: A django user object.
         :rtype: a django queryset
         """
-        return cls._meta.model.where_is_admin_or_superadmin(user, 'feedback', 'parentnode').annotate(latest_delivery_id=Max('deadlines__deliveries__id'),
-                                                                                                     latest_deadline_id=Max('deadlines__id'),
-                                                                                                     latest_deadline_deadline=Max('deadlines__deadline'),
-                                                                                                     number_of_deliveries=Count('deadlines__deliveries'))
+        return cls._meta.model.where_is_admin_or_superadmin(user, 'feedback', 'parentnode')
+
+    @classmethod
+    def write_authorize_many(cls, user, objs):
+        """ Same as :meth:`write_authorize` for each of the given
+        AssignmentGroup ``objs``, but with a fixed number of queries.
+
+        :param user: A django user object.
+        :param objs: List of AssignmentGroup objects.
+        :throws PermissionDenied:
+        """
+        _authorize_admin_on_all(user, models.Assignment,
+                                [obj.parentnode_id for obj in objs])
 
     @classmethod
     def _parse_examiners_as_list_of_usernames(cls, obj):
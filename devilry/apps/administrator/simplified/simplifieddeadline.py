@@ -3,6 +3,9 @@ from devilry.coreutils.simplified.metabases import SimplifiedDeadlineMetaMixin
 
 from django.db.models import Count
 
+from devilry.apps.core.models import AssignmentGroup
+from helpers import _authorize_admin_on_all
+
 
 @simplified_modelapi
 class SimplifiedDeadline(SimplifiedModelApi):
@@ -48,3 +51,15 @@ class SimplifiedDeadline(SimplifiedModelApi):
         """
         if not obj.assignment_group.can_save(user_obj):
             raise PermissionDenied()
+
+    @classmethod
+    def write_authorize_many(cls, user_obj, objs):
+        """ Same as :meth:`write_authorize` for each of the given Deadline
+        ``objs``, but with a fixed number of queries.
+
+        :param user: A django user object.
+        :param objs: List of Deadline objects.
+        :throws PermissionDenied:
+        """
+        _authorize_admin_on_all(user_obj, AssignmentGroup,
+                                [obj.assignment_group_id for obj in objs])
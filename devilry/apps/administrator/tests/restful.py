@@ -446,6 +446,27 @@ class TestRestfulSimplifiedAssignmentGroup(TestCase, testhelper.TestHelper):
         first = data['items'][0]
         self.assertEquals(set(first.keys()), set(self.resultfields.all_aslist()))
 
+    def test_search_cursor(self):
+        url = self.simplifiedcls.get_rest_url()
+        ids = []
+        getdata = {'getdata_in_qrystring': True, 'limit': 4, 'count_total': 0,
+                   'orderby': json.dumps(['-parentnode__short_name'])}
+        while True:
+            r = self.client.get(url, data=getdata)
+            self.assertEquals(r.status_code, 200)
+            data = json.loads(r.content)
+            self.assertFalse('total' in data)
+            ids.extend(item['id'] for item in data['items'])
+            if not data['next_cursor']:
+                break
+            getdata['cursor'] = data['next_cursor']
+        self.assertEquals(len(ids), 6)
+        self.assertEquals(len(set(ids)), 6)
+
+        getdata['cursor'] = 'invalid'
+        r = self.client.get(url, data=getdata)
+        self.assertEquals(r.status_code, 400)
+
     def test_create(self):
         self.create_user('exampleexaminer1')
         self.create_user('exampleexaminer2')
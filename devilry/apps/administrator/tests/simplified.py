@@ -1175,14 +1175,14 @@ class TestSimplifiedAdminAssignmentGroup(SimplifiedAdminTestBase):
 
         # do a read with no extra fields
         read_res = SimplifiedAssignmentGroup.read(self.admin1, self.inf101_firstsem_a1_g1.id)
-        expected_res = modelinstance_to_dict(self.inf101_firstsem_a1_g1,
+        expected_res = modelinstance_to_dict(models.AssignmentGroup.objects.get(id=self.inf101_firstsem_a1_g1.id),
                                              SimplifiedAssignmentGroup._meta.resultfields.aslist())
         self.assertDictEqual(read_res, expected_res)
 
     def test_read_allextras(self):
         # do a read with all extras
         read_res = SimplifiedAssignmentGroup.read(self.admin1, self.inf101_firstsem_a1_g1.id, result_fieldgroups=self.allExtras)
-        expected_res = modelinstance_to_dict(self.inf101_firstsem_a1_g1,
+        expected_res = modelinstance_to_dict(models.AssignmentGroup.objects.get(id=self.inf101_firstsem_a1_g1.id),
                                              SimplifiedAssignmentGroup._meta.resultfields.aslist(self.allExtras))
         self.assertDictEqual(read_res, expected_res)
 
@@ -1390,6 +1390,53 @@ class TestSimplifiedAdminAssignmentGroup(SimplifiedAdminTestBase):
         with self.assertRaises(PermissionDenied):
             SimplifiedAssignmentGroup.delete(self.testexam, self.inf101_firstsem_a1_g1.id)
 
+    def test_write_authorize_many(self):
+        groups = [self.inf101_firstsem_a1_g1, self.inf101_firstsem_a2_g1, self.inf101_secondsem_a1_g2]
+        with self.assertNumQueries(1):
+            SimplifiedAssignmentGroup.write_authorize_many(self.admin1, groups)
+        with self.assertNumQueries(0):
+            SimplifiedAssignmentGroup.write_authorize_many(self.superadminuser, groups)
+        with self.assertRaises(PermissionDenied):
+            SimplifiedAssignmentGroup.write_authorize_many(self.testadmin,
+                                                           groups + [self.inf110_secondsem_a1_g1])
+
+    def test_createmany(self):
+        assignment = self.inf101_firstsem_a1_g1.parentnode
+        newpks = SimplifiedAssignmentGroup.createmany(self.admin1,
+                                                      dict(name='test1', parentnode=assignment),
+                                                      dict(name='test2', parentnode=assignment))
+        self.assertEquals([models.AssignmentGroup.objects.get(pk=pk).name for pk in newpks],
+                          ['test1', 'test2'])
+
+    def test_createmany_security_asadmin(self):
+        before = models.AssignmentGroup.objects.count()
+        with self.assertRaises(PermissionDenied):
+            SimplifiedAssignmentGroup.createmany(self.testadmin,
+                                                 dict(name='test1', parentnode=self.inf101_firstsem_a1_g1.parentnode),
+                                                 dict(name='test2', parentnode=self.inf110_secondsem_a1_g1.parentnode))
+        self.assertEquals(models.AssignmentGroup.objects.count(), before)
+
+    def test_updatemany(self):
+        pks = SimplifiedAssignmentGroup.updatemany(self.admin1,
+                                                   dict(pk=self.inf101_firstsem_a1_g1.id, name='test1'),
+                                                   dict(pk=str(self.inf110_secondsem_a1_g1.id), name='test2'))
+        self.assertEquals([models.AssignmentGroup.objects.get(pk=pk).name for pk in pks],
+                          ['test1', 'test2'])
+        with self.assertRaises(PermissionDenied):
+            SimplifiedAssignmentGroup.updatemany(self.admin1, dict(pk=100000, name='test'))
+        with self.assertRaises(PermissionDenied):
+            SimplifiedAssignmentGroup.updatemany(self.testadmin,
+                                                 dict(pk=self.inf101_firstsem_a1_g1.id, name='test3'),
+                                                 dict(pk=self.inf110_secondsem_a1_g1.id, name='test4'))
+        self.assertEquals(models.AssignmentGroup.objects.get(pk=self.inf101_firstsem_a1_g1.id).name, 'test1')
+
+    def test_deletemany(self):
+        pks = [self.inf101_firstsem_a1_g1.id, self.inf110_secondsem_a1_g1.id]
+        with self.assertRaises(PermissionDenied): # Not empty
+            SimplifiedAssignmentGroup.deletemany(self.admin1, *pks)
+        SimplifiedAssignmentGroup.deletemany(self.superadminuser, *pks)
+        self.assertEquals(models.AssignmentGroup.objects.filter(pk__in=pks).count(), 0)
+
 
 class TestSimplifiedAdminStaticFeedback(SimplifiedAdminTestBase):
 
@@ -1716,6 +1763,19 @@ class TestSimplifiedAdminDeadline(SimplifiedAdminTestBase):
 
         self.assertEquals(read_res, expected_res)
 
+    def test_createmany(self):
+        deadline = self.inf101_firstsem_a1.publishing_time + timedelta(days=3)
+        groups = [self.inf101_firstsem_a1_g1, self.inf110_secondsem_a1_g1]
+        createdpks = SimplifiedDeadline.createmany(self.admin1,
+                                                   *[dict(assignment_group=group, deadline=deadline, text='Many')
+                                                     for group in groups])
+        self.assertEquals([models.Deadline.objects.get(pk=pk).assignment_group for pk in createdpks],
+                          groups)
+        with self.assertRaises(PermissionDenied):
+            SimplifiedDeadline.createmany(self.testadmin,
+                                          *[dict(assignment_group=group, deadline=deadline, text='Many')
+                                            for group in groups])
+
     def test_create_invaliddeadline(self):
         # create an invalid deadline, which runs out before the
         # publishing date
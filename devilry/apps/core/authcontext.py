@@ -0,0 +1,145 @@
+"""
+Memoised authorization checks.
+
+Views and the simplified API often check the same roles on the same
+objects several times in a request (``is_candidate``, ``is_examiner``,
+``is_admin`` and ``can_save`` in turn). :func:`get_authcontext` gives an
+:class:`AuthorizationContext` for the user, which remembers the result of
+each check for as long as the user object lives. ``request.user`` is
+loaded for each request, so this is a request-scoped cache.
+
+If ``DEVILRY_AUTHORIZATION_CACHE_TIMEOUT`` is not ``0``, the results are
+also stored in the django cache for that many seconds, and shared between
+requests. The cached results of a user are invalidated when the effective
+roles of the user change (see
+:mod:`devilry.apps.core.models.effectiverole_sync`), which happens when
+admins, examiners or candidates are added or removed. Changes that may
+affect the roles of many users (such as moving a period) invalidate the
+cached results of all users.
+"""
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = 'devilry.authcontext'
+GLOBAL_GENERATION_KEY = KEY_PREFIX + '.generation'
+
+#: Incremented on each invalidation, so contexts in this process forget
+#: their results when roles change during their lifetime.
+_local_generation = [0]
+
+
+def _get_user_generation_key(userid):
+    return '{0}.generation.{1}'.format(KEY_PREFIX, userid)
+
+def _get_generation(key, cached):
+    generation = cached.get(key)
+    if generation is None:
+        cache.add(key, uuid4().hex)
+        generation = cache.get(key)
+    return generation
+
+def get_role_version(user_obj):
+    """ Get a string that changes when the cached results of ``user_obj``
+    are invalidated, that is, when the roles of the user may have changed.
+    Other caches depending on the roles of the user can use this in their
+    keys. """
+    userkey = _get_user_generation_key(user_obj.id)
+    cached = cache.get_many([GLOBAL_GENERATION_KEY, userkey])
+    return '{0}.{1}'.format(_get_generation(GLOBAL_GENERATION_KEY, cached),
+                            _get_generation(userkey, cached))
+
+def invalidate_user(userid):
+    """ Invalidate the cached results of the user with the given id. """
+    _local_generation[0] += 1
+    cache.delete(_get_user_generation_key(userid))
+
+def invalidate_all():
+    """ Invalidate the cached results of all users. """
+    _local_generation[0] += 1
+    cache.delete(GLOBAL_GENERATION_KEY)
+
+
+class AuthorizationContext(object):
+    """ Memoises the authorization checks of ``user_obj``. Use
+    :func:`get_authcontext` instead of creating this directly. """
+    def __init__(self, user_obj):
+        self.user_obj = user_obj
+        self.results = {}
+        self.generation = _local_generation[0]
+        self.timeout = getattr(settings, 'DEVILRY_AUTHORIZATION_CACHE_TIMEOUT', 0)
+        self._cache_prefix = None
+
+    def _get_cache_prefix(self):
+        """ Get the prefix of the cache keys of the user. The prefix
+        contains the generations of the user and of all users, so
+        invalidating any of these gives new keys. """
+        if self._cache_prefix is None:
+            self._cache_prefix = '{0}.{1}.{2}'.format(KEY_PREFIX,
+                                                      get_role_version(self.user_obj),
+                                                      self.user_obj.id)
+        return self._cache_prefix
+
+    def check(self, checkname, obj, checkfunc, shared=True):
+        """ Get the result of ``checkfunc()``, which checks ``checkname``
+        (such as ``'is_admin'``) on ``obj`` for the user. The result is
+        remembered for the lifetime of this context, and if ``shared`` is
+        ``True``, in the django cache. Only use ``shared`` for checks
+        depending only on the roles of the user, since other changes do
+        not invalidate the cache.
+
+        ``obj`` must be saved, and must not have unsaved changes affecting
+        ``checkfunc``.
+        """
+        opts = obj._meta
+        key = '{0}.{1}.{2}.{3}'.format(checkname, opts.app_label,
+                                       opts.object_name.lower(), obj.pk)
+        if self.generation != _local_generation[0]:
+            self.results = {}
+            self._cache_prefix = None
+            self.generation = _local_generation[0]
+        if key in self.results:
+            return self.results[key]
+        result = None
+        shared = shared and self.timeout
+        if shared:
+            cachekey = self._get_cache_prefix() + '.' + key
+            result = cache.get(cachekey)
+        if result is None:
+            result = bool(checkfunc())
+            if shared:
+                cache.set(cachekey, result, self.timeout)
+        self.results[key] = result
+        return result
+
+    def is_admin(self, obj):
+        """ Memoised ``obj.is_admin(user_obj)``. """
+        return self.check('is_admin', obj, lambda: obj.is_admin(self.user_obj))
+
+    def is_examiner(self, obj):
+        """ Memoised ``obj.is_examiner(user_obj)``. """
+        return self.check('is_examiner', obj, lambda: obj.is_examiner(self.user_obj))
+
+    def is_candidate(self, obj):
+        """ Memoised ``obj.is_candidate(user_obj)``. """
+        return self.check('is_candidate', obj, lambda: obj.is_candidate(self.user_obj))
+
+    def can_save(self, obj):
+        """ Memoised ``obj.can_save(user_obj)`` for objects read from the
+        database. Superusers can save anything, so this does not use the
+        cache for them. """
+        if self.user_obj.is_superuser:
+            return True
+        return self.check('can_save', obj, lambda: obj.can_save(self.user_obj))
+
+
+def get_authcontext(user_obj):
+    """ Get the :class:`AuthorizationContext` of ``user_obj``. The context
+    is created on the first call, and stored on ``user_obj``. """
+    context = getattr(user_obj, '_devilry_authcontext', None)
+    if context is None:
+        context = AuthorizationContext(user_obj)
+        user_obj._devilry_authcontext = context
+    return context
@@ -1,9 +1,14 @@
 from django.utils.importlib import import_module
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from os.path import join, exists
+from os.path import join, exists, dirname
 from os import makedirs, remove
 from StringIO import StringIO
+from tempfile import mkstemp
+from hashlib import sha256
+from shutil import copy2
+import os
+import errno
 import dumbdbm
 
 
@@ -96,6 +101,18 @@ class DeliveryStoreInterface(object):
         """
         raise NotImplementedError()
 
+    def get_filesystem_path(self, filemeta_obj):
+        """ Return the absolute path to the file on the local filesystem, or
+        ``None`` if the file is not stored as a regular file. This is
+        optional, and the default implementation returns ``None``. It is used
+        to let the web server send files (see :mod:`devilry.utils.sendfile`).
+
+        Raise FileNotFoundError if the file does not exist.
+
+        :param filemeta_obj: A :class:`devilry.core.models.FileMeta`-object.
+        """
+        return None
+
 
 class FsDeliveryStore(DeliveryStoreInterface):
     """ Filesystem-based DeliveryStore suitable for production use.
@@ -140,6 +157,85 @@ class FsDeliveryStore(DeliveryStoreInterface):
         filepath = self._get_filepath(filemeta_obj)
         return exists(filepath)
 
+    def get_filesystem_path(self, filemeta_obj):
+        filepath = os.path.abspath(self._get_filepath(filemeta_obj))
+        if not exists(filepath):
+            raise FileNotFoundError(filemeta_obj)
+        return filepath
+
+    def _listdir_numeric(self, dirpath):
+        """ List the entries in ``dirpath`` with numeric names (which is
+        all delivery and FileMeta directory entries) sorted by number. """
+        return sorted(int(name) for name in os.listdir(dirpath) if name.isdigit())
+
+    def get_delivery_parentdirs(self):
+        """ Get a list of all directories containing delivery directories. """
+        return [self.root]
+
+    def list_files_in_parentdir(self, parentdir):
+        """ List all files stored in the delivery directories within
+        ``parentdir`` (one of the directories returned by
+        :meth:`get_delivery_parentdirs`).
+
+        :return: A list of ``(deliveryid, filemetaid, filepath, stat)``
+            tuples, where ``stat`` is the result of ``os.stat(filepath)``.
+        """
+        files = []
+        for deliveryid in self._listdir_numeric(parentdir):
+            dirpath = join(parentdir, str(deliveryid))
+            if not os.path.isdir(dirpath):
+                continue
+            for filemetaid in self._listdir_numeric(dirpath):
+                filepath = join(dirpath, str(filemetaid))
+                files.append((deliveryid, filemetaid, filepath, os.stat(filepath)))
+        return files
+
+    def get_modified_time(self, stat):
+        """ Get the time the file with the given ``os.stat()`` result was
+        last written or linked into the store. A hard link keeps the
+        mtime of the file it links to, but updates the ctime, so this is
+        the newest of the two. """
+        return max(stat.st_mtime, stat.st_ctime)
+
+    def get_freed_size(self, filepath, stat):
+        """ Get the number of bytes :meth:`remove_filepath` would free by
+        removing the file at ``filepath``. ``stat`` is the result of
+        ``os.stat(filepath)``. """
+        return stat.st_size
+
+    def remove_filepath(self, filepath):
+        """ Remove the file at ``filepath``, which does not belong to any
+        FileMeta.
+
+        :return: The number of bytes freed.
+        """
+        size = os.stat(filepath).st_size
+        remove(filepath)
+        return size
+
+    def quarantine_filepath(self, filepath, targetpath):
+        """ Move the file at ``filepath``, which does not belong to any
+        FileMeta, to ``targetpath`` outside the store.
+
+        :return: The number of bytes freed in the store.
+        """
+        size = os.stat(filepath).st_size
+        targetdir = dirname(targetpath)
+        if not exists(targetdir):
+            makedirs(targetdir)
+        os.rename(filepath, targetpath)
+        return size
+
+    def list_unreferenced_files(self, newest_allowed):
+        """ List the files outside the delivery directories that are no
+        longer used by the store, and were modified before the
+        ``newest_allowed`` timestamp. FsDeliveryStore does not have any files
+        outside the delivery directories, so this returns an empty list.
+
+        :return: A list of ``(filepath, stat)`` tuples.
+        """
+        return []
+
 
 class FsHierDeliveryStore(FsDeliveryStore):
     """ Filesystem-based DeliveryStore suitable for production use with huge
@@ -181,6 +277,232 @@ class FsHierDeliveryStore(FsDeliveryStore):
         toplevel, sublevel = self.get_path_from_deliveryid(delivery_obj.pk)
         return join(self.root, str(toplevel), str(sublevel), str(delivery_obj.pk))
 
+    def get_delivery_parentdirs(self):
+        parentdirs = []
+        for toplevel in self._listdir_numeric(self.root):
+            topleveldir = join(self.root, str(toplevel))
+            for sublevel in self._listdir_numeric(topleveldir):
+                parentdirs.append(join(topleveldir, str(sublevel)))
+        return parentdirs
+
+
+class FsHierDedupDeliveryStore(FsHierDeliveryStore):
+    """ Content-addressed variant of :class:`FsHierDeliveryStore` that stores
+    each unique file only once.
+
+    Each file is stored once as a *blob* named by the SHA-256 digest of its
+    contents in ``<root>/blobs/``. The path used by
+    :class:`FsHierDeliveryStore` for each FileMeta is a hard link to the
+    blob, so the link count of a blob is its reference count, and it is
+    maintained atomically by the filesystem. The blob is removed when the
+    last FileMeta referring to it is removed.
+
+    Because the FileMeta paths are the same as in :class:`FsHierDeliveryStore`,
+    an existing FsHierDeliveryStore can be converted in place with the
+    ``devilry_deliverystore_dedup`` management command, and
+    :meth:`read_open` is just as cheap as in FsHierDeliveryStore.
+
+    Requires a filesystem with hard link support, and ``blobs/`` and
+    ``tmp/`` must be on the same filesystem as the rest of the store.
+    """
+
+    BLOBS_DIRNAME = 'blobs'
+    TMP_DIRNAME = 'tmp'
+
+    class FileWriter(object):
+        """ Writes to a temporary file while computing the digest, and moves
+        the file into place as a blob (or links to an existing blob) on
+        :meth:`close`. """
+        def __init__(self, store, filepath):
+            self.store = store
+            self.filepath = filepath
+            fd, self.tmppath = mkstemp(dir=store._get_tmpdir())
+            # mkstemp creates the file readable only by the owner. Use the
+            # same permissions as files written with open().
+            os.chmod(self.tmppath, 0644)
+            self.fileobj = os.fdopen(fd, 'wb')
+            self.checksum = sha256()
+
+        def write(self, s):
+            self.fileobj.write(s)
+            self.checksum.update(s)
+
+        def close(self):
+            self.fileobj.close()
+            self.store._commit_tmpfile(self.tmppath, self.checksum.hexdigest(),
+                                       self.filepath)
+
+    def _get_blobsdir(self):
+        return join(self.root, self.BLOBS_DIRNAME)
+
+    def _get_tmpdir(self):
+        tmpdir = join(self.root, self.TMP_DIRNAME)
+        if not exists(tmpdir):
+            try:
+                makedirs(tmpdir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return tmpdir
+
+    def get_blobpath(self, digest):
+        """ Get the path of the blob with the given hex digest. Blobs are
+        spread over 256 directories named by the first two characters of the
+        digest. """
+        return join(self._get_blobsdir(), digest[:2], digest)
+
+    def _link(self, blobpath, filepath):
+        dirpath = os.path.dirname(filepath)
+        if not exists(dirpath):
+            try:
+                makedirs(dirpath)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        if exists(filepath):
+            self._unlink(filepath)
+        os.link(blobpath, filepath)
+
+    def _commit_tmpfile(self, tmppath, digest, filepath):
+        """ Move ``tmppath`` into the store as the blob for ``digest`` (unless
+        the blob already exists), and link ``filepath`` to the blob. """
+        blobpath = self.get_blobpath(digest)
+        try:
+            self._link(blobpath, filepath)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            blobdir = os.path.dirname(blobpath)
+            if not exists(blobdir):
+                try:
+                    makedirs(blobdir)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+            os.rename(tmppath, blobpath)
+            self._link(blobpath, filepath)
+        else:
+            remove(tmppath)
+
+    def _unlink(self, filepath, digest=None):
+        """ Remove the link at ``filepath``, and the blob if this was the last
+        reference to it. ``digest`` is only needed when this is the last
+        reference, and it is computed from the file if not given. """
+        if os.stat(filepath).st_nlink == 2:
+            # Only the blob itself is left after we remove this link.
+            if digest is None:
+                digest = self.compute_digest(filepath)
+            blobpath = self.get_blobpath(digest)
+            remove(filepath)
+            if exists(blobpath) and os.stat(blobpath).st_nlink == 1:
+                remove(blobpath)
+        else:
+            remove(filepath)
+
+    def compute_digest(self, filepath, chunksize=65536):
+        """ Compute the hex SHA-256 digest of the file at ``filepath``. """
+        checksum = sha256()
+        f = open(filepath, 'rb')
+        try:
+            while True:
+                data = f.read(chunksize)
+                if not data:
+                    break
+                checksum.update(data)
+        finally:
+            f.close()
+        return checksum.hexdigest()
+
+    def deduplicate_file(self, filepath):
+        """ Convert a file written by :class:`FsHierDeliveryStore` in place.
+
+        If a blob with the same contents exists, ``filepath`` is replaced by
+        a link to it, otherwise ``filepath`` becomes the blob. Files that are
+        already linked to a blob are left alone.
+
+        :return: The number of bytes freed.
+        """
+        stat = os.stat(filepath)
+        if stat.st_nlink > 1:
+            return 0
+        digest = self.compute_digest(filepath)
+        blobpath = self.get_blobpath(digest)
+        if exists(blobpath):
+            # Link to a temporary name first, and rename over filepath so that
+            # the file is never missing.
+            fd, tmppath = mkstemp(dir=self._get_tmpdir())
+            os.close(fd)
+            remove(tmppath)
+            os.link(blobpath, tmppath)
+            os.rename(tmppath, filepath)
+            return stat.st_size
+        else:
+            blobdir = os.path.dirname(blobpath)
+            if not exists(blobdir):
+                makedirs(blobdir)
+            os.link(filepath, blobpath)
+            return 0
+
+    def get_freed_size(self, filepath, stat):
+        if stat.st_nlink <= 2:
+            # Either not linked to a blob, or the last link to the blob
+            return stat.st_size
+        else:
+            return 0
+
+    def remove_filepath(self, filepath):
+        stat = os.stat(filepath)
+        self._unlink(filepath)
+        return self.get_freed_size(filepath, stat)
+
+    def quarantine_filepath(self, filepath, targetpath):
+        """ Moving a link to a blob would leave the blob in the store, so the
+        contents are copied to ``targetpath``, and the link is removed like
+        in :meth:`remove_filepath`. """
+        stat = os.stat(filepath)
+        if stat.st_nlink == 1:
+            return super(FsHierDedupDeliveryStore, self).quarantine_filepath(filepath, targetpath)
+        targetdir = dirname(targetpath)
+        if not exists(targetdir):
+            makedirs(targetdir)
+        copy2(filepath, targetpath)
+        self._unlink(filepath)
+        return self.get_freed_size(filepath, stat)
+
+    def list_unreferenced_files(self, newest_allowed):
+        """ List the blobs without any links from the delivery directories
+        (left behind by interrupted writes or by removing files outside the
+        store), and the files in ``tmp/`` left behind by interrupted
+        writes. """
+        files = []
+        blobsdir = self._get_blobsdir()
+        if exists(blobsdir):
+            for prefix in sorted(os.listdir(blobsdir)):
+                prefixdir = join(blobsdir, prefix)
+                for filename in sorted(os.listdir(prefixdir)):
+                    filepath = join(prefixdir, filename)
+                    stat = os.stat(filepath)
+                    if stat.st_nlink == 1 and self.get_modified_time(stat) < newest_allowed:
+                        files.append((filepath, stat))
+        tmpdir = join(self.root, self.TMP_DIRNAME)
+        if exists(tmpdir):
+            for filename in sorted(os.listdir(tmpdir)):
+                filepath = join(tmpdir, filename)
+                stat = os.stat(filepath)
+                if self.get_modified_time(stat) < newest_allowed:
+                    files.append((filepath, stat))
+        return files
+
+    def write_open(self, filemeta_obj):
+        return FsHierDedupDeliveryStore.FileWriter(self,
+                self._get_filepath(filemeta_obj))
+
+    def remove(self, filemeta_obj):
+        filepath = self._get_filepath(filemeta_obj)
+        if not exists(filepath):
+            raise FileNotFoundError(filemeta_obj)
+        self._unlink(filepath, getattr(filemeta_obj, 'digest', None) or None)
+
 
 class DbmDeliveryStore(DeliveryStoreInterface):
     """Dbm DeliveryStore ONLY FOR TESTING."""
@@ -2,7 +2,7 @@ from abstract_is_admin import AbstractIsAdmin
 from abstract_is_examiner import AbstractIsExaminer
 from abstract_is_candidate import AbstractIsCandidate
 from basenode import BaseNode
-from node import Node
+from node import Node, NodeClosure
 from subject import Subject
 from period import Period, PeriodApplicationKeyValue
 from relateduser import RelatedExaminer, RelatedStudent, RelatedStudentKeyValue
@@ -15,9 +15,16 @@ from static_feedback import StaticFeedback
 from filemeta import FileMeta
 from devilryuserprofile import DevilryUserProfile
 from examiner import Examiner
+from searchtoken import SearchToken
+from effectiverole import EffectiveRole
 
 __all__ = ("AbstractIsAdmin", "AbstractIsExaminer", "AbstractIsCandidate",
-           "BaseNode", "Node", "Subject", "Period", 'RelatedExaminer', 'RelatedStudent',
+           "BaseNode", "Node", "NodeClosure", "Subject", "Period", 'RelatedExaminer', 'RelatedStudent',
            "RelatedStudentKeyValue", "Assignment", "AssignmentGroup",
            "AssignmentGroupTag", "Delivery", "Deadline", "Candidate", "StaticFeedback",
-           "FileMeta", "DevilryUserProfile", 'PeriodApplicationKeyValue', 'Examiner')
+           "FileMeta", "DevilryUserProfile", 'PeriodApplicationKeyValue', 'Examiner',
+           'SearchToken', 'EffectiveRole')
+
+# Connects the signal handlers keeping EffectiveRole up to date. Must be
+# imported after all the models it handles.
+import effectiverole_sync
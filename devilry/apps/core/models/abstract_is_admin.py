@@ -6,9 +6,10 @@ class AbstractIsAdmin(object):
     def q_is_admin(cls, user_obj):
         """
         Get a django.db.models.Q object matching all objects of this
-        type where the given user is admin. The matched result is not
-        guaranteed to contain unique items, so you should use distinct() on
-        the queryset if this is required.
+        type where the given user is admin. Implementations use a subquery
+        on :class:`devilry.apps.core.models.EffectiveRole` (or
+        :class:`devilry.apps.core.models.NodeClosure` for nodes) instead of
+        joins, so the matched result contains unique items.
 
         This must be implemented in all subclassed.
         """
@@ -17,7 +18,7 @@ class AbstractIsAdmin(object):
     @classmethod
     def where_is_admin(cls, user_obj, *related_fields):
         """ Get all objects of this type where the given user is admin. """
-        return cls.objects.select_related(*related_fields).filter(cls.q_is_admin(user_obj)).distinct()
+        return cls.objects.select_related(*related_fields).filter(cls.q_is_admin(user_obj))
 
     @classmethod
     def where_is_admin_or_superadmin(cls, user_obj, *related_fields):
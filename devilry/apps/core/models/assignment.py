@@ -7,7 +7,7 @@ from django.db.models import Q
 from django.contrib.auth.models import User
 
 from basenode import BaseNode
-from node import Node
+from effectiverole import EffectiveRole
 from period import Period
 from abstract_is_examiner import AbstractIsExaminer
 from abstract_is_candidate import AbstractIsCandidate
@@ -107,7 +107,7 @@ class Assignment(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate
 
     @classmethod
     def q_is_candidate(cls, user_obj):
-        return Q(assignmentgroups__candidates__student=user_obj)
+        return Q(pk__in=EffectiveRole.get_ids(user_obj, EffectiveRole.CANDIDATE, 'assignment'))
 
     def save(self, *args, **kwargs):
         if self.pk:
@@ -132,14 +132,22 @@ class Assignment(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(admins=user_obj) | \
-                Q(parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(pk__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
+
+    def is_admin(self, user_obj):
+        """ Check if the given user is admin on this assignment or any
+        parentnode, using :class:`EffectiveRole`.
+
+        :param user_obj: A django.contrib.auth.models.User_ object.
+        :rtype: bool
+        """
+        if not self.id:
+            return super(Assignment, self).is_admin(user_obj)
+        return EffectiveRole.has_role(user_obj, EffectiveRole.ADMIN, assignment=self)
 
     @classmethod
     def q_is_examiner(cls, user_obj):
-        return Q(assignmentgroups__examiners__user=user_obj)
+        return Q(pk__in=EffectiveRole.get_ids(user_obj, EffectiveRole.EXAMINER, 'assignment'))
 
     def clean(self, *args, **kwargs):
         """Validate the assignment.
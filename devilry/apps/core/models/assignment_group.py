@@ -1,11 +1,11 @@
 from datetime import datetime
 
 from django.utils.translation import ugettext as _
-from django.db.models import Q
+from django.db.models import Q, Max, Count
 from django.contrib.auth.models import User
 from django.db import models
 
-from node import Node
+from effectiverole import EffectiveRole
 from abstract_is_admin import AbstractIsAdmin
 from abstract_is_examiner import AbstractIsExaminer
 from assignment import Assignment
@@ -59,7 +59,33 @@ class AssignmentGroup(models.Model, AbstractIsAdmin, AbstractIsExaminer, Etag):
     .. attribute:: etag
 
        A DateTimeField containing the etag for this object.
+
+    .. attribute:: latest_delivery_id
+
+       The id of the last :class:`devilry.apps.core.models.Delivery` (by id)
+       on any of the deadlines on this group, or ``None``.
+
+    .. attribute:: latest_deadline_id
+
+       The id of the last :class:`devilry.apps.core.models.Deadline` (by
+       id) on this group, or ``None``.
+
+    .. attribute:: latest_deadline_deadline
+
+       The latest ``deadline`` of the deadlines on this group, or ``None``.
+
+    .. attribute:: number_of_deliveries
+
+       The number of deliveries on all the deadlines on this group.
+
+    The last four attributes are a denormalized summary of the deadlines
+    and deliveries, updated by :meth:`update_delivery_summary` when a
+    deadline or delivery is saved or deleted. :meth:`save` writes the
+    values loaded with the object, which may be out of date, so it
+    recalculates them afterwards.
     """
+    SUMMARY_FIELDS = ('latest_delivery_id', 'latest_deadline_id',
+                      'latest_deadline_deadline', 'number_of_deliveries')
 
     parentnode = models.ForeignKey(Assignment, related_name='assignmentgroups')
     name = models.CharField(max_length=30, blank=True, null=True,
@@ -71,6 +97,12 @@ class AssignmentGroup(models.Model, AbstractIsAdmin, AbstractIsExaminer, Etag):
             help_text = _('If this is checked, the group can add deliveries.'))
     feedback = models.OneToOneField("StaticFeedback", blank=True, null=True)
     etag = models.DateTimeField(auto_now_add=True)
+    latest_delivery_id = models.IntegerField(blank=True, null=True, editable=False)
+    latest_deadline_id = models.IntegerField(blank=True, null=True, editable=False)
+    latest_deadline_deadline = models.DateTimeField(blank=True, null=True, editable=False,
+                                                    db_index=True)
+    number_of_deliveries = models.PositiveIntegerField(default=0, editable=False,
+                                                       db_index=True)
 
     class Meta:
         app_label = 'core'
@@ -80,16 +112,66 @@ class AssignmentGroup(models.Model, AbstractIsAdmin, AbstractIsExaminer, Etag):
         create_dummy_deadline = False
         if self.id == None and self.parentnode.delivery_types == deliverytypes.NON_ELECTRONIC:
             create_dummy_deadline = True
+        existing = self.id != None
         super(AssignmentGroup, self).save(*args, **kwargs)
+        if existing:
+            # The summary may have been updated since this object was loaded
+            self.update_delivery_summary()
         if create_dummy_deadline:
             self.deadlines.create(deadline=self.parentnode.parentnode.end_time)
 
+    @classmethod
+    def _get_summary_aggregates(cls):
+        return {'latest_delivery_id': Max('deadlines__deliveries__id'),
+                'latest_deadline_id': Max('deadlines__id'),
+                'latest_deadline_deadline': Max('deadlines__deadline'),
+                'number_of_deliveries': Count('deadlines__deliveries')}
+
+    @classmethod
+    def _store_delivery_summary(cls, groupid):
+        summary = cls.objects.filter(id=groupid).aggregate(**cls._get_summary_aggregates())
+        cls.objects.filter(id=groupid).update(**summary)
+        return summary
+
+    def update_delivery_summary(self):
+        """ Recalculate :attr:`latest_delivery_id`, :attr:`latest_deadline_id`,
+        :attr:`latest_deadline_deadline` and :attr:`number_of_deliveries`, and
+        store them in the database without saving the other fields. """
+        summary = self._store_delivery_summary(self.id)
+        for fieldname, value in summary.iteritems():
+            setattr(self, fieldname, value)
+
+    @classmethod
+    def update_delivery_summaries(cls, groupids):
+        """ Same as :meth:`update_delivery_summary` for the groups with the
+        given ids, without loading the groups. ``None`` and ids of groups
+        that do not exist are ignored. """
+        for groupid in set(groupids):
+            if groupid != None:
+                cls._store_delivery_summary(groupid)
+
+    @classmethod
+    def rebuild_delivery_summaries(cls):
+        """ Recalculate the summary fields (see :meth:`update_delivery_summary`)
+        of all groups, and store the ones that have changed. Returns the
+        number of groups that were changed. """
+        # Annotations can not have the same names as the fields
+        aggregates = dict(('calculated_' + fieldname, aggregate) for fieldname, aggregate \
+                          in cls._get_summary_aggregates().iteritems())
+        fieldnames = list(cls.SUMMARY_FIELDS)
+        calculatednames = ['calculated_' + fieldname for fieldname in fieldnames]
+        changed = 0
+        rows = cls.objects.annotate(**aggregates).values('id', *(fieldnames + calculatednames))
+        for row in rows:
+            summary = dict((fieldname, row['calculated_' + fieldname]) for fieldname in fieldnames)
+            if summary != dict((fieldname, row[fieldname]) for fieldname in fieldnames):
+                cls.objects.filter(id=row['id']).update(**summary)
+                changed += 1
+        return changed
+
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     @classmethod
     def q_is_candidate(cls, user_obj):
@@ -5,7 +5,7 @@ from django.db.models import Q
 
 from model_utils import Etag
 from abstract_is_admin import AbstractIsAdmin
-from node import Node
+from effectiverole import EffectiveRole
 
 class Candidate(models.Model, Etag, AbstractIsAdmin):
     """
@@ -46,10 +46,7 @@ class Candidate(models.Model, Etag, AbstractIsAdmin):
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(assignment_group__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(assignment_group__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     def __unicode__(self):
         return self.identifier
@@ -10,7 +10,7 @@ from abstract_is_candidate import AbstractIsCandidate
 from assignment_group import AssignmentGroup
 from abstract_is_admin import AbstractIsAdmin
 
-from node import Node
+from effectiverole import EffectiveRole
 
 
 class Deadline(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCandidate):
@@ -100,10 +100,7 @@ class Deadline(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCand
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(assignment_group__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__parentnode__admins=user_obj) | \
-            Q(assignment_group__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(assignment_group__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     @classmethod
     def q_published(cls, old=True, active=True):
@@ -122,3 +119,20 @@ class Deadline(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCand
     @classmethod
     def q_is_examiner(cls, user_obj):
         return Q(assignment_group__examiners__user=user_obj)
+
+
+def deadline_pre_save_handler(sender, instance, **kwargs):
+    instance._summary_old_assignment_group = None
+    if instance.id != None:
+        old = Deadline.objects.filter(id=instance.id).values_list('assignment_group', flat=True)
+        if len(old) > 0:
+            instance._summary_old_assignment_group = old[0]
+
+def update_delivery_summary_handler(sender, instance, **kwargs):
+    AssignmentGroup.update_delivery_summaries([instance.assignment_group_id,
+                                               getattr(instance, '_summary_old_assignment_group', None)])
+
+from django.db.models.signals import pre_save, post_save, post_delete
+pre_save.connect(deadline_pre_save_handler, sender=Deadline)
+post_save.connect(update_delivery_summary_handler, sender=Deadline)
+post_delete.connect(update_delivery_summary_handler, sender=Deadline)
@@ -1,4 +1,6 @@
 from datetime import datetime
+from hashlib import sha256
+from zlib import crc32
 
 from django.utils.formats import date_format
 from django.utils.translation import ugettext as _
@@ -6,8 +8,10 @@ from django.db import models
 from django.db.models import Q, Max
 
 from deadline import Deadline
+from assignment_group import AssignmentGroup
 from filemeta import FileMeta
-from . import AbstractIsAdmin, AbstractIsExaminer, AbstractIsCandidate, Node
+from . import AbstractIsAdmin, AbstractIsExaminer, AbstractIsCandidate
+from effectiverole import EffectiveRole
 import deliverytypes
 
 
@@ -120,17 +124,16 @@ class Delivery(models.Model, AbstractIsAdmin, AbstractIsCandidate, AbstractIsExa
     
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(deadline__assignment_group__parentnode__admins=user_obj) | \
-                Q(deadline__assignment_group__parentnode__parentnode__admins=user_obj) | \
-                Q(deadline__assignment_group__parentnode__parentnode__parentnode__admins=user_obj) | \
-                Q(deadline__assignment_group__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(deadline__assignment_group__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     @classmethod
     def q_is_examiner(cls, user_obj):
         return Q(deadline__assignment_group__examiners__user=user_obj)
 
     def add_file(self, filename, iterable_data):
-        """ Add a file to the delivery.
+        """ Add a file to the delivery. The size, SHA-256 digest and CRC-32
+        of the file is computed while writing, and stored in the returned
+        :class:`FileMeta`.
 
         :param filename:
             A filename as defined in :class:`FileMeta`.
@@ -145,10 +148,16 @@ class Delivery(models.Model, AbstractIsAdmin, AbstractIsCandidate, AbstractIsExa
         filemeta.save()
         f = FileMeta.deliverystore.write_open(filemeta)
         filemeta.save()
+        checksum = sha256()
+        crc = 0
         for data in iterable_data:
             f.write(data)
+            checksum.update(data)
+            crc = crc32(data, crc)
             filemeta.size += len(data)
         f.close()
+        filemeta.digest = checksum.hexdigest()
+        filemeta.crc32 = crc & 0xffffffff
         filemeta.save()
         return filemeta
 
@@ -168,3 +177,28 @@ class Delivery(models.Model, AbstractIsAdmin, AbstractIsCandidate, AbstractIsExa
     def __unicode__(self):
         return u'%s - %s (%s)' % (self.deadline.assignment_group, self.number,
                 date_format(self.time_of_delivery, "DATETIME_FORMAT"))
+
+
+def _get_assignment_group_id(deadlineid):
+    groupids = Deadline.objects.filter(id=deadlineid).values_list('assignment_group', flat=True)
+    if len(groupids) > 0:
+        return groupids[0]
+    return None
+
+def delivery_pre_save_handler(sender, instance, **kwargs):
+    instance._summary_old_deadline = None
+    if instance.id != None:
+        old = Delivery.objects.filter(id=instance.id).values_list('deadline', flat=True)
+        if len(old) > 0:
+            instance._summary_old_deadline = old[0]
+
+def update_delivery_summary_handler(sender, instance, **kwargs):
+    deadlineids = set([instance.deadline_id,
+                       getattr(instance, '_summary_old_deadline', None)])
+    AssignmentGroup.update_delivery_summaries(_get_assignment_group_id(deadlineid) \
+                                              for deadlineid in deadlineids)
+
+from django.db.models.signals import pre_save, post_save, post_delete
+pre_save.connect(delivery_pre_save_handler, sender=Delivery)
+post_save.connect(update_delivery_summary_handler, sender=Delivery)
+post_delete.connect(update_delivery_summary_handler, sender=Delivery)
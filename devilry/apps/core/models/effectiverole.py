@@ -0,0 +1,90 @@
+from django.utils.translation import ugettext as _
+from django.contrib.auth.models import User
+from django.db import models
+
+
+class EffectiveRole(models.Model):
+    """
+    The effective roles of users on subjects, periods and assignments. This
+    is a denormalized copy of the admins of the nodes, subjects, periods and
+    assignments, and of the examiners and candidates on assignment groups,
+    which makes it possible to find the objects where a user has a role with
+    one indexed subquery instead of joining every level of the hierarchy.
+
+    The rows are kept up to date by the signal handlers in
+    :mod:`devilry.apps.core.models.effectiverole_sync`. Run the
+    ``devilry_rebuild_effective_roles`` management command if admins,
+    examiners or candidates are changed without signals (such as with SQL).
+
+    Admin rows are stored for each subject, period and assignment where the
+    user is admin (on the object itself or on any of its parents), with
+    only the foreign key to that object set. Examiner and candidate rows
+    are stored for each assignment where the user is examiner or candidate
+    on a group, with only :attr:`assignment` set. Being examiner or
+    candidate on an assignment makes the user examiner or candidate on its
+    period and subject, so those are found through the assignments (such
+    as in :meth:`devilry.apps.core.models.Subject.q_is_examiner`).
+
+    Each role is stored once (``unique_together``). Since only one of the
+    foreign keys is set on each row, the database update script also
+    creates a unique index for each of them, which is what prevents
+    duplicates when roles are refreshed concurrently.
+
+    .. attribute:: user
+
+        A django.db.models.ForeignKey_ that points to the user.
+
+    .. attribute:: role
+
+        One of :attr:`ADMIN`, :attr:`EXAMINER` and :attr:`CANDIDATE`.
+
+    .. attribute:: subject
+
+        A django.db.models.ForeignKey_ that points to a
+        :class:`devilry.apps.core.models.Subject`, or ``None``.
+
+    .. attribute:: period
+
+        A django.db.models.ForeignKey_ that points to a
+        :class:`devilry.apps.core.models.Period`, or ``None``.
+
+    .. attribute:: assignment
+
+        A django.db.models.ForeignKey_ that points to a
+        :class:`devilry.apps.core.models.Assignment`, or ``None``.
+    """
+    ADMIN = 'admin'
+    EXAMINER = 'examiner'
+    CANDIDATE = 'candidate'
+
+    user = models.ForeignKey(User)
+    role = models.CharField(max_length=10,
+                            choices=((ADMIN, _('Administrator')),
+                                     (EXAMINER, _('Examiner')),
+                                     (CANDIDATE, _('Candidate'))))
+    subject = models.ForeignKey('Subject', null=True)
+    period = models.ForeignKey('Period', null=True)
+    assignment = models.ForeignKey('Assignment', null=True)
+
+    class Meta:
+        app_label = 'core'
+        unique_together = ('user', 'role', 'subject', 'period', 'assignment')
+
+    @classmethod
+    def get_ids(cls, user_obj, role, fieldname):
+        """ Get a ``values_list`` queryset with the ids of the objects where
+        ``user_obj`` has ``role``. Use this in ``__in`` lookups to get a
+        subquery instead of an extra query.
+
+        :param fieldname: ``'subject'``, ``'period'`` or ``'assignment'``.
+        """
+        return cls.objects.filter(**{'user': user_obj,
+                                     'role': role,
+                                     fieldname + '__isnull': False})\
+                .values_list(fieldname, flat=True)
+
+    @classmethod
+    def has_role(cls, user_obj, role, **kwargs):
+        """ Check if ``user_obj`` has ``role`` on the object given as a
+        keyword argument, such as ``subject=subject_obj``. """
+        return cls.objects.filter(user=user_obj, role=role, **kwargs).exists()
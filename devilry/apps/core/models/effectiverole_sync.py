@@ -0,0 +1,234 @@
+"""
+Keep :class:`devilry.apps.core.models.EffectiveRole` up to date.
+
+This module is imported at the end of :mod:`devilry.apps.core.models`,
+since the signal handlers need all the core models, and the other core
+models need :class:`EffectiveRole`. Refreshing the roles of a user also
+invalidates the cached authorization checks of the user (see
+:mod:`devilry.apps.core.authcontext`).
+"""
+from django.db import connection, transaction
+from django.db.models.signals import (pre_save, post_save, pre_delete,
+                                      post_delete, m2m_changed)
+
+from node import Node
+from subject import Subject
+from period import Period
+from assignment import Assignment
+from assignment_group import AssignmentGroup
+from candidate import Candidate
+from examiner import Examiner
+from effectiverole import EffectiveRole
+from ..authcontext import invalidate_user, invalidate_all
+
+
+BATCH_SIZE = 500
+
+#: The paths from each level to the users that are admin on the level.
+#: Node admins are found through the :class:`NodeClosure` of the node
+#: containing the subject.
+ADMIN_PATHS = (
+    ('subject', Subject, ('admins',
+                          'parentnode__ancestor_links__ancestor__admins')),
+    ('period', Period, ('admins',
+                        'parentnode__admins',
+                        'parentnode__parentnode__ancestor_links__ancestor__admins')),
+    ('assignment', Assignment, ('admins',
+                                'parentnode__admins',
+                                'parentnode__parentnode__admins',
+                                'parentnode__parentnode__parentnode__ancestor_links__ancestor__admins')))
+
+#: The role, and the path from AssignmentGroup to the user, of examiners
+#: and candidates.
+MEMBER_PATHS = ((EffectiveRole.EXAMINER, 'examiners__user'),
+                (EffectiveRole.CANDIDATE, 'candidates__student'))
+
+
+def _insert_roles(role, fieldname, rows):
+    """ Insert a role for each ``(user id, object id)`` in ``rows``. """
+    rows = [(userid, role, objectid) for userid, objectid in rows]
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    sql = 'INSERT INTO {table} ({user}, {role}, {field}) VALUES (%s, %s, %s)'.format(
+        table=qn(EffectiveRole._meta.db_table),
+        user=qn('user_id'),
+        role=qn('role'),
+        field=qn(fieldname + '_id'))
+    cursor = connection.cursor()
+    for start in xrange(0, len(rows), BATCH_SIZE):
+        cursor.executemany(sql, rows[start:start+BATCH_SIZE])
+    transaction.commit_unless_managed()
+
+
+def refresh_admin_roles(subjects=None, periods=None, assignments=None, user=None):
+    """ Recompute the admin roles on the given querysets of subjects,
+    periods and assignments, and on all periods and assignments within
+    them. If ``user`` is given, only the roles of that user are
+    recomputed. """
+    levels = {'subject': subjects,
+              'period': periods,
+              'assignment': assignments}
+    if subjects is not None:
+        subperiods = Period.objects.filter(parentnode__in=subjects.values('pk'))
+        levels['period'] = subperiods if periods is None else periods | subperiods
+    if levels['period'] is not None:
+        subassignments = Assignment.objects.filter(parentnode__in=levels['period'].values('pk'))
+        levels['assignment'] = subassignments if assignments is None else assignments | subassignments
+    for fieldname, modelcls, paths in ADMIN_PATHS:
+        qryset = levels[fieldname]
+        if qryset is None:
+            continue
+        roles = EffectiveRole.objects.filter(role=EffectiveRole.ADMIN,
+                                             **{fieldname + '__in': qryset.values('pk')})
+        if user:
+            roles = roles.filter(user=user)
+        roles.delete()
+        rows = set()
+        for path in paths:
+            if user:
+                rows.update((user.id, objectid) for objectid in \
+                            qryset.filter(**{path: user}).values_list('pk', flat=True))
+            else:
+                rows.update(qryset.values_list(path, 'pk'))
+        _insert_roles(EffectiveRole.ADMIN, fieldname,
+                      [row for row in rows if row[0] is not None])
+    if user:
+        invalidate_user(user.id)
+    else:
+        invalidate_all()
+
+
+def refresh_admin_roles_for_user(user):
+    """ Recompute all the admin roles of ``user``. """
+    refresh_admin_roles(Subject.objects.all(), Period.objects.all(),
+                        Assignment.objects.all(), user=user)
+
+
+def refresh_admin_roles_within_node(node):
+    """ Recompute the admin roles on all subjects, periods and assignments
+    within ``node`` or any of its childnodes. """
+    refresh_admin_roles(Subject.objects.filter(parentnode__ancestor_links__ancestor=node))
+
+
+def refresh_member_roles(assignments):
+    """ Recompute the examiner and candidate roles on the given queryset of
+    assignments. """
+    for role, path in MEMBER_PATHS:
+        EffectiveRole.objects.filter(role=role, assignment__in=assignments.values('pk')).delete()
+        groups = AssignmentGroup.objects.filter(parentnode__in=assignments.values('pk'))
+        rows = set(groups.values_list(path, 'parentnode'))
+        _insert_roles(role, 'assignment',
+                      [row for row in rows if row[0] is not None])
+    invalidate_all()
+
+
+def refresh_member_role(role, userid, assignmentid):
+    """ Recompute the examiner or candidate role of a single user on a
+    single assignment. """
+    EffectiveRole.objects.filter(role=role, user=userid, assignment=assignmentid).delete()
+    path = dict(MEMBER_PATHS)[role]
+    if AssignmentGroup.objects.filter(parentnode=assignmentid, **{path: userid}).exists():
+        EffectiveRole.objects.create(role=role, user_id=userid, assignment_id=assignmentid)
+    invalidate_user(userid)
+
+
+def rebuild():
+    """ Rebuild all effective roles. """
+    EffectiveRole.objects.all().delete()
+    refresh_admin_roles(Subject.objects.all())
+    refresh_member_roles(Assignment.objects.all())
+
+
+def _get_old_parentnode(sender, instance):
+    if instance.id is None:
+        return None
+    old = sender.objects.filter(id=instance.id).values_list('parentnode', flat=True)
+    if len(old) > 0:
+        return old[0]
+    return None
+
+def basenode_pre_save_handler(sender, instance, **kwargs):
+    instance._effectiverole_old_parentnode = _get_old_parentnode(sender, instance)
+
+def node_post_save_handler(sender, instance, created, **kwargs):
+    if not created and instance._effectiverole_old_parentnode != instance.parentnode_id:
+        refresh_admin_roles_within_node(instance)
+
+def basenode_post_save_handler(sender, instance, created, **kwargs):
+    if created or instance._effectiverole_old_parentnode != instance.parentnode_id:
+        fieldname = sender.__name__.lower()
+        refresh_admin_roles(**{fieldname + 's': sender.objects.filter(id=instance.id)})
+
+def admins_changed_handler(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # ``instance`` is the user
+        refresh_admin_roles_for_user(instance)
+    elif isinstance(instance, Node):
+        refresh_admin_roles_within_node(instance)
+    else:
+        fieldname = type(instance).__name__.lower()
+        refresh_admin_roles(**{fieldname + 's': type(instance).objects.filter(id=instance.id)})
+
+def assignmentgroup_pre_save_handler(sender, instance, **kwargs):
+    instance._effectiverole_old_parentnode = _get_old_parentnode(sender, instance)
+
+def assignmentgroup_post_save_handler(sender, instance, created, **kwargs):
+    oldparentnode = instance._effectiverole_old_parentnode
+    if not created and oldparentnode != instance.parentnode_id:
+        refresh_member_roles(Assignment.objects.filter(id__in=[oldparentnode,
+                                                               instance.parentnode_id]))
+
+def _get_member_key(instance):
+    """ Get ``(role, user id, assignment id)`` for an Examiner or Candidate,
+    or ``None`` if the group does not exist. """
+    if isinstance(instance, Examiner):
+        role, userid, groupid = EffectiveRole.EXAMINER, instance.user_id, instance.assignmentgroup_id
+    else:
+        role, userid, groupid = EffectiveRole.CANDIDATE, instance.student_id, instance.assignment_group_id
+    assignmentids = AssignmentGroup.objects.filter(id=groupid).values_list('parentnode', flat=True)
+    if len(assignmentids) == 0:
+        return None
+    return role, userid, assignmentids[0]
+
+def member_pre_save_handler(sender, instance, **kwargs):
+    instance._effectiverole_old_key = None
+    if instance.id is not None:
+        old = list(sender.objects.filter(id=instance.id))
+        if len(old) > 0:
+            instance._effectiverole_old_key = _get_member_key(old[0])
+
+def member_post_save_handler(sender, instance, **kwargs):
+    newkey = _get_member_key(instance)
+    oldkey = instance._effectiverole_old_key
+    if oldkey and oldkey != newkey:
+        refresh_member_role(*oldkey)
+    if newkey:
+        refresh_member_role(*newkey)
+
+def member_pre_delete_handler(sender, instance, **kwargs):
+    instance._effectiverole_old_key = _get_member_key(instance)
+
+def member_post_delete_handler(sender, instance, **kwargs):
+    if instance._effectiverole_old_key:
+        refresh_member_role(*instance._effectiverole_old_key)
+
+
+# The Node handlers must be connected after the NodeClosure handlers in
+# node.py, since they use the closure of the moved node.
+pre_save.connect(basenode_pre_save_handler, sender=Node)
+post_save.connect(node_post_save_handler, sender=Node)
+for modelcls in (Subject, Period, Assignment):
+    pre_save.connect(basenode_pre_save_handler, sender=modelcls)
+    post_save.connect(basenode_post_save_handler, sender=modelcls)
+for modelcls in (Node, Subject, Period, Assignment):
+    m2m_changed.connect(admins_changed_handler, sender=modelcls.admins.through)
+pre_save.connect(assignmentgroup_pre_save_handler, sender=AssignmentGroup)
+post_save.connect(assignmentgroup_post_save_handler, sender=AssignmentGroup)
+for modelcls in (Examiner, Candidate):
+    pre_save.connect(member_pre_save_handler, sender=modelcls)
+    post_save.connect(member_post_save_handler, sender=modelcls)
+    pre_delete.connect(member_pre_delete_handler, sender=modelcls)
+    post_delete.connect(member_post_delete_handler, sender=modelcls)
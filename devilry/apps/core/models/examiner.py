@@ -3,7 +3,7 @@ from django.db import models
 from django.db.models import Q
 
 from abstract_is_admin import AbstractIsAdmin
-from node import Node
+from effectiverole import EffectiveRole
 
 class Examiner(models.Model, AbstractIsAdmin):
     """
@@ -26,7 +26,4 @@ class Examiner(models.Model, AbstractIsAdmin):
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(assignmentgroup__parentnode__admins=user_obj) | \
-            Q(assignmentgroup__parentnode__parentnode__admins=user_obj) | \
-            Q(assignmentgroup__parentnode__parentnode__parentnode__admins=user_obj) | \
-            Q(assignmentgroup__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(assignmentgroup__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
@@ -2,7 +2,7 @@ from django.db import models
 from django.utils.translation import ugettext as _
 from django.db.models import Q
 
-from node import Node
+from effectiverole import EffectiveRole
 from abstract_is_admin import AbstractIsAdmin
 from abstract_is_examiner import AbstractIsExaminer
 from abstract_is_candidate import AbstractIsCandidate
@@ -47,6 +47,18 @@ class FileMeta(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCand
 
         Size of the file in bytes.
 
+    .. attribute:: digest
+
+        Hex encoded SHA-256 digest of the file contents. Computed by
+        :meth:`devilry.apps.core.models.Delivery.add_file`. Empty for files
+        added before the digest was recorded.
+
+    .. attribute:: crc32
+
+        The CRC-32 of the file contents (the checksum used in ZIP archives).
+        Computed by :meth:`devilry.apps.core.models.Delivery.add_file`.
+        ``None`` for files added before the checksum was recorded.
+
     .. attribute:: deliverystore
 
         The current :ref:`DeliveryStore <devilry.apps.core.deliverystore>`.
@@ -55,6 +67,10 @@ class FileMeta(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCand
     delivery = models.ForeignKey("core.Delivery", related_name='filemetas')
     filename = models.CharField(max_length=255, help_text=_('Name of the file.'))
     size = models.IntegerField(help_text=_('Size of the file in bytes.'))
+    digest = models.CharField(max_length=64, blank=True, default='',
+                              help_text=_('Hex encoded SHA-256 digest of the file contents.'))
+    crc32 = models.BigIntegerField(blank=True, null=True, default=None,
+                                   help_text=_('CRC-32 of the file contents.'))
 
     deliverystore = load_deliverystore_backend()
 
@@ -85,10 +101,7 @@ class FileMeta(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCand
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(delivery__deadline__assignment_group__parentnode__admins=user_obj) | \
-            Q(delivery__deadline__assignment_group__parentnode__parentnode__admins=user_obj) | \
-            Q(delivery__deadline__assignment_group__parentnode__parentnode__parentnode__admins=user_obj) | \
-            Q(delivery__deadline__assignment_group__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(delivery__deadline__assignment_group__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     def __unicode__(self):
         return self.filename
@@ -99,9 +112,9 @@ def filemeta_deleted_handler(sender, **kwargs):
     try:
         filemeta.deliverystore.remove(filemeta)
     except FileNotFoundError, e:
-        # TODO: We should have some way of cleaning files which have no
-        # corresponding FileMeta from DeliveryStores (could happen if the
-        # disk is not mounted when this kicks in..
+        # Files which are left without a corresponding FileMeta (could happen
+        # if the disk is not mounted when this kicks in) are cleaned up by the
+        # devilry_deliverystore_gc management command.
         pass
 
 
@@ -3,6 +3,7 @@ from django.core.exceptions import ValidationError
 from django.db.models import Q
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import pre_save, post_save
 
 from basenode import BaseNode
 from custom_db_fields import ShortNameField, LongNameField
@@ -59,20 +60,34 @@ class Node(models.Model, BaseNode, Etag):
             return False
 
     def get_path(self):
-        if self.parentnode:
-            return self.parentnode.get_path() + "." + self.short_name
+        if self.parentnode_id:
+            ancestors = NodeClosure.objects.filter(descendant=self.parentnode_id)\
+                    .order_by('-depth').values_list('ancestor__short_name', flat=True)
+            return '.'.join(list(ancestors) + [self.short_name])
         else:
             return self.short_name
 
+    def is_admin(self, user_obj):
+        """ Check if the given user is admin on this node or any parentnode.
+
+        :param user_obj: A django.contrib.auth.models.User_ object.
+        :rtype: bool
+        """
+        if not self.id:
+            return super(Node, self).is_admin(user_obj)
+        return NodeClosure.objects.filter(descendant=self,
+                                          ancestor__admins=user_obj).count() > 0
+
     def iter_childnodes(self):
         """
-        Recursively iterates over all child nodes, and their child nodes.
-        For a list of direct child nodes, use atribute child_nodes instead.
+        Recursively iterates over all child nodes, and their child nodes,
+        ordered by depth. For a list of direct child nodes, use atribute
+        child_nodes instead.
         """
-        for node in Node.objects.filter(parentnode=self):
-            yield node
-            for c in node.iter_childnodes():
-                yield c
+        links = NodeClosure.objects.filter(ancestor=self, depth__gt=0)\
+                .select_related('descendant').order_by('depth', 'descendant__short_name')
+        for link in links:
+            yield link.descendant
 
     def clean(self, *args, **kwargs):
         """Validate the node, making sure it does not do something stupid.
@@ -105,8 +120,9 @@ class Node(models.Model, BaseNode, Etag):
                    filter(parentnode=None).count() > greater_than_count:
                 raise ValidationError(_('A root node can not have the same '\
                                         'short name as another root node.'))
-        for node in self.iter_childnodes():
-            if node == self.parentnode:
+        if self.id != None and self.parentnode_id != None:
+            if NodeClosure.objects.filter(ancestor=self.id,
+                                          descendant=self.parentnode_id).count() > 0:
                 raise ValidationError(_('A node can not be the child of one of it\'s own children.'))
         super(Node, self).clean(*args, **kwargs)
 
@@ -114,15 +130,103 @@ class Node(models.Model, BaseNode, Etag):
     def _get_nodepks_where_isadmin(cls, user_obj):
         """ Get a list with the primary key of all nodes where the given
         `user_obj` is admin. """
-        admnodes = Node.objects.filter(admins=user_obj)
-        l = []
-        def add_admnodes(admnodes):
-            for a in admnodes.all():
-                l.append(a.pk)
-                add_admnodes(a.child_nodes)
-        add_admnodes(admnodes)
-        return l
+        return list(cls._get_nodepks_where_isadmin_qry(user_obj))
+
+    @classmethod
+    def _get_nodepks_where_isadmin_qry(cls, user_obj):
+        """ Same as :meth:`_get_nodepks_where_isadmin`, but returns a
+        ``values_list`` queryset. Use this in ``pk__in`` lookups to get a
+        subquery instead of an extra query. """
+        return NodeClosure.objects.filter(ancestor__admins=user_obj)\
+                .values_list('descendant', flat=True).distinct()
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(pk__in=cls._get_nodepks_where_isadmin(user_obj))
+        return Q(pk__in=cls._get_nodepks_where_isadmin_qry(user_obj))
+
+
+class NodeClosure(models.Model):
+    """
+    The closure of the :class:`Node` hierarchy: one row for each node and
+    each of its ancestors, including a row where the node is its own
+    ancestor. This makes it possible to find all the ancestors or all the
+    descendants of a node, such as the nodes where a user is admin, in one
+    query.
+
+    The rows are kept up to date by signal handlers when nodes are saved.
+    Run the ``devilry_rebuild_node_closure`` management command if nodes
+    are changed without signals (such as with SQL).
+
+    .. attribute:: ancestor
+
+        A django.db.models.ForeignKey_ that points to the ancestor `Node`_.
+
+    .. attribute:: descendant
+
+        A django.db.models.ForeignKey_ that points to the descendant `Node`_.
+
+    .. attribute:: depth
+
+        The number of levels between ``ancestor`` and ``descendant``. ``0``
+        for the row where they are the same node.
+    """
+    ancestor = models.ForeignKey(Node, related_name='descendant_links')
+    descendant = models.ForeignKey(Node, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        app_label = 'core'
+        unique_together = ('ancestor', 'descendant')
+
+    @classmethod
+    def _add_links(cls, nodeid, parentnodeid, subtree):
+        """ Link the ``subtree`` (a list of ``(descendant id, depth)``
+        tuples for a node and its descendants) to the node with id
+        ``parentnodeid`` and all its ancestors. """
+        if parentnodeid is None:
+            return
+        ancestors = [(parentnodeid, 0)]
+        ancestors += cls.objects.filter(descendant=parentnodeid, depth__gt=0)\
+                .values_list('ancestor', 'depth')
+        for ancestorid, ancestordepth in ancestors:
+            for descendantid, descendantdepth in subtree:
+                cls.objects.create(ancestor_id=ancestorid, descendant_id=descendantid,
+                                   depth=ancestordepth + descendantdepth + 1)
+
+    @classmethod
+    def rebuild(cls):
+        """ Rebuild the closure of all nodes. """
+        cls.objects.all().delete()
+        parents = dict(Node.objects.values_list('id', 'parentnode'))
+        for nodeid in parents:
+            ancestorid = nodeid
+            depth = 0
+            while ancestorid is not None:
+                cls.objects.create(ancestor_id=ancestorid, descendant_id=nodeid, depth=depth)
+                ancestorid = parents[ancestorid]
+                depth += 1
+
+
+def node_pre_save_handler(sender, instance, **kwargs):
+    instance._closure_old_parentnode = None
+    instance._closure_created = True
+    if instance.id != None:
+        old = Node.objects.filter(id=instance.id).values_list('parentnode', flat=True)
+        if len(old) > 0:
+            instance._closure_old_parentnode = old[0]
+            instance._closure_created = False
+
+def node_post_save_handler(sender, instance, **kwargs):
+    if instance._closure_created:
+        NodeClosure.objects.create(ancestor=instance, descendant=instance, depth=0)
+        NodeClosure._add_links(instance.id, instance.parentnode_id, [(instance.id, 0)])
+    elif instance._closure_old_parentnode != instance.parentnode_id:
+        subtree = list(NodeClosure.objects.filter(ancestor=instance)\
+                       .values_list('descendant', 'depth'))
+        subtreeids = [descendantid for descendantid, depth in subtree]
+        NodeClosure.objects.filter(descendant__in=subtreeids)\
+                .exclude(ancestor__in=subtreeids).delete()
+        NodeClosure._add_links(instance.id, instance.parentnode_id, subtree)
+
+pre_save.connect(node_pre_save_handler, sender=Node)
+post_save.connect(node_post_save_handler, sender=Node)
@@ -10,7 +10,7 @@ from abstract_is_examiner import AbstractIsExaminer
 from abstract_is_candidate import AbstractIsCandidate
 from custom_db_fields import ShortNameField, LongNameField
 from basenode import BaseNode
-from node import Node
+from effectiverole import EffectiveRole
 from subject import Subject
 from model_utils import *
 from model_utils import Etag
@@ -96,13 +96,22 @@ class Period(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate, Et
     #TODO delete this?
     @classmethod
     def q_is_candidate(cls, user_obj):
-        return Q(assignments__assignmentgroups__candidates__student=user_obj)
+        return Q(assignments__in=EffectiveRole.get_ids(user_obj, EffectiveRole.CANDIDATE, 'assignment'))
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(admins=user_obj) | \
-                Q(parentnode__admins=user_obj) | \
-                Q(parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(pk__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'period'))
+
+    def is_admin(self, user_obj):
+        """ Check if the given user is admin on this period or any
+        parentnode, using :class:`EffectiveRole`.
+
+        :param user_obj: A django.contrib.auth.models.User_ object.
+        :rtype: bool
+        """
+        if not self.id:
+            return super(Period, self).is_admin(user_obj)
+        return EffectiveRole.has_role(user_obj, EffectiveRole.ADMIN, period=self)
 
     #TODO delete this?
     #@classmethod
@@ -151,7 +160,7 @@ class Period(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate, Et
 
     @classmethod
     def q_is_examiner(cls, user_obj):
-        return Q(assignments__assignmentgroups__examiners__user=user_obj)
+        return Q(assignments__in=EffectiveRole.get_ids(user_obj, EffectiveRole.EXAMINER, 'assignment'))
 
 
     @classmethod
@@ -174,9 +183,7 @@ class PeriodApplicationKeyValue(AbstractApplicationKeyValue, AbstractIsAdmin):
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(period__admins=user_obj) | \
-                Q(period__parentnode__admins=user_obj) | \
-                Q(period__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(period__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'period'))
 
     def __unicode__(self):
         return '{0}: {1}'.format(self.period, super(AbstractApplicationKeyValue, self).__unicode__())
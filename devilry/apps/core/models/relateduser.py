@@ -6,7 +6,7 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
 from period import Period
-from node import Node
+from effectiverole import EffectiveRole
 from abstract_is_admin import AbstractIsAdmin
 from abstract_applicationkeyvalue import AbstractApplicationKeyValue
 
@@ -27,9 +27,7 @@ class RelatedUserBase(models.Model, AbstractIsAdmin):
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(period__admins=user_obj) | \
-                Q(period__parentnode__admins=user_obj) | \
-                Q(period__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(period__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'period'))
 
     def clean(self):
         if self.tags and not self.tags_patt.match(self.tags):
@@ -62,9 +60,7 @@ class RelatedStudentKeyValue(AbstractApplicationKeyValue, AbstractIsAdmin):
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(relatedstudent__period__admins=user_obj) | \
-                Q(relatedstudent__period__parentnode__admins=user_obj) | \
-                Q(relatedstudent__period__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(relatedstudent__period__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'period'))
 
     def __unicode__(self):
         return '{0}: {1}'.format(self.relatedstudent, super(RelatedStudentKeyValue, self).__unicode__())
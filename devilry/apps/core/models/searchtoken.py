@@ -0,0 +1,36 @@
+from django.db import models
+from django.contrib.contenttypes.models import ContentType
+
+
+class SearchToken(models.Model):
+    """ A token in the search index used by free-text queries in the
+    simplified API (see :mod:`devilry.simplified.searchindex`).
+
+    .. attribute:: content_type
+
+        The model of the indexed object.
+
+    .. attribute:: object_id
+
+        The primary key of the indexed object.
+
+    .. attribute:: fieldname
+
+        The searchfield (a field name or a ``__`` path) containing the token.
+
+    .. attribute:: token
+
+        A lowercase suffix of a word in the field, starting at the word or
+        at a run of letters or digits in the word. The tokens of a field
+        starting with a query word are the tokens of the words where a run
+        of letters or digits starts with the query word.
+    """
+    MAX_LENGTH = 50
+
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField(db_index=True)
+    fieldname = models.CharField(max_length=200)
+    token = models.CharField(max_length=MAX_LENGTH, db_index=True)
+
+    class Meta:
+        app_label = 'core'
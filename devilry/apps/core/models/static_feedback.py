@@ -9,7 +9,7 @@ from abstract_is_admin import AbstractIsAdmin
 from abstract_is_examiner import AbstractIsExaminer
 from abstract_is_candidate import AbstractIsCandidate
 from delivery import Delivery
-from node import Node
+from effectiverole import EffectiveRole
 
 class StaticFeedback(models.Model, AbstractIsAdmin, AbstractIsExaminer, AbstractIsCandidate):
     """ Represents a feedback for a `Delivery`_.
@@ -82,10 +82,7 @@ class StaticFeedback(models.Model, AbstractIsAdmin, AbstractIsExaminer, Abstract
 
     @classmethod
     def q_is_admin(cls, user_obj):
-        return Q(delivery__deadline__assignment_group__parentnode__admins=user_obj) | \
-                Q(delivery__deadline__assignment_group__parentnode__parentnode__admins=user_obj) | \
-                Q(delivery__deadline__assignment_group__parentnode__parentnode__parentnode__admins=user_obj) | \
-                Q(delivery__deadline__assignment_group__parentnode__parentnode__parentnode__parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(delivery__deadline__assignment_group__parentnode__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'assignment'))
 
     @classmethod
     def q_is_candidate(cls, user_obj):
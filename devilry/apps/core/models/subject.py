@@ -10,6 +10,7 @@ from abstract_is_candidate import AbstractIsCandidate
 from custom_db_fields import ShortNameField, LongNameField
 from basenode import BaseNode
 from node import Node
+from effectiverole import EffectiveRole
 from model_utils import Etag, EtagMismatchException
 
 class Subject(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate, Etag):
@@ -57,8 +58,18 @@ class Subject(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate, E
 
     @classmethod
     def q_is_admin(cls, user_obj):
-            return Q(admins__pk=user_obj.pk) \
-                | Q(parentnode__pk__in=Node._get_nodepks_where_isadmin(user_obj))
+        return Q(pk__in=EffectiveRole.get_ids(user_obj, EffectiveRole.ADMIN, 'subject'))
+
+    def is_admin(self, user_obj):
+        """ Check if the given user is admin on this subject or any
+        parentnode, using :class:`EffectiveRole`.
+
+        :param user_obj: A django.contrib.auth.models.User_ object.
+        :rtype: bool
+        """
+        if not self.id:
+            return super(Subject, self).is_admin(user_obj)
+        return EffectiveRole.has_role(user_obj, EffectiveRole.ADMIN, subject=self)
 
     def get_path(self):
         """ Only returns :attr:`short_name` for subject since it is
@@ -81,10 +92,10 @@ class Subject(models.Model, BaseNode, AbstractIsExaminer, AbstractIsCandidate, E
 
     @classmethod
     def q_is_examiner(cls, user_obj):
-        return Q(periods__assignments__assignmentgroups__examiners__user=user_obj)
+        return Q(periods__assignments__in=EffectiveRole.get_ids(user_obj, EffectiveRole.EXAMINER, 'assignment'))
 
     @classmethod
     def q_is_candidate(cls, user_obj):
-        return Q(periods__assignments__assignmentgroups__candidates__student=user_obj)
+        return Q(periods__assignments__in=EffectiveRole.get_ids(user_obj, EffectiveRole.CANDIDATE, 'assignment'))
 
 
@@ -10,5 +10,8 @@ from feedback import *
 from deadline import *
 from memorydeliverystore import *
 from fsdeliverystore import *
+from fshierdedupdeliverystore import *
 from dbmdeliverystore import *
 from testhelper import *
+from effectiverole import *
+from authcontext import *
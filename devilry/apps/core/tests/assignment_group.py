@@ -148,3 +148,51 @@ class TestAssignmentGroup(TestCase, TestHelper):
             obj.etag_update(e.etag)
         obj2 = AssignmentGroup.objects.get(id=obj.id)
         self.assertFalse(obj2.is_open)
+
+    def _create_delivery(self, group):
+        deadline = group.deadlines.create(deadline=datetime.now() + timedelta(10))
+        return deadline.deliveries.create(delivered_by=group.candidates.all()[0],
+                                          successful=True)
+
+    def test_delivery_summary(self):
+        group = self.inf1100_looong_assignment1_g1
+        deadline = group.deadlines.create(deadline=datetime.now() + timedelta(10))
+        group = AssignmentGroup.objects.get(id=group.id)
+        self.assertEquals(group.latest_deadline_id, deadline.id)
+        self.assertEquals(group.number_of_deliveries, 0)
+        without_deliveries = AssignmentGroup.objects.filter(number_of_deliveries=0).count()
+
+        delivery = self._create_delivery(group)
+        self.assertEquals(AssignmentGroup.objects.filter(number_of_deliveries=0).count(),
+                          without_deliveries - 1)
+        group = AssignmentGroup.objects.get(id=group.id)
+        self.assertEquals(group.latest_delivery_id, delivery.id)
+        self.assertEquals(group.number_of_deliveries, 1)
+
+        delivery.delete()
+        group = AssignmentGroup.objects.get(id=group.id)
+        self.assertEquals(group.latest_delivery_id, None)
+        self.assertEquals(group.number_of_deliveries, 0)
+
+        deadlineid = deadline.id
+        deadline.delete()
+        group = AssignmentGroup.objects.get(id=group.id)
+        self.assertNotEquals(group.latest_deadline_id, deadlineid)
+
+    def test_delivery_summary_stale_save(self):
+        group = self.inf1100_looong_assignment1_g1
+        self._create_delivery(group)
+        group.name = 'Renamed'
+        group.save()
+        self.assertEquals(AssignmentGroup.objects.get(id=group.id).number_of_deliveries, 1)
+        self.assertEquals(group.number_of_deliveries, 1)
+
+    def test_rebuild_delivery_summaries(self):
+        group = self.inf1100_looong_assignment1_g1
+        delivery = self._create_delivery(group)
+        self.assertEquals(AssignmentGroup.rebuild_delivery_summaries(), 0)
+        AssignmentGroup.objects.all().update(latest_delivery_id=None, number_of_deliveries=0)
+        self.assertEquals(AssignmentGroup.rebuild_delivery_summaries(), 1)
+        group = AssignmentGroup.objects.get(id=group.id)
+        self.assertEquals(group.latest_delivery_id, delivery.id)
+        self.assertEquals(group.number_of_deliveries, 1)
@@ -0,0 +1,61 @@
+from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+
+from ..models import Examiner
+from ..authcontext import get_authcontext
+from ..testhelper import TestHelper
+
+
+class TestAuthorizationContext(TestCase, TestHelper):
+
+    def setUp(self):
+        self.add(nodes="uio:admin(uioadmin)",
+                 subjects=["inf101"],
+                 periods=["firstsem"],
+                 assignments=["a1"],
+                 assignmentgroups=["g1:candidate(stud1):examiner(exam1)"])
+        self.group = self.inf101_firstsem_a1_g1
+        self.orig_timeout = settings.DEVILRY_AUTHORIZATION_CACHE_TIMEOUT
+        settings.DEVILRY_AUTHORIZATION_CACHE_TIMEOUT = 60
+        cache.clear()
+
+    def tearDown(self):
+        settings.DEVILRY_AUTHORIZATION_CACHE_TIMEOUT = self.orig_timeout
+        cache.clear()
+
+    def test_request_scoped(self):
+        authcontext = get_authcontext(self.exam1)
+        self.assertTrue(authcontext is get_authcontext(self.exam1))
+        self.assertTrue(authcontext.is_examiner(self.group))
+        self.assertFalse(authcontext.is_candidate(self.group))
+        with self.assertNumQueries(0):
+            self.assertTrue(authcontext.is_examiner(self.group))
+            self.assertFalse(authcontext.is_candidate(self.group))
+
+    def test_is_admin(self):
+        authcontext = get_authcontext(self.uioadmin)
+        with self.assertNumQueries(1):
+            self.assertTrue(authcontext.is_admin(self.inf101_firstsem_a1))
+        self.assertTrue(authcontext.can_save(self.group))
+        self.assertFalse(get_authcontext(self.stud1).can_save(self.group))
+
+    def test_shared(self):
+        self.assertTrue(get_authcontext(self.exam1).is_examiner(self.group))
+        exam1 = self.exam1.__class__.objects.get(id=self.exam1.id) # A new request
+        with self.assertNumQueries(0):
+            self.assertTrue(get_authcontext(exam1).is_examiner(self.group))
+
+    def test_invalidate(self):
+        authcontext = get_authcontext(self.exam1)
+        self.assertTrue(authcontext.is_examiner(self.group))
+        Examiner.objects.filter(user=self.exam1).delete()
+        self.assertFalse(authcontext.is_examiner(self.group))
+        exam1 = self.exam1.__class__.objects.get(id=self.exam1.id)
+        self.assertFalse(get_authcontext(exam1).is_examiner(self.group))
+
+        authcontext = get_authcontext(self.uioadmin)
+        self.assertTrue(authcontext.is_admin(self.inf101))
+        self.uio.admins.clear()
+        uioadmin = self.uioadmin.__class__.objects.get(id=self.uioadmin.id)
+        self.assertFalse(get_authcontext(uioadmin).is_admin(self.inf101))
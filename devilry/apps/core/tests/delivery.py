@@ -56,3 +56,20 @@ class TestDelivery(TestCase, TestHelper):
         self.assertEquals(Delivery.published_where_is_candidate(self.student2).count(), 7)
         self.assertEquals(Delivery.published_where_is_candidate(self.student3).count(), 3)
         self.assertEquals(Delivery.published_where_is_candidate(self.student4).count(), 0)
+
+    def test_add_file_digest(self):
+        d = self.add_delivery("inf1100.period1.assignment1.g1", self.goodFile)
+        filemeta = d.add_file('hello.txt', ['hello', ' ', 'world'])
+        self.assertEquals(filemeta.size, 11)
+        self.assertEquals(filemeta.digest,
+                          'b94d27b9934d3e08a52e52d7da7dabfac484efe37a5380ee9088f7ace2efcde9')
+        self.assertEquals(filemeta.crc32, 0x0d4a1185)
+
+    def test_verify_nodigest_size(self):
+        from devilry.apps.superadmin.management.commands.devilry_deliverystore_verify import verify_filemeta
+        d = self.add_delivery("inf1100.period1.assignment1.g1", self.goodFile)
+        filemeta = d.add_file('hello.txt', ['hello world'])
+        filemeta.digest = None
+        self.assertEquals(verify_filemeta(filemeta)[1], 'nodigest')
+        filemeta.size = 20 # Truncated or corrupt legacy file
+        self.assertEquals(verify_filemeta(filemeta)[1], 'corrupt')
@@ -0,0 +1,100 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from ..models import (Subject, Period, Assignment, AssignmentGroup,
+                      Candidate, Examiner, EffectiveRole)
+from ..models.effectiverole_sync import rebuild
+from ..testhelper import TestHelper
+
+
+class TestEffectiveRole(TestCase, TestHelper):
+
+    def setUp(self):
+        self.add(nodes="uio:admin(uioadmin).ifi:admin(ifiadmin)",
+                 subjects=["inf101:admin(subjectadmin)"],
+                 periods=["firstsem:admin(periodadmin)"],
+                 assignments=["a1:admin(assignmentadmin)"],
+                 assignmentgroups=["g1:candidate(stud1):examiner(exam1)",
+                                   "g2:candidate(stud2,stud3):examiner(exam1,exam2)"])
+        self.add(nodes="uio.phys", subjects=["fys101"], periods=["firstsem"],
+                 assignments=["a1"])
+
+    def _get_roles(self):
+        return set(EffectiveRole.objects.values_list('user__username', 'role',
+                                                     'subject__short_name',
+                                                     'period__short_name',
+                                                     'assignment__short_name'))
+
+    def test_where_is_admin(self):
+        self.assertEquals(set(Subject.where_is_admin(self.uioadmin)),
+                          set([self.inf101, self.fys101]))
+        self.assertEquals(list(Subject.where_is_admin(self.ifiadmin)), [self.inf101])
+        self.assertEquals(list(Period.where_is_admin(self.subjectadmin)),
+                          [self.inf101_firstsem])
+        self.assertEquals(list(Assignment.where_is_admin(self.periodadmin)),
+                          [self.inf101_firstsem_a1])
+        self.assertEquals(list(Period.where_is_admin(self.assignmentadmin)), [])
+        self.assertEquals(AssignmentGroup.where_is_admin(self.assignmentadmin).count(), 2)
+        self.assertEquals(AssignmentGroup.where_is_admin(self.uioadmin).count(), 2)
+        self.assertEquals(AssignmentGroup.where_is_admin(self.ifiadmin).count(), 2)
+
+    def test_where_is_examiner_and_candidate(self):
+        self.assertEquals(list(Assignment.where_is_examiner(self.exam1)),
+                          [self.inf101_firstsem_a1])
+        self.assertEquals(list(Subject.where_is_examiner(self.exam2)), [self.inf101])
+        self.assertEquals(list(Period.where_is_candidate(self.stud3)),
+                          [self.inf101_firstsem])
+        self.assertEquals(list(Subject.where_is_candidate(self.exam1)), [])
+
+    def test_admins_changed(self):
+        user = User.objects.create(username='newadmin')
+        self.inf101_firstsem.admins.add(user)
+        self.assertEquals(list(Assignment.where_is_admin(user)), [self.inf101_firstsem_a1])
+        self.inf101_firstsem.admins.clear()
+        self.assertEquals(list(Assignment.where_is_admin(user)), [])
+        self.assertEquals(list(Period.where_is_admin(self.periodadmin)), [])
+        user.node_set.add(self.uio_phys)
+        self.assertEquals(list(Subject.where_is_admin(user)), [self.fys101])
+        user.node_set.remove(self.uio_phys)
+        self.assertEquals(list(Subject.where_is_admin(user)), [])
+
+    def test_move(self):
+        self.fys101.parentnode = self.uio_ifi
+        self.fys101.save()
+        self.assertEquals(set(Period.where_is_admin(self.ifiadmin)),
+                          set([self.inf101_firstsem, self.fys101_firstsem]))
+        self.uio_ifi.parentnode = None
+        self.uio_ifi.save()
+        self.assertEquals(list(Assignment.where_is_admin(self.uioadmin)), [])
+        self.assertEquals(Assignment.where_is_admin(self.ifiadmin).count(), 2)
+
+    def test_create(self):
+        assignment = Assignment.objects.create(parentnode=self.inf101_firstsem,
+                                               short_name='a2', long_name='A2',
+                                               publishing_time=self.inf101_firstsem.start_time)
+        self.assertEquals(set(Assignment.where_is_admin(self.subjectadmin)),
+                          set([self.inf101_firstsem_a1, assignment]))
+
+    def test_examiners_and_candidates_changed(self):
+        group = self.inf101_firstsem_a1_g1
+        Examiner.objects.get(assignmentgroup=group, user=self.exam1).delete()
+        self.assertEquals(list(Assignment.where_is_examiner(self.exam1)),
+                          [self.inf101_firstsem_a1]) # Still examiner on g2
+        Examiner.objects.get(assignmentgroup=self.inf101_firstsem_a1_g2, user=self.exam1).delete()
+        self.assertEquals(list(Assignment.where_is_examiner(self.exam1)), [])
+
+        candidate = Candidate.objects.get(assignment_group=group, student=self.stud1)
+        candidate.assignment_group = self.fys101_firstsem_a1.assignmentgroups.create()
+        candidate.save()
+        self.assertEquals(list(Assignment.where_is_candidate(self.stud1)),
+                          [self.fys101_firstsem_a1])
+        self.inf101_firstsem_a1_g2.delete()
+        self.assertEquals(list(Assignment.where_is_candidate(self.stud2)), [])
+
+    def test_rebuild(self):
+        roles = self._get_roles()
+        EffectiveRole.objects.all().delete()
+        rebuild()
+        self.assertEquals(self._get_roles(), roles)
+        self.assertTrue((u'exam2', EffectiveRole.EXAMINER, None, None, u'a1') in roles)
+        self.assertTrue((u'uioadmin', EffectiveRole.ADMIN, None, u'firstsem', None) in roles)
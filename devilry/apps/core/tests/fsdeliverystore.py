@@ -1,9 +1,11 @@
 from django.test import TestCase
 from tempfile import mkdtemp
 from shutil import rmtree
+from os.path import join
 
 from ..testhelpers import TestDeliveryStoreMixin
-from ..deliverystore import FsDeliveryStore
+from ..deliverystore import FsDeliveryStore, FsHierDeliveryStore
+from ..models import FileMeta
 
 class TestFsDeliveryStore(TestDeliveryStoreMixin, TestCase):
     def setUp(self):
@@ -15,3 +17,34 @@ class TestFsDeliveryStore(TestDeliveryStoreMixin, TestCase):
 
     def tearDown(self):
         rmtree(self.root)
+
+
+class TestFsHierDeliveryStore(TestDeliveryStoreMixin, TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        super(TestFsHierDeliveryStore, self).setUp()
+
+    def get_storageobj(self):
+        return FsHierDeliveryStore(self.root, interval=10)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def test_list_files(self):
+        store = self.get_storageobj()
+        filemeta = FileMeta.objects.create(delivery=self.filemeta.delivery,
+                                           filename='a.txt', size=0)
+        w = store.write_open(filemeta)
+        w.write('hello')
+        w.close()
+        deliveryid = filemeta.delivery.id
+        toplevel, sublevel = store.get_path_from_deliveryid(deliveryid)
+        parentdir = join(self.root, str(toplevel), str(sublevel))
+        self.assertEquals(store.get_delivery_parentdirs(), [parentdir])
+        files = store.list_files_in_parentdir(parentdir)
+        self.assertEquals(len(files), 1)
+        self.assertEquals(files[0][:3], (deliveryid, filemeta.id,
+                                         join(parentdir, str(deliveryid), str(filemeta.id))))
+        self.assertEquals(files[0][3].st_size, 5)
+        self.assertEquals(store.remove_filepath(files[0][2]), 5)
+        self.assertFalse(store.exists(filemeta))
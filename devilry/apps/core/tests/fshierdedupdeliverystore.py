@@ -0,0 +1,128 @@
+from django.test import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+import os
+from hashlib import sha256
+
+from ..testhelpers import TestDeliveryStoreMixin
+from ..deliverystore import FsHierDedupDeliveryStore, FsHierDeliveryStore
+from ..models import FileMeta
+
+
+class TestFsHierDedupDeliveryStore(TestDeliveryStoreMixin, TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        super(TestFsHierDedupDeliveryStore, self).setUp()
+        delivery = self.filemeta.delivery
+        self.filemeta1 = FileMeta.objects.create(delivery=delivery, filename='a.txt', size=0)
+        self.filemeta2 = FileMeta.objects.create(delivery=delivery, filename='b.txt', size=0)
+
+    def get_storageobj(self):
+        return FsHierDedupDeliveryStore(self.root, interval=10)
+
+    def tearDown(self):
+        rmtree(self.root)
+
+    def _write(self, store, filemeta, data):
+        w = store.write_open(filemeta)
+        w.write(data)
+        w.close()
+
+    def _count_blobs(self, store):
+        return sum(len(filenames) for dirpath, dirnames, filenames in
+                   os.walk(store._get_blobsdir()))
+
+    def test_dedup(self):
+        store = self.get_storageobj()
+        self._write(store, self.filemeta1, 'hello')
+        self._write(store, self.filemeta2, 'hello')
+        self.assertEquals(self._count_blobs(store), 1)
+        self.assertEquals(store.read_open(self.filemeta1).read(), 'hello')
+        self.assertEquals(store.read_open(self.filemeta2).read(), 'hello')
+
+        store.remove(self.filemeta1)
+        self.assertEquals(self._count_blobs(store), 1)
+        self.assertEquals(store.read_open(self.filemeta2).read(), 'hello')
+        store.remove(self.filemeta2)
+        self.assertEquals(self._count_blobs(store), 0)
+
+    def test_overwrite(self):
+        store = self.get_storageobj()
+        self._write(store, self.filemeta1, 'hello')
+        self._write(store, self.filemeta1, 'world')
+        self.assertEquals(self._count_blobs(store), 1)
+        self.assertEquals(store.read_open(self.filemeta1).read(), 'world')
+        self._write(store, self.filemeta1, 'world')
+        self.assertEquals(self._count_blobs(store), 1)
+        self.assertEquals(store.read_open(self.filemeta1).read(), 'world')
+
+    def test_deduplicate_file(self):
+        oldstore = FsHierDeliveryStore(self.root, interval=10)
+        self._write(oldstore, self.filemeta1, 'hello')
+        self._write(oldstore, self.filemeta2, 'hello')
+        store = self.get_storageobj()
+        self.assertEquals(store.deduplicate_file(store._get_filepath(self.filemeta1)), 0)
+        self.assertEquals(store.deduplicate_file(store._get_filepath(self.filemeta2)), 5)
+        self.assertEquals(store.deduplicate_file(store._get_filepath(self.filemeta2)), 0)
+        self.assertEquals(self._count_blobs(store), 1)
+        self.assertEquals(store.read_open(self.filemeta2).read(), 'hello')
+        store.remove(self.filemeta1)
+        store.remove(self.filemeta2)
+        self.assertEquals(self._count_blobs(store), 0)
+
+    def test_quarantine_filepath(self):
+        store = self.get_storageobj()
+        self._write(store, self.filemeta1, 'hello')
+        self._write(store, self.filemeta2, 'hello')
+        quarantine = os.path.join(self.root, 'quarantine')
+        filepath1 = store._get_filepath(self.filemeta1)
+        self.assertEquals(store.get_freed_size(filepath1, os.stat(filepath1)), 0) # Shared
+        self.assertEquals(store.quarantine_filepath(filepath1, os.path.join(quarantine, '1')), 0)
+        self.assertEquals(self._count_blobs(store), 1)
+        filepath2 = store._get_filepath(self.filemeta2)
+        self.assertEquals(store.get_freed_size(filepath2, os.stat(filepath2)), 5)
+        self.assertEquals(store.quarantine_filepath(filepath2, os.path.join(quarantine, '2')), 5)
+        self.assertEquals(self._count_blobs(store), 0)
+        self.assertEquals(open(os.path.join(quarantine, '1')).read(), 'hello')
+        self.assertEquals(open(os.path.join(quarantine, '2')).read(), 'hello')
+
+    def test_list_unreferenced_files(self):
+        from time import time
+        store = self.get_storageobj()
+        self._write(store, self.filemeta1, 'hello')
+        self._write(store, self.filemeta2, 'world')
+        # Leave the blob of filemeta1 without links, and a temporary file
+        os.remove(store._get_filepath(self.filemeta1))
+        tmppath = os.path.join(store._get_tmpdir(), 'interrupted')
+        open(tmppath, 'w').write('data')
+        self.assertEquals(store.list_unreferenced_files(time() - 3600), [])
+        files = store.list_unreferenced_files(time() + 1)
+        self.assertEquals([filepath for filepath, stat in files],
+                          [store.get_blobpath(sha256('hello').hexdigest()), tmppath])
+        for filepath, stat in files:
+            self.assertEquals(store.remove_filepath(filepath), stat.st_size)
+        self.assertEquals(self._count_blobs(store), 1)
+
+    def test_gc_min_age_new_link(self):
+        from time import time
+        from django.core.management import call_command
+        store = self.get_storageobj()
+        self._write(store, self.filemeta1, 'hello')
+        blobpath = store.get_blobpath(sha256('hello').hexdigest())
+        old = time() - 48*3600
+        os.utime(blobpath, (old, old))
+        # A file written before the transaction creating its FileMeta is
+        # committed links to the old blob, and keeps its mtime
+        uncommitted = FileMeta(id=self.filemeta2.id + 1000, delivery=self.filemeta.delivery,
+                               filename='c.txt', size=5)
+        self._write(store, uncommitted, 'hello')
+        filepath = store._get_filepath(uncommitted)
+        self.assertTrue(os.stat(filepath).st_mtime < time() - 24*3600)
+        orig_deliverystore = FileMeta.deliverystore
+        FileMeta.deliverystore = store
+        try:
+            call_command('devilry_deliverystore_gc', min_age=24, threads=1, verbosity=0)
+        finally:
+            FileMeta.deliverystore = orig_deliverystore
+        self.assertTrue(os.path.exists(filepath))
+        self.assertEquals(store.read_open(self.filemeta1).read(), 'hello')
@@ -4,8 +4,9 @@ from django.contrib.auth.models import User
 from django.db import IntegrityError
 from django.core.exceptions import ValidationError
 from django.test import TestCase
+from django.core.management import call_command
 
-from ..models import Node
+from ..models import Node, NodeClosure
 from ..testhelper import TestHelper
 from ..models.model_utils import EtagMismatchException
 
@@ -121,3 +122,42 @@ class TestNode(TestCase, TestHelper):
         pk_verify.sort()
         self.assertEquals(set(pks), set(pk_verify))
 
+
+    def _get_closure(self):
+        return set(NodeClosure.objects.values_list('ancestor__short_name',
+                                                   'descendant__short_name', 'depth'))
+
+    def test_closure(self):
+        self.assertEquals(set(NodeClosure.objects.filter(descendant=self.uio_deepdummy1_deepdummy2)\
+                                  .values_list('ancestor__short_name', 'depth')),
+                          set([(u'deepdummy2', 0), (u'deepdummy1', 1), (u'uio', 2)]))
+        closure = self._get_closure()
+        NodeClosure.rebuild()
+        self.assertEquals(self._get_closure(), closure)
+
+    def test_closure_move(self):
+        self.uio_deepdummy1_deepdummy2.parentnode = self.uio_ifi
+        self.uio_deepdummy1_deepdummy2.save()
+        self.assertEquals(self.uio_deepdummy1_deepdummy2_deepdummy3.get_path(),
+                          'uio.ifi.deepdummy2.deepdummy3')
+        self.assertTrue(self.uio_deepdummy1_deepdummy2_deepdummy3.is_admin(self.ifiadmin))
+        self.assertEquals(Node.where_is_admin(self.ifiadmin).count(), 3)
+        closure = self._get_closure()
+        call_command('devilry_rebuild_node_closure', verbosity=0)
+        self.assertEquals(self._get_closure(), closure)
+
+    def test_clean_parent_is_grandchild(self):
+        self.uio.parentnode = self.uio_deepdummy1_deepdummy2_deepdummy3
+        with self.assertNumQueries(2): # The unique check and the closure lookup
+            self.assertRaises(ValidationError, self.uio.clean)
+
+    def test_admin_lookups(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.uio_deepdummy1_deepdummy2_deepdummy3.is_admin(self.uioadmin))
+        with self.assertNumQueries(1):
+            self.assertFalse(self.uio_deepdummy1_deepdummy2_deepdummy3.is_admin(self.ifiadmin))
+        with self.assertNumQueries(1):
+            self.assertEquals(self.uio_deepdummy1_deepdummy2_deepdummy3.get_path(),
+                              'uio.deepdummy1.deepdummy2.deepdummy3')
+        with self.assertNumQueries(1):
+            self.assertEquals(Node.where_is_admin(self.uioadmin).count(), 6)
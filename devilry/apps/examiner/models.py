@@ -1 +1,18 @@
-# Only here to make Django see this as an app.
\ No newline at end of file
+# Only here to make Django see this as an app, and to connect the signals
+# invalidating the archives downloaded by examiners and administrators.
+from django.db.models.signals import post_save, pre_delete
+
+from devilry.apps.core.models import FileMeta, Delivery, Deadline, Candidate
+from devilry.utils.archive_cache import (invalidate_on_filemeta_change,
+                                         invalidate_on_delivery_change,
+                                         invalidate_on_deadline_or_candidate_change)
+
+
+post_save.connect(invalidate_on_filemeta_change, sender=FileMeta)
+pre_delete.connect(invalidate_on_filemeta_change, sender=FileMeta)
+post_save.connect(invalidate_on_delivery_change, sender=Delivery)
+pre_delete.connect(invalidate_on_delivery_change, sender=Delivery)
+post_save.connect(invalidate_on_deadline_or_candidate_change, sender=Deadline)
+pre_delete.connect(invalidate_on_deadline_or_candidate_change, sender=Deadline)
+post_save.connect(invalidate_on_deadline_or_candidate_change, sender=Candidate)
+pre_delete.connect(invalidate_on_deadline_or_candidate_change, sender=Candidate)
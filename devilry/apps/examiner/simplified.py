@@ -1,8 +1,9 @@
 from datetime import datetime
-from django.db.models import Count, Max
+from django.db.models import Count
 
 from ...simplified import SimplifiedModelApi, simplified_modelapi, PermissionDenied, FieldSpec
 from ..core import models
+from ..core.authcontext import get_authcontext
 from devilry.coreutils.simplified.metabases import (SimplifiedSubjectMetaMixin,
                                                    SimplifiedFileMetaMetaMixin,
                                                    SimplifiedPeriodMetaMixin,
@@ -37,7 +38,9 @@ class PublishedWhereIsExaminerMixin(SimplifiedModelApi):
         :param obj: An object of the type this method is used in.
         :throws PermissionDenied:
         """
-        if not cls._meta.model.published_where_is_examiner(user).filter(id=obj.id):
+        qry = cls._meta.model.published_where_is_examiner(user).filter(id=obj.id)
+        if not get_authcontext(user).check('published_where_is_examiner', obj,
+                                           qry.exists, shared=False):
             raise PermissionDenied()
 
 
@@ -103,10 +106,7 @@ class SimplifiedAssignmentGroup(PublishedWhereIsExaminerMixin):
         :param user: A django user object.
         :rtype: a django queryset
         """
-        return cls._meta.model.published_where_is_examiner(user).annotate(latest_delivery_id=Max('deadlines__deliveries__id'),
-                                                                          latest_deadline_id=Max('deadlines__id'),
-                                                                          latest_deadline_deadline=Max('deadlines__deadline'),
-                                                                          number_of_deliveries=Count('deadlines__deliveries'))
+        return cls._meta.model.published_where_is_examiner(user)
 
 
     @classmethod
@@ -486,13 +486,13 @@ class TestSimplifiedExaminerAssignmentGroup(SimplifiedExaminerTestBase):
 
         # do a read with no extra fields
         read_res = SimplifiedAssignmentGroup.read(self.firstExam, self.inf101_firstsem_a1.id)
-        expected_res = modelinstance_to_dict(self.inf101_firstsem_a1_g1,
+        expected_res = modelinstance_to_dict(models.AssignmentGroup.objects.get(id=self.inf101_firstsem_a1_g1.id),
                                              SimplifiedAssignmentGroup._meta.resultfields.aslist())
         self.assertEquals(read_res, expected_res)
 
         # do a read with all extras
         read_res = SimplifiedAssignmentGroup.read(self.firstExam, self.inf101_firstsem_a1.id, result_fieldgroups=self.allExtras)
-        expected_res = modelinstance_to_dict(self.inf101_firstsem_a1_g1,
+        expected_res = modelinstance_to_dict(models.AssignmentGroup.objects.get(id=self.inf101_firstsem_a1_g1.id),
                                              SimplifiedAssignmentGroup._meta.resultfields.aslist(self.allExtras))
         self.assertEquals(read_res, expected_res)
 
@@ -1,18 +1,18 @@
 from django.views.generic import TemplateView, View
 from django.shortcuts import render
-from tempfile import TemporaryFile, NamedTemporaryFile
 from devilry.apps.gradeeditors.restful import examiner as gradeeditors_restful
 from devilry.utils.module import dump_all_into_dict
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render, get_object_or_404, get_list_or_404
 from ..core.models import (Assignment, AssignmentGroup)
-from devilry.utils.filewrapperwithexplicitclose import FileWrapperWithExplicitClose
-import zipfile
+from devilry.utils.delivery_collection import (create_archive_from_assignment,
+                                               get_archive_token, parse_archive_token,
+                                               ARCHIVE_TOKEN_HEADER)
+from devilry.utils.archive_cache import create_cached_archive_from_assignment
 import tarfile
 import os, glob
 import shutil
 import restful
-from devilry.defaults.encoding import ZIPFILE_FILENAME_CHARSET
 
 
 class MainView(TemplateView):
@@ -47,45 +47,26 @@ class AssignmentView(View):
                        
 class CompressedFileDownloadView(View):
 
-    def _get_candidates_as_string(self, assignmentgroup):
-        return '-'.join([candidate.identifier for candidate in assignmentgroup.candidates.all()])
-
     def get(self, request, assignmentid):
+        """ Download all files delivered on the assignment. Give the
+        ``X-Devilry-Archive-Token`` header from a download as the ``since``
+        parameter to only get the deliveries made after that download. """
         assignment = get_object_or_404(Assignment, id=assignmentid)
-        zip_rootdir_name = assignment.get_path()
-        zip_file_name = zip_rootdir_name + ".zip"
-        ziptempfile = self._create_zip(request, assignment, zip_rootdir_name)
-
-        response = HttpResponse(FileWrapperWithExplicitClose(ziptempfile),
-                                content_type="application/zip")
-        response['Content-Disposition'] = "attachment; filename=%s" % \
-                zip_file_name.encode("ascii", 'replace')
-        response['Content-Length'] = os.stat(ziptempfile.name).st_size
+        assignmentgroups = self._create_assignment_group_qry(request, assignment)
+        token = get_archive_token(assignmentgroups)
+        since = request.GET.get('since')
+        if since:
+            try:
+                delivered_after = parse_archive_token(since)
+            except ValueError, e:
+                return HttpResponseBadRequest(str(e))
+            response = create_archive_from_assignment(assignment, assignmentgroups, 'zip',
+                                                      delivered_after=delivered_after,
+                                                      request=request)
+        else:
+            response = create_cached_archive_from_assignment(request, assignment, assignmentgroups, 'zip')
+        response[ARCHIVE_TOKEN_HEADER] = token
         return response
 
-    def _create_zip(self, request, assignment, zip_rootdir_name):
-        tempfile = NamedTemporaryFile()
-        zip_file = zipfile.ZipFile(tempfile, 'w');
-
-        for assignmentgroup in self._create_assignment_group_qry(request, assignment):
-            candidates = self._get_candidates_as_string(assignmentgroup)
-
-            for deadline in assignmentgroup.deadlines.all():
-                for delivery in deadline.deliveries.all():
-                    for filemeta in delivery.filemetas.all():
-                        file_content = filemeta.deliverystore.read_open(filemeta)
-                        filenametpl = '{zip_rootdir_name}/{candidates}_group-{groupid}/deadline-{deadline}/delivery-{delivery_number}/{filename}'
-                        filename = filenametpl.format(zip_rootdir_name=zip_rootdir_name,
-                                                      groupid=assignmentgroup.id,
-                                                      candidates=candidates,
-                                                      deadline=deadline.deadline.strftime("%Y-%m-%dT%H_%M_%S"),
-                                                      delivery_number="%.3d" % delivery.number,
-                                                      filename = filemeta.filename.encode(ZIPFILE_FILENAME_CHARSET))
-                        zip_file.writestr(filename, file_content.read())
-        zip_file.close()
-
-        tempfile.seek(0)
-        return tempfile
-
     def _create_assignment_group_qry(self, request, assignment):
         return AssignmentGroup.published_where_is_examiner(request.user, old=False).filter(parentnode=assignment)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from django.db.models import Count, Max
+from django.db.models import Count
 import django.dispatch
 
 from devilry.simplified import simplified_modelapi, SimplifiedModelApi, PermissionDenied, FieldSpec
@@ -12,6 +12,7 @@ from devilry.coreutils.simplified.metabases import (SimplifiedSubjectMetaMixin,
                                                    SimplifiedStaticFeedbackMetaMixin,
                                                    SimplifiedFileMetaMetaMixin)
 from devilry.apps.core.models import AssignmentGroup, Delivery
+from devilry.apps.core.authcontext import get_authcontext
 from isrelatedstudentbase import IsRelatedStudentBase
 from simplifiedrelatedstudentkeyvalue import SimplifiedRelatedStudentKeyValue
 
@@ -42,7 +43,9 @@ class PublishedWhereIsCandidateMixin(SimplifiedModelApi):
         :param obj: An object of the type this method is used in.
         :throws PermissionDenied:
         """
-        if not cls._meta.model.published_where_is_candidate(user).filter(id=obj.id):
+        qry = cls._meta.model.published_where_is_candidate(user).filter(id=obj.id)
+        if not get_authcontext(user).check('published_where_is_candidate', obj,
+                                           qry.exists, shared=False):
             raise PermissionDenied()
 
 
@@ -130,10 +133,7 @@ class SimplifiedAssignmentGroup(PublishedWhereIsCandidateMixin):
         :param user: A django user object.
         :rtype: a django queryset
         """
-        return cls._meta.model.published_where_is_candidate(user).annotate(latest_delivery_id=Max('deadlines__deliveries__id'),
-                                                                           latest_deadline_id=Max('deadlines__id'),
-                                                                           latest_deadline_deadline=Max('deadlines__deadline'),
-                                                                           number_of_deliveries=Count('deadlines__deliveries'))
+        return cls._meta.model.published_where_is_candidate(user)
 
 
 
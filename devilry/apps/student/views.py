@@ -8,12 +8,13 @@ import json
 from django.views.generic import (TemplateView, View)
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpResponse, HttpResponseForbidden, HttpResponseBadRequest
-from django.core.servers.basehttp import FileWrapper
 from django.db import IntegrityError
 
 from devilry.apps.core.models import Delivery, FileMeta, Deadline, AssignmentGroup
+from devilry.apps.core.authcontext import get_authcontext
 from devilry.utils.module import dump_all_into_dict
 from devilry.utils.filewrapperwithexplicitclose import FileWrapperWithExplicitClose
+from devilry.utils.sendfile import create_filemeta_response
 from devilry.restful.serializers import (serialize, SerializableResult,
                                          ErrorMsgSerializableResult,
                                          ForbiddenSerializableResult)
@@ -38,9 +39,9 @@ class MainView(TemplateView):
 class AddDeliveryView(View):
     def get(self, request, assignmentgroupid):
         assignment_group = get_object_or_404(AssignmentGroup, id=assignmentgroupid)
-        logged_in_user = request.user
-        if not assignment_group.can_save(logged_in_user):
-            if not assignment_group.is_candidate(logged_in_user):
+        authcontext = get_authcontext(request.user)
+        if not authcontext.can_save(assignment_group):
+            if not authcontext.is_candidate(assignment_group):
                 return HttpResponseForbidden()
         deadline = assignment_group.get_active_deadline()
         deadline_timestamp_milliseconds = mktime(deadline.deadline.timetuple()) + (deadline.deadline.microsecond/1000000)
@@ -74,8 +75,9 @@ class FileUploadView(View):
         deliveryid = request.POST['deliveryid']
 
         # Allow administrators and candidates on the group
-        if not assignment_group_obj.can_save(logged_in_user):
-            if not assignment_group_obj.is_candidate(logged_in_user):
+        authcontext = get_authcontext(logged_in_user)
+        if not authcontext.can_save(assignment_group_obj):
+            if not authcontext.is_candidate(assignment_group_obj):
                 return ForbiddenSerializableResult()
 
         # Only allowed to add on open groups
@@ -117,19 +119,17 @@ class FileDownloadView(View):
     def get(self, request, filemetaid):    
         filemeta = get_object_or_404(FileMeta, id=filemetaid)
         assignment_group = filemeta.delivery.deadline.assignment_group
-        if not (assignment_group.is_candidate(request.user) \
-                    or assignment_group.is_examiner(request.user) \
+        authcontext = get_authcontext(request.user)
+        if not (authcontext.is_candidate(assignment_group) \
+                    or authcontext.is_examiner(assignment_group) \
                     or request.user.is_superuser \
-                    or assignment_group.parentnode.is_admin(request.user)):
+                    or authcontext.is_admin(assignment_group.parentnode)):
             return HttpResponseForbidden("Forbidden")
         
-        # TODO: make this work on any storage backend
-        response = HttpResponse(FileWrapper(filemeta.deliverystore.read_open(filemeta)),
-                                content_type=guess_type(filemeta.filename)[0])
+        response = create_filemeta_response(request, filemeta,
+                                            content_type=guess_type(filemeta.filename)[0])
         response['Content-Disposition'] = "attachment; filename=%s" % \
             filemeta.filename.encode("ascii", 'replace')
-        response['Content-Length'] = filemeta.size
-
         return response
 
 
@@ -138,10 +138,11 @@ class CompressedFileDownloadView(View):
     def get(self, request, deliveryid):
         delivery = get_object_or_404(Delivery, id=deliveryid)
         assignment_group = delivery.deadline.assignment_group
-        if not (assignment_group.is_candidate(request.user) \
-                    or assignment_group.is_examiner(request.user) \
+        authcontext = get_authcontext(request.user)
+        if not (authcontext.is_candidate(assignment_group) \
+                    or authcontext.is_examiner(assignment_group) \
                     or request.user.is_superuser \
-                    or assignment_group.parentnode.is_admin(request.user)):
+                    or authcontext.is_admin(assignment_group.parentnode)):
             return HttpResponseForbidden("Forbidden")
         zip_file_name = str(delivery.delivered_by) + ".zip"
 
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from devilry.apps.core.models import Assignment, AssignmentGroup, Examiner
+from devilry.utils.archive_cache import get_cache_root, CachedArchive
+
+
+class Command(BaseCommand):
+    args = '[assignment-id ...]'
+    help = 'Build the archives downloaded by administrators and examiners on '\
+            'the given assignments, or on assignments with a deadline that expired '\
+            'recently if no assignments are given, and put them in '\
+            'DEVILRY_ARCHIVE_CACHE_ROOT. Archives that are already cached, and up '\
+            'to date, are not rebuilt. Run this from cron.'
+    option_list = BaseCommand.option_list + (
+        make_option('--days',
+            dest='days',
+            type='int',
+            default=7,
+            help='Build archives for assignments with a deadline that expired less than this many days ago. Defaults to 7.'),
+        make_option('--archive-type',
+            dest='archive_type',
+            default='zip',
+            help='The archive type to build. Defaults to "zip", the type used by the download views.'),
+    )
+
+    def get_assignments(self, assignmentids, days):
+        if assignmentids:
+            return Assignment.objects.filter(id__in=assignmentids)
+        now = datetime.now()
+        return Assignment.objects.filter(
+                assignmentgroups__deadlines__deadline__lt=now,
+                assignmentgroups__deadlines__deadline__gte=now - timedelta(days=days)).distinct()
+
+    def iter_assignmentgroup_qrys(self, assignment):
+        """ Yield the querysets the download views use for the admins and
+        examiners on the assignment. """
+        yield AssignmentGroup.objects.filter(parentnode=assignment)
+        userids = Examiner.objects.filter(assignmentgroup__parentnode=assignment)\
+                .values_list('user', flat=True).distinct()
+        for user in User.objects.filter(id__in=userids).order_by('id'):
+            yield AssignmentGroup.published_where_is_examiner(user, old=False).filter(parentnode=assignment)
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        root = get_cache_root()
+        if not root:
+            raise CommandError('DEVILRY_ARCHIVE_CACHE_ROOT is not set.')
+        try:
+            assignmentids = [int(arg) for arg in args]
+        except ValueError:
+            raise CommandError('Assignment ids must be integers.')
+
+        built = 0
+        for assignment in self.get_assignments(assignmentids, options['days']):
+            # Examiners with the same groups share one archive
+            keys = set()
+            for assignmentgroups in self.iter_assignmentgroup_qrys(assignment):
+                cached = CachedArchive(root, assignment, assignmentgroups, options['archive_type'])
+                if cached.key in keys or cached.exists():
+                    continue
+                keys.add(cached.key)
+                cached.build()
+                built += 1
+                if verbosity > 1:
+                    print 'Built {0}'.format(cached.filepath)
+        if verbosity > 0:
+            print 'Built {0} archives.'.format(built)
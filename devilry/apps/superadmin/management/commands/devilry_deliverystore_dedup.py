@@ -0,0 +1,46 @@
+import os
+from os.path import join
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from devilry.apps.core.deliverystore import FsHierDedupDeliveryStore
+
+
+class Command(NoArgsCommand):
+    help = 'Convert a FsHierDeliveryStore in place to a FsHierDedupDeliveryStore. '\
+            'Files with identical contents are replaced by hard links to a single '\
+            'copy. Safe to run more than once, and safe to interrupt. '\
+            'Set DEVILRY_DELIVERY_STORE_BACKEND to '\
+            '"devilry.apps.core.deliverystore.FsHierDedupDeliveryStore" '\
+            'before running this, or stop all writes to the store while it runs.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--root',
+            dest='root',
+            default=None,
+            help='Root directory of the store. Defaults to the DEVILRY_FSHIERDELIVERYSTORE_ROOT setting.'),
+    )
+
+    def iter_filepaths(self, store):
+        skip = (store.BLOBS_DIRNAME, store.TMP_DIRNAME)
+        for dirpath, dirnames, filenames in os.walk(store.root):
+            if dirpath == store.root:
+                dirnames[:] = [d for d in dirnames if not d in skip]
+            dirnames.sort()
+            for filename in sorted(filenames):
+                yield join(dirpath, filename)
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        store = FsHierDedupDeliveryStore(root=options['root'])
+
+        filecount = 0
+        freed = 0
+        for filepath in self.iter_filepaths(store):
+            bytes_freed = store.deduplicate_file(filepath)
+            if verbosity > 1 and bytes_freed:
+                print 'Deduplicated {0} ({1} bytes)'.format(filepath, bytes_freed)
+            freed += bytes_freed
+            filecount += 1
+        if verbosity > 0:
+            print 'Processed {0} files. Freed {1} bytes.'.format(filecount, freed)
@@ -0,0 +1,121 @@
+import os
+from os.path import join, exists, relpath
+from time import time
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from devilry.apps.core.models import FileMeta
+from devilry.apps.core.deliverystore import FsDeliveryStore
+
+
+class Command(NoArgsCommand):
+    help = 'Find files in the deliverystore without a corresponding FileMeta, '\
+            'and files no longer used by the deliverystore (such as unreferenced '\
+            'blobs and temporary files in FsHierDedupDeliveryStore), and delete '\
+            'them or move them to a quarantine directory. Only works with '\
+            'FsDeliveryStore and its subclasses.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--dry-run',
+            dest='dryrun',
+            action='store_true',
+            default=False,
+            help='Only report the orphaned files. Do not remove or move anything.'),
+        make_option('--quarantine',
+            dest='quarantine',
+            default=None,
+            help=('Move orphaned files to this directory instead of deleting them. '
+                  'The path of each file relative to the deliverystore root is kept.')),
+        make_option('--threads',
+            dest='threads',
+            type='int',
+            default=4,
+            help='Number of directories to scan in parallel. Defaults to 4.'),
+        make_option('--min-age',
+            dest='min_age',
+            type='int',
+            default=24,
+            help=('Ignore files modified or linked less than this many hours ago. '
+                  'Files are written before the transaction creating their FileMeta '
+                  'is committed, so this must be longer than any upload. Defaults to 24.')),
+        make_option('--batchsize',
+            dest='batchsize',
+            type='int',
+            default=500,
+            help='Number of delivery ids to look up FileMetas for in each query. Defaults to 500.'),
+    )
+
+    def get_existing_filemetaids(self, deliveryids, batchsize):
+        """ Get the set of ``(deliveryid, filemetaid)`` for all FileMetas in
+        the given deliveries, with one query per ``batchsize`` deliveries. """
+        existing = set()
+        deliveryids = sorted(deliveryids)
+        for index in xrange(0, len(deliveryids), batchsize):
+            batch = deliveryids[index:index+batchsize]
+            qry = FileMeta.objects.filter(delivery__in=batch).order_by('id')
+            existing.update(qry.values_list('delivery', 'id'))
+        return existing
+
+    def collect(self, store, filepath, stat, dryrun, quarantine, verbosity):
+        """ Remove or quarantine the orphaned file at ``filepath``, and return
+        the number of bytes freed (or that would be freed on dry run). """
+        if verbosity > 1 or dryrun:
+            print 'Orphan: {0} ({1} bytes)'.format(filepath, stat.st_size)
+        if dryrun:
+            return store.get_freed_size(filepath, stat)
+        elif quarantine:
+            targetpath = join(quarantine, relpath(filepath, store.root))
+            return store.quarantine_filepath(filepath, targetpath)
+        else:
+            return store.remove_filepath(filepath)
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        dryrun = options['dryrun']
+        quarantine = options['quarantine']
+        batchsize = options['batchsize']
+        store = FileMeta.deliverystore
+        if not isinstance(store, FsDeliveryStore):
+            raise CommandError('The deliverystore, {0}, is not a FsDeliveryStore.'.format(
+                store.__class__.__name__))
+        if quarantine and not dryrun and not exists(quarantine):
+            os.makedirs(quarantine)
+        newest_allowed = time() - options['min_age']*3600
+
+        filecount = 0
+        orphancount = 0
+        reclaimed = 0
+        pool = ThreadPool(options['threads'])
+        try:
+            # The filesystem is scanned in the pool, while the database
+            # lookups run in this thread, one parentdir at a time.
+            for files in pool.imap_unordered(store.list_files_in_parentdir,
+                                             store.get_delivery_parentdirs()):
+                filecount += len(files)
+                deliveryids = set(deliveryid for deliveryid, filemetaid, filepath, stat in files)
+                existing = self.get_existing_filemetaids(deliveryids, batchsize)
+                for deliveryid, filemetaid, filepath, stat in files:
+                    if (deliveryid, filemetaid) in existing or \
+                            store.get_modified_time(stat) > newest_allowed:
+                        continue
+                    orphancount += 1
+                    reclaimed += self.collect(store, filepath, stat, dryrun, quarantine, verbosity)
+        finally:
+            pool.close()
+            pool.join()
+
+        for filepath, stat in store.list_unreferenced_files(newest_allowed):
+            filecount += 1
+            orphancount += 1
+            reclaimed += self.collect(store, filepath, stat, dryrun, quarantine, verbosity)
+
+        if verbosity > 0:
+            if dryrun:
+                action = 'would be reclaimed (dry run)'
+            elif quarantine:
+                action = 'moved to {0}'.format(quarantine)
+            else:
+                action = 'reclaimed'
+            print 'Scanned {0} files. Found {1} orphaned files. {2} bytes {3}.'.format(
+                filecount, orphancount, reclaimed, action)
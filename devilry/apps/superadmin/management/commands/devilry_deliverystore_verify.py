@@ -0,0 +1,138 @@
+from os.path import exists
+from os import remove
+from hashlib import sha256
+from zlib import crc32
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from devilry.apps.core.models import FileMeta
+from devilry.apps.core.deliverystore import FileNotFoundError
+
+
+def verify_filemeta(filemeta, chunksize=65536):
+    """ Read the file for ``filemeta`` from the deliverystore, and compare it
+    to the size and digest stored on ``filemeta``.
+
+    :return: ``(filemeta, status, digest, crc)`` where status is one of
+        ``'ok'``, ``'missing'``, ``'corrupt'`` or ``'nodigest'`` (the file
+        was read successfully and has the stored size, but there is no
+        stored digest to compare with). ``digest`` and ``crc`` are the
+        SHA-256 and CRC-32 of the file.
+    """
+    try:
+        fileobj = filemeta.deliverystore.read_open(filemeta)
+    except FileNotFoundError:
+        return filemeta, 'missing', None, None
+    checksum = sha256()
+    crc = 0
+    size = 0
+    try:
+        while True:
+            data = fileobj.read(chunksize)
+            if not data:
+                break
+            checksum.update(data)
+            crc = crc32(data, crc)
+            size += len(data)
+    finally:
+        fileobj.close()
+    digest = checksum.hexdigest()
+    crc &= 0xffffffff
+    if size != filemeta.size:
+        return filemeta, 'corrupt', digest, crc
+    if not filemeta.digest:
+        return filemeta, 'nodigest', digest, crc
+    if digest != filemeta.digest or \
+            filemeta.crc32 not in (None, crc):
+        return filemeta, 'corrupt', digest, crc
+    return filemeta, 'ok', digest, crc
+
+
+class Command(NoArgsCommand):
+    help = 'Verify the contents of every file in the deliverystore against the '\
+            'size and SHA-256 digest stored on its FileMeta. Prints missing and '\
+            'corrupt files. Use --checkpoint to be able to resume an interrupted run.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threads',
+            dest='threads',
+            type='int',
+            default=4,
+            help='Number of files to verify in parallel. Defaults to 4.'),
+        make_option('--batchsize',
+            dest='batchsize',
+            type='int',
+            default=500,
+            help='Number of FileMetas to load from the database at a time. Defaults to 500.'),
+        make_option('--checkpoint',
+            dest='checkpoint',
+            default=None,
+            help=('Path to a checkpoint file. The id of the last verified FileMeta is '
+                  'saved in this file after each batch, and a run continues from the '
+                  'checkpoint if the file exists. The file is removed when all '
+                  'files are verified.')),
+        make_option('--set-missing-digests',
+            dest='set_missing_digests',
+            action='store_true',
+            default=False,
+            help=('Store the computed digest and CRC-32 on FileMetas without them. '
+                  'Files with the wrong size are reported as corrupt, and not updated.')),
+    )
+
+    def read_checkpoint(self, checkpoint):
+        if checkpoint and exists(checkpoint):
+            try:
+                return int(open(checkpoint).read().strip())
+            except ValueError:
+                raise CommandError('Invalid checkpoint file: {0}'.format(checkpoint))
+        return 0
+
+    def write_checkpoint(self, checkpoint, last_id):
+        f = open(checkpoint, 'w')
+        f.write(str(last_id))
+        f.close()
+
+    def iter_batches(self, last_id, batchsize):
+        while True:
+            batch = list(FileMeta.objects.select_related('delivery').filter(id__gt=last_id).order_by('id')[:batchsize])
+            if not batch:
+                break
+            yield batch
+            last_id = batch[-1].id
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        checkpoint = options['checkpoint']
+        last_id = self.read_checkpoint(checkpoint)
+        if verbosity > 0 and last_id:
+            print 'Resuming after FileMeta with id={0}.'.format(last_id)
+
+        counts = dict(ok=0, missing=0, corrupt=0, nodigest=0)
+        pool = ThreadPool(options['threads'])
+        try:
+            for batch in self.iter_batches(last_id, options['batchsize']):
+                for filemeta, status, digest, crc in pool.imap_unordered(verify_filemeta, batch):
+                    counts[status] += 1
+                    if status in ('missing', 'corrupt'):
+                        print '{0}: FileMeta id={1}, delivery id={2}, filename={3}'.format(
+                            status.upper(), filemeta.id, filemeta.delivery_id,
+                            filemeta.filename.encode('utf-8'))
+                    elif options['set_missing_digests'] and \
+                            (status == 'nodigest' or filemeta.crc32 is None):
+                        filemeta.digest = digest
+                        filemeta.crc32 = crc
+                        filemeta.save()
+                    if verbosity > 1 and status == 'ok':
+                        print 'OK: FileMeta id={0}'.format(filemeta.id)
+                if checkpoint:
+                    self.write_checkpoint(checkpoint, batch[-1].id)
+        finally:
+            pool.close()
+            pool.join()
+
+        if checkpoint and exists(checkpoint):
+            remove(checkpoint)
+        if verbosity > 0:
+            print ('Verified {ok} files successfully. {corrupt} corrupt, {missing} missing, '
+                   '{nodigest} without a stored digest.').format(**counts)
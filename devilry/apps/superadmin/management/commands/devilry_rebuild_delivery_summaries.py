@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.core.management.base import NoArgsCommand
+
+from devilry.apps.core.models import AssignmentGroup
+
+
+class Command(NoArgsCommand):
+    help = 'Recalculate the latest delivery, latest deadline and number of '\
+            'deliveries stored on each assignment group. Run this after '\
+            'changing deadlines or deliveries with SQL.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        with transaction.commit_on_success():
+            changed = AssignmentGroup.rebuild_delivery_summaries()
+        if verbosity > 0:
+            print 'Updated the delivery summary of {0} assignment groups.'.format(changed)
@@ -0,0 +1,18 @@
+from django.db import transaction
+from django.core.management.base import NoArgsCommand
+
+from devilry.apps.core.models import EffectiveRole
+from devilry.apps.core.models.effectiverole_sync import rebuild
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the effective roles of all users (core_effectiverole). '\
+            'Run this after upgrading devilry, and after changing admins, '\
+            'examiners or candidates with SQL.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        with transaction.commit_on_success():
+            rebuild()
+        if verbosity > 0:
+            print 'Rebuilt the effective roles with {0} rows.'.format(EffectiveRole.objects.count())
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.core.management.base import NoArgsCommand
+
+from devilry.apps.core.models import NodeClosure
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the closure table of the node hierarchy (core_nodeclosure). '\
+            'Run this after upgrading devilry, and after changing nodes with SQL.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        with transaction.commit_on_success():
+            NodeClosure.rebuild()
+        if verbosity > 0:
+            print 'Rebuilt the node closure with {0} rows.'.format(NodeClosure.objects.count())
@@ -0,0 +1,20 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+from devilry.simplified import searchindex
+
+
+class Command(NoArgsCommand):
+    help = 'Rebuild the search index used by free-text queries in the '\
+            'simplified API. Run this after enabling DEVILRY_SIMPLIFIED_SEARCH_INDEX, '\
+            'after loading data with SQL, and after upgrading devilry.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', '1'))
+        if not searchindex.is_enabled():
+            raise CommandError('DEVILRY_SIMPLIFIED_SEARCH_INDEX is not enabled.')
+        searchindex.autodiscover()
+        for index in searchindex.iter_searchindexes():
+            index.rebuild()
+            if verbosity > 0:
+                meta = index.modelcls._meta
+                print 'Indexed {0}.{1}'.format(meta.app_label, meta.object_name)
@@ -10,7 +10,6 @@ class SimplifiedAssignmentGroupMetaMixin(object):
     search and which fields can be used to search for an AssignmentGroup object
     using the Simplified API """
     model = models.AssignmentGroup
-    annotated_fields = ('latest_delivery_id', 'number_of_deliveries', 'latest_deadline_deadline', 'latest_deadline_id')
     resultfields = FieldSpec('id',
                              'name',
                              'is_open',
@@ -42,6 +41,9 @@ class SimplifiedAssignmentGroupMetaMixin(object):
                                       'parentnode__parentnode__parentnode__short_name']
                              )
     orderbyfields = ['candidates__identifier', 'candidates__full_name', 'candidates__email']
+    # The latest_* and number_of_deliveries fields are updated when
+    # deadlines and deliveries change
+    cache_dependencies = [models.Deadline, models.Delivery]
     searchfields = FieldSpec('name',
                              'candidates__identifier',
                              'candidates__full_name',
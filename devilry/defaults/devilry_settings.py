@@ -21,6 +21,70 @@ DEVILRY_HELP_URL = 'https://github.com/devilry/devilry-django/wiki'
 #Set max file size to 5MB. Files greater than this size are split into chunks of this size.
 DEVILRY_MAX_ARCHIVE_CHUNK_SIZE = 5000000
 
+# Data is sent from the archive download views each time this many bytes
+# have been written to the archive.
+DEVILRY_ARCHIVE_HIGH_WATER_MARK = 1000000
+
+# Number of threads reading files ahead while an archive is generated, and
+# the maximum number of bytes they may hold in memory. Set the number of
+# threads to 0 to disable read-ahead.
+DEVILRY_ARCHIVE_PREFETCH_THREADS = 4
+DEVILRY_ARCHIVE_PREFETCH_MAX_BYTES = 20000000
+
+# Number of threads compressing archives (ZIP and tar.gz) in parallel. 0
+# compresses in the thread generating the archive. Each download starts its
+# own threads, so only enable this when there are few concurrent downloads
+# and cores to spare.
+DEVILRY_ARCHIVE_COMPRESSION_THREADS = 0
+
+# Store files that are already compressed (decided by the file extension,
+# or the entropy of the first chunk) in ZIP archives instead of deflating
+# them again.
+DEVILRY_ARCHIVE_STORE_COMPRESSED_FILES = True
+
+# Send assignment ZIP archives without compression, with a Content-Length
+# and support for resuming interrupted downloads (HTTP Range requests).
+# Only used for files with a CRC-32 (see devilry_deliverystore_verify).
+# This trades compression (parallel compression and the compression
+# policy are not used) for resumable downloads, and the archive layout is
+# computed from the size and CRC-32 on the FileMetas. If those do not match
+# the files in the delivery store, the download ends up truncated or
+# corrupt, so run devilry_deliverystore_verify before enabling this.
+DEVILRY_ARCHIVE_RESUMABLE_DOWNLOADS = False
+
+# Directory where archives with all deliveries on an assignment are cached.
+# None disables the cache. Run the devilry_build_archive_cache management
+# command from cron to build archives when deadlines expire. See
+# devilry.utils.archive_cache.
+DEVILRY_ARCHIVE_CACHE_ROOT = None
+
+# Number of seconds the total number of results of a search in the
+# simplified API (and the RESTful API) is cached in the django cache. The
+# cached total may be wrong for this long after a change. 0 disables the
+# cache.
+DEVILRY_SEARCH_COUNT_CACHE_TIMEOUT = 0
+
+# Number of seconds the results of authorization checks (is_admin,
+# is_examiner, is_candidate and can_save) are cached in the django cache,
+# and shared between requests. The cached results are invalidated when
+# admins, examiners or candidates change. 0 only remembers the results
+# within a request. See devilry.apps.core.authcontext.
+DEVILRY_AUTHORIZATION_CACHE_TIMEOUT = 0
+
+# Match free-text queries in the simplified API (and the RESTful API) using
+# the search index (see devilry.simplified.searchindex) instead of
+# icontains on each searchfield. Run the devilry_rebuild_search_index
+# management command after enabling this.
+DEVILRY_SIMPLIFIED_SEARCH_INDEX = False
+
+# Number of seconds the results of search and read in the simplified API
+# (and the RESTful API) are cached in the django cache. The cached results
+# are invalidated when the objects they are read from change, or when the
+# roles of the user change. Results depending on the time (such as
+# assignments becoming published) may be out of date for this long. 0
+# disables the cache. See devilry.simplified.resultcache.
+DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT = 0
+
 DEVILRY_SEND_EMAIL_TO_USERS = True
 DEVILRY_EMAIL_SUBJECT_PREFIX_ADMIN = '[devilry-admin] '
 DEVILRY_EMAIL_SIGNATURE = "This is a message from the Devilry assignment delivery system. " \
@@ -28,6 +92,15 @@ DEVILRY_EMAIL_SIGNATURE = "This is a message from the Devilry assignment deliver
 
 DEVILRY_DELIVERY_STORE_BACKEND = 'devilry.apps.core.deliverystore.FsHierDeliveryStore'
 DEVILRY_FSHIERDELIVERYSTORE_INTERVAL = 1000
+
+## Let the web server send delivery files instead of Django. One of None,
+## 'xsendfile' (Apache mod_xsendfile/lighttpd), 'xaccelredirect' (nginx)
+## or 'wsgi' (wsgi.file_wrapper). See devilry.utils.sendfile.
+DEVILRY_SENDFILE_BACKEND = None
+## Used with 'xaccelredirect'. DEVILRY_XACCELREDIRECT_LOCATION must be an
+## internal nginx location with DEVILRY_XACCELREDIRECT_ROOT as alias.
+DEVILRY_XACCELREDIRECT_ROOT = None
+DEVILRY_XACCELREDIRECT_LOCATION = '/devilry-deliverystore/'
 DEVILRY_SYNCSYSTEM = 'YOUR MASTER SYSTEM HERE'
 
 ## Email pattern. Set this, and add 'devilry.apps.autoset_empty_email_by_username' to INSTALLED_APPS
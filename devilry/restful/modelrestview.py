@@ -175,6 +175,9 @@ class ModelRestfulView(RestfulView):
 
             resultlist = self.restultqry_to_list(qryresultwrapper)
             result = self.extjswrapshortcut(resultlist, total=qryresultwrapper.total)
+            if not isinstance(result, dict): # No total (count_total=0)
+                result = dict(items=result)
+            result['next_cursor'] = qryresultwrapper.get_next_cursor()
             return SerializableResult(result)
         else:
             return FormErrorSerializableResult(form, self.use_extjshacks)
@@ -19,4 +19,7 @@ def _create_seachform(cls):
         filter = fields.JsonListWithFallbackField()
         sort = fields.JsonListWithFallbackField(fallbackvalue=None)
         exact_number_of_results = fields.PositiveIntegerWithFallbackField(fallbackvalue=None)
+        cursor = fields.CharWithFallbackField()
+        count_total = fields.BooleanWithFallbackField(fallbackvalue=True)
+        estimate_total = fields.BooleanWithFallbackField()
     cls.SearchForm = SearchForm
@@ -1,5 +1,5 @@
 from exceptions import (SimplifiedException, PermissionDenied, InvalidUsername,
-                        InvalidNumberOfResults, FilterValidationError)
+                        InvalidNumberOfResults, FilterValidationError, InvalidCursor)
 from qryresultwrapper import QryResultWrapper
 from fieldspec import FieldSpec, OneToMany
 from modelapi import simplified_modelapi, SimplifiedModelApi, UnsupportedCrudsMethod
@@ -9,7 +9,7 @@ from filterspec import (FilterSpecs, FilterSpec, ForeignFilterSpec,
 
 
 __all__ = ('SimplifiedException', 'PermissionDenied', 'InvalidNumberOfResults', 'InvalidUsername',
-           'FilterValidationError', 'QryResultWrapper', 'FieldSpec', 'OneToMany',
+           'FilterValidationError', 'InvalidCursor', 'QryResultWrapper', 'FieldSpec', 'OneToMany',
            'simplified_modelapi', 'SimplifiedModelApi', 'FilterSpecs', 'FilterSpec',
            'ForeignFilterSpec', 'PatternFilterSpec', 'boolConverter', 'intConverter', 'noCandidateIdConverter',
            'intOrNoneConverter', 'dateTimeConverter', 'stringOrNoneConverter')
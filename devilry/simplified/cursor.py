@@ -0,0 +1,84 @@
+""" Opaque cursors for keyset pagination in
+:meth:`devilry.simplified.SimplifiedModelApi.search`.
+
+A cursor identifies the last item on a page, and is created from the
+ordering of the search and the orderby values and primary key of the item.
+The next page is the items ordered after these values, which the database
+finds using an index instead of counting past ``start`` items with OFFSET.
+
+Orderings that can not be expressed as keyset comparisons (annotated
+fields, nullable fields and fields on to-many relations) use cursors
+containing the offset of the next page instead.
+"""
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import date, time
+from decimal import Decimal
+
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.fields.related import ForeignKey
+
+from exceptions import InvalidCursor
+
+
+def _serialize_value(value):
+    if isinstance(value, (date, time, Decimal)):
+        # str() keeps the microseconds, and is parsed by the fields when
+        # the cursor is used in a lookup.
+        return str(value)
+    return value
+
+
+def encode_cursor(orderby, values=None, offset=None):
+    """ Create a cursor for the item with the given ``values`` (the values
+    of the fields in ``orderby`` followed by the primary key), or for the
+    item at ``offset`` if ``values`` is ``None``. """
+    if values is None:
+        data = dict(o=orderby, s=offset)
+    else:
+        data = dict(o=orderby, v=[_serialize_value(value) for value in values])
+    return urlsafe_b64encode(json.dumps(data, separators=(',', ':')))
+
+
+def decode_cursor(cursor, orderby):
+    """ Decode a cursor created by :func:`encode_cursor`.
+
+    :return: ``(values, offset)`` where one of them is ``None``.
+    :raise InvalidCursor: If the cursor is malformed, or was not created for ``orderby``.
+    """
+    try:
+        data = json.loads(urlsafe_b64decode(str(cursor)))
+        values = data.get('v')
+        offset = data.get('s')
+        cursor_orderby = data['o']
+    except (TypeError, ValueError, KeyError, AttributeError), e:
+        raise InvalidCursor('Invalid cursor: {0}'.format(cursor))
+    if cursor_orderby != list(orderby):
+        raise InvalidCursor('The cursor was created for another ordering.')
+    if values is not None:
+        if not isinstance(values, list) or len(values) != len(orderby) + 1:
+            raise InvalidCursor('Invalid cursor: {0}'.format(cursor))
+        return values, None
+    if not isinstance(offset, int) or offset < 0:
+        raise InvalidCursor('Invalid cursor: {0}'.format(cursor))
+    return None, offset
+
+
+def supports_keyset(modelcls, fieldname):
+    """ Check if items can be paged after their values in ``fieldname``
+    (without any ``-`` prefix) using keyset comparisons. This requires
+    ``fieldname`` to be a non-nullable field, following only non-nullable
+    foreign keys. """
+    path = fieldname.split('__')
+    for index, pathseg in enumerate(path):
+        try:
+            field, model, direct, m2m = modelcls._meta.get_field_by_name(pathseg)
+        except FieldDoesNotExist:
+            return False # Annotated field
+        if not direct or m2m or field.null:
+            return False
+        if index < len(path) - 1:
+            if not isinstance(field, ForeignKey):
+                return False
+            modelcls = field.rel.to
+    return True
@@ -17,3 +17,8 @@ class InvalidUsername(SimplifiedException):
 class FilterValidationError(SimplifiedException):
     """ Raised when an invalid filter is given to
     :meth:`devilry.simplified.SimplifiedModelApi.search`. """
+
+class InvalidCursor(SimplifiedException):
+    """ Raised when the *cursor* given to
+    :meth:`devilry.simplified.SimplifiedModelApi.search` is malformed, or
+    was created for another ordering. """
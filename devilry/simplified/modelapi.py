@@ -1,12 +1,18 @@
 from types import MethodType
 from django.db.models.fields import AutoField, FieldDoesNotExist
 from django.db import transaction
+from django.db.models import Model
+from django.core.exceptions import ValidationError
 
 
 from qryresultwrapper import QryResultWrapper
+from resultplanner import ResultPlanner
+from fieldspec import _is_local_field
 from utils import modelinstance_to_dict, get_field_from_fieldname, get_clspath
 from exceptions import PermissionDenied, InvalidNumberOfResults
 from filterspec import FilterSpecs
+import searchindex
+import resultcache
 
 
 
@@ -24,12 +30,19 @@ def _require_attr(cls, attr):
                                                                classname=cls.__name__,
                                                                attr=attr))
 
+def _is_editable_field(modelcls, fieldname):
+    try:
+        return modelcls._meta.get_field(fieldname).editable
+    except FieldDoesNotExist:
+        return True
+
 def _create_meta_ediablefields(cls):
     if hasattr(cls._meta, 'editablefields'):
         editablefields = cls._meta.editablefields
     else:
         editablefields = [f for f in cls._meta.resultfields.localfields_aslist() \
-                if not f in cls._meta.annotated_fields]
+                if not f in cls._meta.annotated_fields \
+                and _is_editable_field(cls._meta.model, f)]
         pk = cls._meta.model._meta.pk
         if pk.get_attname() in editablefields:
             if isinstance(pk, AutoField):
@@ -57,6 +70,20 @@ class SimplifiedModelApi(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def write_authorize_many(cls, user, objs):
+        """ Check if the given user has write permission on all the given objs.
+        Used by :meth:`createmany`, :meth:`updatemany` and :meth:`deletemany`.
+
+        Defaults to ``cls.write_authorize(user, obj)`` for each obj. Override
+        this to check the permissions of all the objs with a fixed number of
+        queries.
+
+        :raise PermissionDenied: If the given user do not have write permission on any of the given objs.
+        """
+        for obj in objs:
+            cls.write_authorize(user, obj)
+
     @classmethod
     def read_authorize(cls, user, obj):
         """ Check if the given user has read permission on the given obj.
@@ -83,6 +110,19 @@ class SimplifiedModelApi(object):
         except cls._meta.model.DoesNotExist, e:
             raise PermissionDenied() # Raise permission denied instead of "does not exist" to make it impossible to "brute force" query for existing items
 
+    @classmethod
+    def _getwrappers(cls, pks):
+        """ Get the objects with the given pks, in the same order, using one query. """
+        pkfield = cls._meta.model._meta.pk
+        try:
+            pks = [pkfield.to_python(pk) for pk in pks]
+        except ValidationError, e:
+            raise PermissionDenied()
+        objs = cls._meta.model.objects.in_bulk(pks)
+        if len(objs) != len(set(pks)):
+            raise PermissionDenied() # See _getwrapper()
+        return [objs[pk] for pk in pks]
+
     @classmethod
     def _writeauth_get(cls, user, pk):
         obj = cls._getwrapper(pk)
@@ -170,14 +210,18 @@ class SimplifiedModelApi(object):
         """
 
     @classmethod
-    def _create(cls, user, **field_values):
-        obj = cls._meta.model()
-        cls._set_values(obj, field_values)
-        cls.write_authorize(user, obj) # Important that this is after parentnode is set on Nodes, or admins on parentnode will not be permitted!
+    def _clean_and_save(cls, user, obj):
         cls.pre_full_clean(user, obj)
         obj.full_clean()
         obj.save()
         cls.post_save(user, obj)
+
+    @classmethod
+    def _create(cls, user, **field_values):
+        obj = cls._meta.model()
+        cls._set_values(obj, field_values)
+        cls.write_authorize(user, obj) # Important that this is after parentnode is set on Nodes, or admins on parentnode will not be permitted!
+        cls._clean_and_save(user, obj)
         return obj.pk
 
     @classmethod
@@ -201,18 +245,24 @@ class SimplifiedModelApi(object):
 
         This does the same as calling :meth:`create` many times, except that it
         does it all in a single transaction. This means that the database rolls
-        back the changes unless they all succeed.
+        back the changes unless they all succeed. All the objects are
+        authorized by one call to :meth:`write_authorize_many` before any of
+        them are saved.
 
         :param: list_of_field_values
             List of field_values dicts (see :meth:`create`).
         :return: List of the primary keys of the created objects.
         """
-        pks = []
-        with transaction.commit_manually():
+        with transaction.commit_on_success():
+            objs = []
             for field_values in list_of_field_values:
-                pks.append(cls._create(user, **field_values))
-            transaction.commit()
-        return pks
+                obj = cls._meta.model()
+                cls._set_values(obj, field_values)
+                objs.append(obj)
+            cls.write_authorize_many(user, objs)
+            for obj in objs:
+                cls._clean_and_save(user, obj)
+        return [obj.pk for obj in objs]
 
     @classmethod
     def read(cls, user, pk, result_fieldgroups=[]):
@@ -229,10 +279,39 @@ class SimplifiedModelApi(object):
         :throws PermissionDenied:
             If the given user does not have permission to view this object, or
             if the object does not exist.
+
+        The result is cached if ``DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT`` is
+        not ``0`` (see :mod:`devilry.simplified.resultcache`).
         """
-        obj = cls._readauth_get(user, pk) # authorization in cls._readauth_get
-        resultfields = cls._meta.resultfields.aslist(result_fieldgroups)
-        return modelinstance_to_dict(obj, resultfields)
+        cachekey = resultcache.get_key(cls, user, 'read', pk=unicode(pk),
+                                       result_fieldgroups=result_fieldgroups)
+        result = resultcache.get_cached(cachekey)
+        if result is None:
+            obj = cls._readauth_get(user, pk) # authorization in cls._readauth_get
+            resultfields = cls._meta.resultfields.aslist(result_fieldgroups)
+            result = cls._read_dict(obj, resultfields)
+            resultcache.store(cachekey, result)
+        return result
+
+    @classmethod
+    def _read_dict(cls, obj, resultfields):
+        """ Convert ``obj`` into a dict containing ``resultfields``.
+
+        Local fields are read from ``obj``. If any of the ``resultfields``
+        follow relations, the result is fetched with a
+        :class:`devilry.simplified.resultplanner.ResultPlanner`, which only
+        selects the requested columns of the related tables, instead of
+        loading each related object.
+        """
+        if all(_is_local_field(fieldname) for fieldname in resultfields):
+            return modelinstance_to_dict(obj, resultfields)
+        planner = ResultPlanner(cls._meta.model, resultfields)
+        if planner.fallback:
+            return modelinstance_to_dict(obj, resultfields)
+        results = planner.get_dicts(cls._meta.model.objects.filter(pk=obj.pk))
+        if not results:
+            raise PermissionDenied() # See _getwrapper()
+        return results[0]
 
     @classmethod
     def _update(cls, user, pk, **field_values):
@@ -241,10 +320,7 @@ class SimplifiedModelApi(object):
         # Important to write authorize after _set_values in case any attributes
         # used in write_authorize is changed by _set_values.
         cls.write_authorize(user, obj)
-        cls.pre_full_clean(user, obj)
-        obj.full_clean()
-        obj.save()
-        cls.post_save(user, obj)
+        cls._clean_and_save(user, obj)
         return obj.pk
 
     @classmethod
@@ -270,7 +346,9 @@ class SimplifiedModelApi(object):
 
         This does the same as calling :meth:`update` many times, except that it
         does it all in a single transaction. This means that the database rolls
-        back the changes unless they all succeed.
+        back the changes unless they all succeed. All the objects are fetched
+        with one query, and authorized by one call to
+        :meth:`write_authorize_many` before any of them are saved.
 
         :param: list_of_field_values
             List of field_values dicts (see :meth:`update`). Each dict _must_
@@ -278,13 +356,17 @@ class SimplifiedModelApi(object):
         :return: List of the primary keys of the updated objects.
         """
         pks = []
-        with transaction.commit_manually():
-            for field_values in list_of_field_values:
-                pk = field_values['pk']
-                del field_values['pk']
-                cls._update(user, pk, **field_values)
-                pks.append(pk)
-            transaction.commit()
+        for field_values in list_of_field_values:
+            pks.append(field_values['pk'])
+            del field_values['pk']
+        with transaction.commit_on_success():
+            objs = cls._getwrappers(pks)
+            for obj, field_values in zip(objs, list_of_field_values):
+                cls._set_values(obj, field_values)
+            # Important to write authorize after _set_values (see _update)
+            cls.write_authorize_many(user, objs)
+            for obj in objs:
+                cls._clean_and_save(user, obj)
         return pks
 
     @classmethod
@@ -321,23 +403,37 @@ class SimplifiedModelApi(object):
 
         This does the same as calling :meth:`delete` many times, except that it
         does it all in a single transaction. This means that the database rolls
-        back the changes unless they all succeed.
+        back the changes unless they all succeed. All the objects are fetched
+        with one query, authorized by one call to :meth:`write_authorize_many`,
+        and deleted with one ``QuerySet.delete()`` (unless the model overrides
+        ``delete()``).
 
         :param: list_of_pks
             List of primary-keys/ids of the objects to delete.
         :return: List of the primary keys of the deleted objects.
         """
-        with transaction.commit_manually():
-            for pk in list_of_pks:
-                cls._delete(user, pk)
-            transaction.commit()
+        with transaction.commit_on_success():
+            objs = cls._getwrappers(list_of_pks)
+            cls.write_authorize_many(user, objs)
+            model = cls._meta.model
+            if not user.is_superuser and not all(cls.is_empty(obj) for obj in objs):
+                # Objects may become empty when the objects before them
+                # are deleted, so check them one by one.
+                for obj in objs:
+                    cls._delete(user, obj.pk)
+            elif model.delete.im_func is not Model.delete.im_func:
+                for obj in objs:
+                    obj.delete()
+            else:
+                model.objects.filter(pk__in=[obj.pk for obj in objs]).delete()
         return list_of_pks
 
     @classmethod
     def search(cls, user,
                query = '', start = 0, limit = 50, orderby = None,
                result_fieldgroups=None, search_fieldgroups=None,
-               filters={}, exact_number_of_results=None):
+               filters={}, exact_number_of_results=None,
+               cursor=None, count_total=True, estimate_total=False):
         """ Search for objects.
 
         :param query:
@@ -370,6 +466,29 @@ class SimplifiedModelApi(object):
             Expect this exact number of results. If unspecified (``None``),
             this check is not performed. If the check fails,
             :exc:`devilry.simplified.InvalidNumberOfResults` is raised.
+        :param cursor:
+            Return the results after this cursor instead of the results
+            from ``start``. Cursors are created by
+            :meth:`devilry.simplified.QryResultWrapper.get_next_cursor`, and
+            must be used with the same ``query``, ``filters`` and ``orderby``
+            as the search that created them. Unlike ``start``, paging deep
+            into a large result with cursors costs the same as getting the
+            first page (except for orderings on annotated or nullable
+            fields, where the cursor is an offset). If the cursor is invalid,
+            :exc:`devilry.simplified.InvalidCursor` is raised.
+        :param count_total:
+            Count the total number of results, and set it as ``total`` on
+            the result. Defaults to ``True``. Counting is not free on large
+            results, so clients paging with cursors should only count when
+            they need the total.
+        :param estimate_total:
+            Set ``total`` to the number of results estimated by the database
+            instead of counting them (see
+            :meth:`devilry.simplified.QryResultWrapper.count`). Defaults to
+            ``False``.
+
+        The results are cached if ``DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT``
+        is not ``0`` (see :mod:`devilry.simplified.resultcache`).
 
         :return: The result of the search.
         :rtype: QryResultWrapper
@@ -379,10 +498,28 @@ class SimplifiedModelApi(object):
                                                     result_fieldgroups, search_fieldgroups,
                                                     filters, filterqry)
         orderby = orderby or cls._meta.ordering
-        result._query_order_and_limit(query = query,
-                                    start = start,
-                                    limit = limit,
-                                    orderby = orderby)
+        cachekey = resultcache.get_key(cls, user, 'search',
+                                       query=query, start=start, limit=limit,
+                                       orderby=orderby,
+                                       result_fieldgroups=result_fieldgroups,
+                                       search_fieldgroups=search_fieldgroups,
+                                       filters=filters, cursor=cursor,
+                                       count_total=count_total,
+                                       estimate_total=estimate_total)
+        cachedata = resultcache.get_cached(cachekey)
+        if cachedata is None:
+            result._query_order_and_limit(query = query,
+                                        start = start,
+                                        limit = limit,
+                                        orderby = orderby,
+                                        cursor = cursor,
+                                        count_total = count_total,
+                                        estimate_total = estimate_total)
+            if cachekey is not None:
+                cachedata = result._get_cachedata()
+                resultcache.store(cachekey, cachedata)
+        if cachedata is not None:
+            result._set_cachedata(cachedata)
         if exact_number_of_results != None:
             resultcount = len(result)
             if exact_number_of_results != resultcount:
@@ -461,6 +598,12 @@ def simplified_modelapi(cls):
         filters
             A :class:`devilry.simplified.FilterSpecs` limiting the possible
             filters to perform. Defaults to an empty ``FilterSpec``.
+        cache_dependencies
+            A list of models, in addition to the models in the fields
+            above, whose changes invalidate the cached results of
+            ``read()`` and ``search()`` (see
+            :mod:`devilry.simplified.resultcache`). Defaults to an empty
+            list.
 
     The ``cls`` must have the following methods for handling permissions:
 
@@ -525,4 +668,7 @@ def simplified_modelapi(cls):
         _validate_fieldnameiterator(cls, 'Meta.filters', cls._meta.filters)
     else:
         cls._meta.filters = FilterSpecs()
+
+    searchindex.register(cls._meta.model, cls._meta.searchfields.all_aslist())
+    resultcache.register(cls)
     return cls
@@ -1,6 +1,20 @@
+import re
+from hashlib import sha1
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
 from django.db.models import Q
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from resultplanner import ResultPlanner
+from cursor import encode_cursor, decode_cursor, supports_keyset
+from exceptions import InvalidCursor
+from searchindex import get_searchindex
 
-from utils import modelinstance_to_dict
+
+#: Marks that the next cursor is not known without querying.
+_UNKNOWN = object()
 
 
 class QryResultWrapper(object):
@@ -33,7 +47,9 @@ class QryResultWrapper(object):
     .. attribute:: total
 
         The total number of matches before slicing (before applying start and
-        limit).
+        limit). ``None`` if the search was made with ``count_total=False``.
+        This is an estimate if the search was made with
+        ``estimate_total=True`` (see :meth:`count`).
     """
     def __init__(self, resultfields, searchfields, django_qryset, orderbyfields=[]):
         self.resultfields = resultfields
@@ -41,26 +57,108 @@ class QryResultWrapper(object):
         self.searchfields = searchfields
         self._insecure_django_qryset = django_qryset
         self._cached_valuesqryset = None
+        self._orderby = None
+        self._cached_counts = {}
+        self._cached_results = None
+        self._next_cursor = _UNKNOWN
+        self.start = 0
+        self.limit = None
+
+    def _get_resultplanner(self):
+        return ResultPlanner.from_qryset(self._insecure_django_qryset, self.resultfields)
 
     def __getitem__(self, index):
         """ Get the result at the given ``index`` as a dict. """
-        return modelinstance_to_dict(self._insecure_django_qryset[index],
-                                     self.resultfields)
+        if self._cached_results is not None:
+            return self._cached_results[index]
+        results = self._get_resultplanner().get_dicts(self._insecure_django_qryset.all()[index:index+1])
+        if not results:
+            raise IndexError('QryResultWrapper index out of range')
+        return results[0]
 
     def __len__(self):
-        """ Shortcut for ``len(_insecure_django_qryset)``. """
-        return len(self._insecure_django_qryset)
+        """ Shortcut for :meth:`count`. """
+        return self.count()
+
+    def _get_fingerprint(self, qryset):
+        """ Get a key identifying the SQL query of ``qryset``, or ``None``
+        if it can not match anything. """
+        try:
+            sql, params = qryset.query.get_compiler(qryset.db).as_sql()
+        except EmptyResultSet:
+            return None
+        return sha1(repr((qryset.db, sql, params))).hexdigest()
+
+    def _estimate_count(self, qryset):
+        """ Get the number of rows estimated by the query planner, or
+        ``None`` if the database does not support estimates. """
+        connection = connections[qryset.db]
+        if connection.vendor != 'postgresql' or qryset.query.low_mark or \
+                qryset.query.high_mark is not None:
+            return None
+        sql, params = qryset.query.get_compiler(qryset.db).as_sql()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN ' + sql, params)
+        match = re.search(r'rows=(\d+)', cursor.fetchone()[0])
+        if match:
+            return int(match.group(1))
+        return None
+
+    def count(self, estimate=False):
+        """ Count the items in the result using ``SELECT COUNT`` (instead of
+        loading all the items).
 
-    def count(self):
-        """ Shortcut for ``_insecure_django_qryset.count()``. """
-        return len(self._insecure_django_qryset)
-        return self._insecure_django_qryset.count()
+        Counts are cached for each distinct SQL query, both in this object
+        and (if ``DEVILRY_SEARCH_COUNT_CACHE_TIMEOUT`` is not ``0``) in the
+        django cache, where they may be out of date for the number of
+        seconds in the setting.
+
+        :param estimate:
+            Use the number of rows estimated by the query planner instead
+            of counting. This is much faster than counting in large results,
+            but may be far off. Only supported on PostgreSQL. Other databases
+            count.
+        """
+        if self._cached_results is not None:
+            return len(self._cached_results)
+        qryset = self._insecure_django_qryset
+        fingerprint = self._get_fingerprint(qryset)
+        if fingerprint is None:
+            return 0
+        if estimate:
+            key = 'devilry.simplified.count.estimate.' + fingerprint
+        else:
+            key = 'devilry.simplified.count.' + fingerprint
+        if key in self._cached_counts:
+            return self._cached_counts[key]
+
+        timeout = getattr(settings, 'DEVILRY_SEARCH_COUNT_CACHE_TIMEOUT', 0)
+        result = None
+        if timeout:
+            result = cache.get(key)
+        if result is None:
+            if estimate:
+                result = self._estimate_count(qryset)
+            if result is None:
+                result = qryset.count()
+            if timeout:
+                cache.set(key, result, timeout)
+        self._cached_counts[key] = result
+        return result
 
     def __iter__(self):
         """ Iterate over all items in the result, yielding a dict
-        containing the result data for each item. """
-        for item in self._insecure_django_qryset.all():
-            yield modelinstance_to_dict(item, self.resultfields)
+        containing the result data for each item. The results are fetched
+        using a fixed number of queries (see
+        :class:`devilry.simplified.resultplanner.ResultPlanner`). """
+        if self._cached_results is not None:
+            for resultdct in self._cached_results:
+                yield resultdct
+            return
+        results = self._get_resultplanner().get_dicts(self._insecure_django_qryset.all())
+        self._next_cursor = self._get_next_cursor_from_results(results)
+        for resultdct in results:
+            yield resultdct
 
     def _create_q(self, query):
         """ Create a ``django.db.models.Q`` object from the given
@@ -78,6 +176,9 @@ class QryResultWrapper(object):
         return result_q
 
     def _create_word_q(self, queryword):
+        index = get_searchindex(self._insecure_django_qryset.model)
+        if index and index.can_search(self.searchfields, queryword):
+            return Q(pk__in=index.get_matching_pks(self.searchfields, queryword))
         filterargs = None
         for field in self.searchfields:
             q = Q(**{"%s__icontains" % field: queryword})
@@ -103,9 +204,99 @@ class QryResultWrapper(object):
 
     def _order_queryset(self, orderby):
         orderby_filtered = self._filter_orderby(orderby)
-        self._insecure_django_qryset = self._insecure_django_qryset.order_by(*orderby_filtered)
+        self._orderby = orderby_filtered
+        # Order by pk last, to give items with equal orderby values a stable
+        # order that cursors can page through.
+        self._insecure_django_qryset = self._insecure_django_qryset.order_by(*(orderby_filtered + ['pk']))
 
-    def _query_order_and_limit(self, query='', limit=50, start=0, orderby=[]):
+    def _supports_keyset(self):
+        if self._orderby is None:
+            return False
+        modelcls = self._insecure_django_qryset.model
+        for orderfield in self._orderby:
+            if not supports_keyset(modelcls, orderfield.lstrip('-')):
+                return False
+        return True
+
+    def _get_keyset_fields(self):
+        return [orderfield.lstrip('-') for orderfield in self._orderby or []] + ['pk']
+
+    def _create_keyset_q(self, values):
+        """ Create a ``django.db.models.Q`` object matching the items ordered
+        after the item with the given values for :meth:`_get_keyset_fields`. """
+        directions = [orderfield.startswith('-') for orderfield in self._orderby] + [False]
+        result_q = None
+        equal_q = Q()
+        for fieldname, descending, value in zip(self._get_keyset_fields(), directions, values):
+            lookup = '%s__%s' % (fieldname, 'lt' if descending else 'gt')
+            field_q = equal_q & Q(**{lookup: value})
+            if result_q == None:
+                result_q = field_q
+            else:
+                result_q |= field_q
+            equal_q &= Q(**{fieldname: value})
+        return result_q
+
+    def _apply_cursor(self, cursor):
+        """ Limit the queryset to the items after ``cursor``, and return
+        the offset of the cursor in the limited queryset. """
+        values, offset = decode_cursor(cursor, self._orderby or [])
+        if values is None:
+            return offset
+        if not self._supports_keyset():
+            raise InvalidCursor('The cursor was created for another ordering.')
+        self._insecure_django_qryset = self._insecure_django_qryset.filter(self._create_keyset_q(values))
+        return 0
+
+    def _create_next_cursor(self, count, getlastrow):
+        """ Create the cursor for the page after this page of ``count``
+        items. ``getlastrow()`` returns the values of
+        :meth:`_get_keyset_fields` on the last item. """
+        if count < self.limit:
+            return None
+        if self._supports_keyset():
+            return encode_cursor(self._orderby, values=getlastrow())
+        else:
+            return encode_cursor(self._orderby or [], offset=self.start + self.limit)
+
+    def _get_next_cursor_from_results(self, results):
+        """ Get the next cursor from the result dicts of this page, or
+        ``_UNKNOWN`` if the dicts do not contain the values required. """
+        if self.limit is None:
+            return None
+        pkname = self._insecure_django_qryset.model._meta.pk.name
+        fieldnames = [pkname if fieldname == 'pk' else fieldname
+                      for fieldname in self._get_keyset_fields()]
+        if results and self._supports_keyset():
+            for fieldname in fieldnames:
+                if not fieldname in results[-1]:
+                    return _UNKNOWN
+        return self._create_next_cursor(len(results),
+                lambda: [results[-1][fieldname] for fieldname in fieldnames])
+
+    def get_next_cursor(self):
+        """ Get an opaque cursor for the page after this result, or ``None``
+        if this is the last page. Give the cursor to
+        :meth:`devilry.simplified.SimplifiedModelApi.search` (with the same
+        arguments as the search giving this result) to get the next page.
+
+        The cursor contains the orderby values of the last item when
+        possible, so getting the next page does not require the database to
+        skip past all the items on the previous pages.
+
+        The cursor is found from the items of the page when they have been
+        iterated, and contain the orderby fields. Otherwise this queries
+        the orderby values of the page. """
+        if self._next_cursor is _UNKNOWN:
+            if self.limit is None:
+                return None
+            # Ordering on annotated fields requires them in the values query
+            rows = list(self._insecure_django_qryset.values_list(*self._get_keyset_fields()))
+            self._next_cursor = self._create_next_cursor(len(rows), lambda: rows[-1])
+        return self._next_cursor
+
+    def _query_order_and_limit(self, query='', limit=50, start=0, orderby=[],
+                               cursor=None, count_total=True, estimate_total=False):
         query = query.strip()
         if query:
             q = self._create_q(query)
@@ -113,5 +304,32 @@ class QryResultWrapper(object):
         self._insecure_django_qryset = self._insecure_django_qryset.distinct()
         if orderby:
             self._order_queryset(orderby)
-        self.total = self._insecure_django_qryset.count()
+        if count_total:
+            self.total = self.count(estimate=estimate_total)
+        else:
+            self.total = None
+        if cursor:
+            start = self._apply_cursor(cursor)
+        self.start = start
+        self.limit = limit
+        self._next_cursor = _UNKNOWN
         self._limit_queryset(limit, start)
+
+    def _get_cachedata(self):
+        """ Get the results, :attr:`total` and next cursor as a dict that
+        :meth:`_set_cachedata` can restore (see
+        :mod:`devilry.simplified.resultcache`). """
+        return dict(results=list(self),
+                    total=self.total,
+                    next_cursor=self.get_next_cursor(),
+                    start=self.start,
+                    limit=self.limit)
+
+    def _set_cachedata(self, cachedata):
+        """ Use the results in ``cachedata`` (from :meth:`_get_cachedata`)
+        instead of querying the database. """
+        self._cached_results = cachedata['results']
+        self._next_cursor = cachedata['next_cursor']
+        self.total = cachedata['total']
+        self.start = cachedata['start']
+        self.limit = cachedata['limit']
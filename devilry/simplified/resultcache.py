@@ -0,0 +1,162 @@
+"""
+Cache of the results of :meth:`devilry.simplified.SimplifiedModelApi.search`
+and :meth:`devilry.simplified.SimplifiedModelApi.read`.
+
+With ``DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT`` set to a number of seconds,
+the result dicts of each search and read are stored in the django cache. The
+key contains:
+
+- the simplified class.
+- the user. The querysets of the simplified classes are limited to the
+  objects where the user has a role, so results are never shared between
+  users.
+- the version of the roles of the user (see
+  :func:`devilry.apps.core.authcontext.get_role_version`), which changes
+  when the user gets or loses a role.
+- the normalised arguments of the search or read.
+- the generation of each model the results depend on. The generation of a
+  model is replaced when an object of the model is saved or deleted, and
+  when a many-to-many relation through the model changes.
+
+The models a simplified class depends on are its model, the models on the
+paths in its resultfields, searchfields and filters, and the models in the
+optional ``Meta.cache_dependencies`` (for columns updated by other models,
+such as the delivery summary on AssignmentGroup). Changes made without
+signals (such as ``QuerySet.update()`` and SQL) are not seen until the
+results time out. The same goes for results depending on the time, such as
+assignments becoming published.
+"""
+from hashlib import sha1
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from devilry.apps.core.authcontext import get_role_version
+from fieldspec import OneToMany
+from utils import get_clspath
+
+
+KEY_PREFIX = 'devilry.simplified.resultcache'
+
+_dependencies_by_cls = {}
+_connected_models = set()
+
+
+def get_timeout():
+    return getattr(settings, 'DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT', 0)
+
+def _get_generation_key(modelcls):
+    return '{0}.generation.{1}.{2}'.format(KEY_PREFIX, modelcls._meta.app_label,
+                                           modelcls._meta.object_name.lower())
+
+def invalidate_model(modelcls):
+    """ Invalidate all cached results depending on ``modelcls``. """
+    cache.delete(_get_generation_key(modelcls))
+
+
+def _walk_path(modelcls, fieldname):
+    """ Get ``(models, endmodel)``, where ``models`` are the models
+    (including many-to-many through models) on the ``__`` separated path
+    ``fieldname`` from ``modelcls``, and ``endmodel`` is the last of them. """
+    models = set()
+    for segment in fieldname.split('__'):
+        try:
+            field, model, direct, m2m = modelcls._meta.get_field_by_name(segment)
+        except FieldDoesNotExist:
+            break # Annotated field or property
+        if direct:
+            if not field.rel:
+                break
+            if m2m:
+                models.add(field.rel.through)
+            modelcls = field.rel.to
+        else:
+            # ``field`` is a django.db.models.related.RelatedObject
+            through = getattr(field.field.rel, 'through', None)
+            if through:
+                models.add(through)
+            modelcls = field.model
+        models.add(modelcls)
+    return models, modelcls
+
+def _get_dependencies(cls):
+    models = set([cls._meta.model])
+    models.update(getattr(cls._meta, 'cache_dependencies', []))
+    fieldnames = list(cls._meta.resultfields.all_aslist()) + \
+            list(cls._meta.searchfields.all_aslist()) + \
+            list(cls._meta.filters.iterfieldnames())
+    for fieldname in fieldnames:
+        if isinstance(fieldname, OneToMany):
+            relatedmodels, relatedcls = _walk_path(cls._meta.model, fieldname.related_field)
+            models.update(relatedmodels)
+            for subpath in fieldname.fields:
+                models.update(_walk_path(relatedcls, subpath)[0])
+        else:
+            models.update(_walk_path(cls._meta.model, fieldname)[0])
+    return models
+
+def register(cls):
+    """ Find the models the results of the simplified class ``cls`` depend
+    on, and invalidate the results when they change. """
+    dependencies = _get_dependencies(cls)
+    _dependencies_by_cls[cls] = sorted(dependencies, key=_get_generation_key)
+    for modelcls in dependencies:
+        if not modelcls in _connected_models:
+            _connected_models.add(modelcls)
+            uid = _get_generation_key(modelcls)
+            post_save.connect(_on_change, sender=modelcls, dispatch_uid=uid)
+            post_delete.connect(_on_change, sender=modelcls, dispatch_uid=uid)
+            m2m_changed.connect(_on_m2m_changed, sender=modelcls, dispatch_uid=uid)
+
+
+def _get_generations(cls):
+    keys = [_get_generation_key(modelcls) for modelcls in _dependencies_by_cls[cls]]
+    cached = cache.get_many(keys)
+    generations = []
+    for key in keys:
+        generation = cached.get(key)
+        if generation is None:
+            cache.add(key, uuid4().hex)
+            generation = cache.get(key)
+        generations.append(generation)
+    return generations
+
+def _normalise(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _normalise(item)) for key, item in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(_normalise(item) for item in value)
+    return value
+
+def get_key(cls, user, methodname, **kwargs):
+    """ Get the cache key of the result of ``cls.<methodname>(user, **kwargs)``,
+    or ``None`` if the cache is disabled. """
+    if not get_timeout():
+        return None
+    kwargs = _normalise(kwargs)
+    key = repr((get_clspath(cls), methodname, user.id, user.is_superuser,
+                get_role_version(user), kwargs, _get_generations(cls)))
+    return '{0}.{1}'.format(KEY_PREFIX, sha1(key).hexdigest())
+
+def get_cached(key):
+    """ Get the cached result with the given ``key`` (from :func:`get_key`),
+    or ``None``. """
+    if key is None:
+        return None
+    return cache.get(key)
+
+def store(key, result):
+    if key is not None:
+        cache.set(key, result, get_timeout())
+
+
+def _on_change(sender, **kwargs):
+    if get_timeout():
+        invalidate_model(sender)
+
+def _on_m2m_changed(sender, action, **kwargs):
+    if action.startswith('post_') and get_timeout():
+        invalidate_model(sender)
@@ -0,0 +1,255 @@
+""" Convert the results of a search into dicts using a fixed number of queries.
+
+:func:`devilry.simplified.utils.modelinstance_to_dict` follows ``__``
+paths one attribute at a time on each model instance, which means a query
+for each foreign key and to-many relation on each result. The
+:class:`ResultPlanner` compiles the resultfields into:
+
+- one ``values()`` query for the local fields, annotated fields and
+  ``__`` paths following foreign keys.
+- one ``values()`` query for each to-many relation (reverse foreign keys
+  and many-to-many fields) used by any resultfield, batched over all the
+  results using ``__in``.
+
+The dicts are assembled from these queries in python, and are the same as
+the ones created by ``modelinstance_to_dict``.
+"""
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.fields.related import ForeignKey, OneToOneField
+from django.db.models.sql.constants import JOIN_TYPE, LHS_ALIAS
+
+from fieldspec import OneToMany
+from utils import modelinstance_to_dict
+
+
+class _ToManyRelation(object):
+    """ A to-many relation followed by one or more resultfields.
+
+    ``keypath`` is the path to the model instance owning the relation (the
+    ``__`` path to a foreign key, or ``pk`` for the relations of the
+    results). The relation is fetched for all the values of ``keypath`` in
+    one query. """
+    def __init__(self, relatedmodel, filtername):
+        self.relatedmodel = relatedmodel
+        self.filtername = filtername
+        self.keypath = 'pk'
+        self.paths = [filtername]
+
+    def add_path(self, path):
+        if not path in self.paths:
+            self.paths.append(path)
+
+    def get_rows_by_key(self, keys):
+        """ Get a dict mapping each key in ``keys`` to a list of the related
+        rows (as dicts). Rows are ordered like in ``relatedmanager.all()``. """
+        rows_by_key = dict((key, []) for key in keys)
+        qry = self.relatedmodel._default_manager.filter(**{'%s__in' % self.filtername: keys})
+        for row in qry.values(*self.paths):
+            rows_by_key[row[self.filtername]].append(row)
+        return rows_by_key
+
+
+def _get_relation(modelcls, pathseg):
+    """ Get ``(modelcls, is_to_many, relation)`` for the relation named
+    ``pathseg`` on ``modelcls``, where ``modelcls`` is the model the
+    relation points to, and ``relation`` is a :class:`_ToManyRelation` if
+    ``is_to_many``. ``modelcls`` is ``None`` if ``pathseg`` is not a
+    relation.
+
+    :raise FieldDoesNotExist: If ``pathseg`` is not a field on ``modelcls``.
+    """
+    field, model, direct, m2m = modelcls._meta.get_field_by_name(pathseg)
+    if direct:
+        if m2m:
+            return field.rel.to, True, _ToManyRelation(field.rel.to, field.related_query_name())
+        elif isinstance(field, ForeignKey):
+            return field.rel.to, False, None
+        else:
+            return None, False, None
+    else:
+        # ``field`` is a django.db.models.related.RelatedObject
+        if isinstance(field.field, OneToOneField):
+            return field.model, False, None
+        return field.model, True, _ToManyRelation(field.model, field.field.name)
+
+
+def _promote_new_joins(query, old_aliases):
+    """ Make all joins added to ``query`` after the ``old_aliases`` (the
+    aliases in the query before ``values()`` was applied) left outer joins
+    if they follow a left outer join.
+
+    Django only promotes the joins following a nullable foreign key when the
+    nullable join is promoted by the same field, so ``feedback__delivery__number``
+    would become an inner join (and hide groups without feedback) if
+    ``feedback__points`` is fetched too. """
+    for alias in query.tables:
+        if alias in old_aliases:
+            continue
+        lhs_alias = query.alias_map[alias][LHS_ALIAS]
+        if lhs_alias and query.alias_map[lhs_alias][JOIN_TYPE] == query.LOUTER:
+            query.promote_alias(alias, unconditional=True)
+
+
+class UnsupportedResultField(Exception):
+    """ Raised when a resultfield can not be fetched by the planner. """
+
+
+class ResultPlanner(object):
+    """ Compiles a list of resultfields (the ``fieldnames`` argument to
+    :func:`devilry.simplified.utils.modelinstance_to_dict`) into a fixed
+    number of queries.
+
+    Paths following more than one to-many relation, and names that are not
+    fields or annotations (such as properties), can not be expressed in
+    ``values()`` queries. If ``fieldnames`` contains any of these,
+    :meth:`get_dicts` falls back to ``modelinstance_to_dict``.
+
+    .. attribute:: valuefields
+
+        The resultfields fetched by the main ``values()`` query.
+
+    .. attribute:: relations
+
+        Maps the path of each to-many relation used by the resultfields
+        (such as ``candidates`` or ``deadline__assignment_group__candidates``)
+        to a :class:`_ToManyRelation`.
+    """
+    def __init__(self, modelcls, fieldnames, annotated_fields=[]):
+        """
+        :param modelcls: The model class of the querysets given to :meth:`get_dicts`.
+        :param fieldnames: The resultfields.
+        :param annotated_fields: Names of annotations and extra selects on the querysets.
+        """
+        self.modelcls = modelcls
+        self.fieldnames = fieldnames
+        self.annotated_fields = annotated_fields
+        self.valuefields = []
+        self.relations = {}
+        self.tomanyfields = {}
+        self.skipped = set()
+        try:
+            for fieldname in fieldnames:
+                self._add_field(fieldname)
+        except UnsupportedResultField:
+            self.fallback = True
+        else:
+            self.fallback = False
+
+    @classmethod
+    def from_qryset(cls, qryset, fieldnames):
+        """ Create a ResultPlanner for ``fieldnames`` on querysets like ``qryset``. """
+        annotated_fields = qryset.query.aggregates.keys() + qryset.query.extra.keys()
+        return cls(qryset.model, fieldnames, annotated_fields)
+
+    def _get_relation(self, name, modelcls, pathseg):
+        try:
+            return _get_relation(modelcls, pathseg)
+        except FieldDoesNotExist:
+            raise UnsupportedResultField(name)
+
+    def _add_tomany_path(self, name, keypath, relationname, relation, modelcls, subpath):
+        """ Add ``subpath``, which must only follow foreign keys, on the
+        to-many relation ``relationname`` on the instance at ``keypath``. """
+        for segment in subpath.split('__')[:-1]:
+            modelcls, is_to_many, subrelation = self._get_relation(name, modelcls, segment)
+            if modelcls is None or is_to_many:
+                raise UnsupportedResultField(name)
+        if keypath:
+            relationpath = '%s__%s' % (keypath, relationname)
+        else:
+            relationpath = relationname
+            keypath = 'pk'
+        relation = self.relations.setdefault(relationpath, relation)
+        relation.keypath = keypath
+        relation.add_path(subpath)
+        return relationpath
+
+    def _add_field(self, fieldname):
+        if isinstance(fieldname, OneToMany):
+            onetomany = fieldname
+            name = onetomany.related_field
+            modelcls, is_to_many, relation = self._get_relation(name, self.modelcls, name)
+            if not is_to_many or not onetomany.fields:
+                raise UnsupportedResultField(name)
+            for subpath in onetomany.fields:
+                self._add_tomany_path(name, '', name, relation, modelcls, subpath)
+            self.tomanyfields[name] = (name, list(onetomany.fields))
+        elif fieldname in self.annotated_fields:
+            self.valuefields.append(fieldname)
+        elif '__' in fieldname:
+            modelcls = self.modelcls
+            path = fieldname.split('__')
+            for index, pathseg in enumerate(path[:-1]):
+                modelcls, is_to_many, relation = self._get_relation(fieldname, modelcls, pathseg)
+                if modelcls is None:
+                    raise UnsupportedResultField(fieldname)
+                if is_to_many:
+                    keypath = '__'.join(path[:index])
+                    subpath = '__'.join(path[index+1:])
+                    relationpath = self._add_tomany_path(fieldname, keypath, pathseg,
+                                                         relation, modelcls, subpath)
+                    self.tomanyfields[fieldname] = (relationpath, subpath)
+                    return
+            modelcls, is_to_many, relation = self._get_relation(fieldname, modelcls, path[-1])
+            if is_to_many:
+                raise UnsupportedResultField(fieldname)
+            self.valuefields.append(fieldname)
+        else:
+            try:
+                modelcls, is_to_many, relation = _get_relation(self.modelcls, fieldname)
+            except FieldDoesNotExist:
+                if hasattr(self.modelcls, fieldname):
+                    raise UnsupportedResultField(fieldname) # A property or method
+                else:
+                    self.skipped.add(fieldname) # Annotated field not available on this queryset
+                    return
+            if is_to_many:
+                raise UnsupportedResultField(fieldname)
+            self.valuefields.append(fieldname)
+
+    def get_dicts(self, qryset):
+        """ Get the results in ``qryset`` as a list of dicts. """
+        if self.fallback:
+            return [modelinstance_to_dict(instance, self.fieldnames) \
+                    for instance in qryset]
+        valuefields = list(self.valuefields)
+        for relation in self.relations.itervalues():
+            if relation.keypath != 'pk' and not relation.keypath in valuefields:
+                valuefields.append(relation.keypath)
+        valuesqry = qryset.values('pk', *valuefields)
+        _promote_new_joins(valuesqry.query, set(qryset.query.tables))
+        rows = list(valuesqry)
+        related_rows = {}
+        for relationpath, relation in self.relations.iteritems():
+            keys = set(row[relation.keypath] for row in rows)
+            keys.discard(None)
+            if keys:
+                related_rows[relationpath] = relation.get_rows_by_key(list(keys))
+            else:
+                related_rows[relationpath] = {}
+        return [self._create_dict(row, related_rows) for row in rows]
+
+    def _get_related_rows(self, row, related_rows, relationpath):
+        key = row[self.relations[relationpath].keypath]
+        if key is None:
+            return None # The foreign key to the instance owning the relation is null
+        return related_rows[relationpath][key]
+
+    def _create_dict(self, row, related_rows):
+        dct = {}
+        for fieldname in self.fieldnames:
+            if isinstance(fieldname, OneToMany):
+                relationpath, subpaths = self.tomanyfields[fieldname.related_field]
+                dct[fieldname.related_field] = \
+                        [dict((subpath, relatedrow[subpath]) for subpath in subpaths) \
+                         for relatedrow in self._get_related_rows(row, related_rows, relationpath)]
+            elif fieldname in self.tomanyfields:
+                relationpath, subpath = self.tomanyfields[fieldname]
+                relatedrows = self._get_related_rows(row, related_rows, relationpath)
+                if relatedrows is None:
+                    dct[fieldname] = None
+                else:
+                    dct[fieldname] = [relatedrow[subpath] for relatedrow in relatedrows]
+            elif not fieldname in self.skipped:
+                dct[fieldname] = row[fieldname]
+        return dct
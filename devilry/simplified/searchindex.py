@@ -0,0 +1,376 @@
+"""
+Search index for free-text queries in the simplified API.
+
+Without the index, :meth:`devilry.simplified.SimplifiedModelApi.search`
+matches each query word with ``icontains`` on every searchfield. This joins
+all the tables in the searchfields, makes the result ``distinct()``, and can
+not use an index in the database.
+
+The searchfields of each simplified class are registered when the class is
+defined (by :func:`devilry.simplified.simplified_modelapi`), and with
+``DEVILRY_SIMPLIFIED_SEARCH_INDEX`` enabled, they are indexed in the
+:class:`devilry.apps.core.models.SearchToken` table. A field value
+is split into lowercase words on whitespace, and the suffixes of each word
+starting at a *segment* (a run of letters or a run of digits) are stored as
+tokens. A query word matches the objects with a token *starting with* the
+word, using the index on the token column. This matches the start of any
+segment, so ``stud``, ``1``, ``example`` and ``com`` all find
+``stud1@example.com``, but unlike ``icontains``, ``tud`` does not. Storing
+every suffix would match like ``icontains``, but the number of tokens would
+grow with the length of the words instead of with the number of segments.
+
+The index is kept up to date by signal handlers on every model in the
+searchfields. For example, the ``candidates__student__username`` field of
+an AssignmentGroup is re-indexed when a Candidate is added to or removed
+from the group, and when the User changes username. Saves that do not
+change any indexed column do not touch the index. Changes are found by
+comparing the indexed columns with the values the instance was loaded (or
+last saved) with, so saving an instance does not query its old values.
+
+Searchfields following many-to-many relations are not indexed. Queries on
+them, and query words longer than ``SearchToken.MAX_LENGTH``, use
+``icontains``.
+
+Run the ``devilry_rebuild_search_index`` management command after enabling
+the index, after loading data without signals (such as with SQL), and after
+adding searchfields.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete
+from django.contrib.contenttypes.models import ContentType
+from django.utils.importlib import import_module
+from django.utils.module_loading import module_has_submodule
+
+
+#: Number of objects indexed in each query.
+BATCH_SIZE = 500
+
+#: Matches the segments where tokens start.
+_SEGMENT_PATTERN = re.compile(r'[^\W\d_]+|\d+', re.UNICODE)
+
+_searchindexes = {}
+_dependencies_by_model = {}
+
+
+def _get_searchtoken_model():
+    # Imported here since the core models import the apps in INSTALLED_APPS
+    # (including this one) when they are translated.
+    from devilry.apps.core.models import SearchToken
+    return SearchToken
+
+def tokenize(value):
+    """ Get the set of tokens for a field value: the suffixes of each word
+    starting at the word, or at a segment in the word. """
+    if value is None:
+        return set()
+    maxlength = _get_searchtoken_model().MAX_LENGTH
+    tokens = set()
+    for word in unicode(value).lower().split():
+        tokens.add(word[:maxlength])
+        for match in _SEGMENT_PATTERN.finditer(word):
+            tokens.add(word[match.start():match.start()+maxlength])
+    return tokens
+
+
+def _get_path_steps(modelcls, fieldname):
+    """ Get a list of ``(modelcls, field, direct)`` tuples for each segment
+    in the ``__`` separated ``fieldname``, or ``None`` if the path can not be
+    indexed. """
+    steps = []
+    segments = fieldname.split('__')
+    for index, segment in enumerate(segments):
+        try:
+            field, model, direct, m2m = modelcls._meta.get_field_by_name(segment)
+        except FieldDoesNotExist:
+            return None # Annotated field
+        if m2m:
+            return None
+        steps.append((modelcls, field, direct))
+        if index < len(segments) - 1:
+            if direct:
+                if not field.rel:
+                    return None
+                modelcls = field.rel.to
+            else:
+                modelcls = field.model
+    return steps
+
+
+class _Dependency(object):
+    """ The searchfields in ``searchindex`` depending on instances of
+    ``modelcls`` found by following ``prefix`` from the indexed model.
+
+    .. attribute:: columns
+
+        Maps the name of each field on ``modelcls`` that affects the
+        searchfields to its attname.
+
+    .. attribute:: has_link
+
+        ``True`` if ``modelcls`` has the foreign key linking it to the
+        objects in the index (such as ``Candidate.assignment_group``), which
+        means that creating and deleting ``modelcls`` objects changes the
+        indexed values.
+    """
+    def __init__(self, searchindex, modelcls, prefix):
+        self.searchindex = searchindex
+        self.modelcls = modelcls
+        self.prefix = prefix
+        self.fieldnames = set()
+        self.columns = {}
+        self.has_link = False
+
+    def affected_by_create(self):
+        return self.prefix is None or self.has_link
+
+    def get_root_pks(self, pk):
+        """ Get the pks of the indexed objects depending on the
+        ``modelcls`` object with the given pk. """
+        if self.prefix is None:
+            return set([pk])
+        qry = self.searchindex.modelcls._default_manager.filter(**{self.prefix: pk})
+        return set(qry.values_list('pk', flat=True))
+
+
+class SearchIndex(object):
+    """ The search index for one model.
+
+    .. attribute:: fieldnames
+
+        The indexed searchfields.
+    """
+    def __init__(self, modelcls):
+        self.modelcls = modelcls
+        self.fieldnames = set()
+        self.unindexed_fieldnames = set()
+        self.dependencies = {}
+
+    def _get_dependency(self, modelcls, prefix):
+        key = (modelcls, prefix)
+        if not key in self.dependencies:
+            dependency = _Dependency(self, modelcls, prefix)
+            self.dependencies[key] = dependency
+            _add_dependency(dependency)
+        return self.dependencies[key]
+
+    def add_fieldname(self, fieldname):
+        if fieldname in self.fieldnames or fieldname in self.unindexed_fieldnames:
+            return
+        steps = _get_path_steps(self.modelcls, fieldname)
+        if steps is None:
+            self.unindexed_fieldnames.add(fieldname)
+            return
+        self.fieldnames.add(fieldname)
+        segments = fieldname.split('__')
+        for index, (modelcls, field, direct) in enumerate(steps):
+            prefix = '__'.join(segments[:index]) or None
+            dependency = self._get_dependency(modelcls, prefix)
+            dependency.fieldnames.add(fieldname)
+            if direct:
+                dependency.columns[field.name] = field.attname
+            if index > 0:
+                prevmodelcls, prevfield, prevdirect = steps[index-1]
+                if not prevdirect:
+                    # Reverse relation: the foreign key is on this model
+                    linkfield = prevfield.field
+                    dependency.columns[linkfield.name] = linkfield.attname
+                    dependency.has_link = True
+
+    def can_search(self, searchfields, queryword):
+        """ Check if ``queryword`` can be matched against all the
+        ``searchfields`` using the index. """
+        return len(searchfields) > 0 and \
+                len(queryword) <= _get_searchtoken_model().MAX_LENGTH and \
+                self.fieldnames.issuperset(searchfields)
+
+    def get_matching_pks(self, searchfields, queryword):
+        """ Get a ``values()`` queryset with the pks of the objects where
+        any of the ``searchfields`` contains ``queryword`` (ignoring case).
+        Use it as the value of a ``pk__in`` lookup. """
+        SearchToken = _get_searchtoken_model()
+        contenttype = ContentType.objects.get_for_model(self.modelcls)
+        return SearchToken.objects.filter(content_type=contenttype,
+                                          fieldname__in=list(searchfields),
+                                          token__startswith=queryword.lower()).values('object_id')
+
+    def reindex(self, pks, fieldnames=None):
+        """ Update the tokens for ``fieldnames`` (defaults to all
+        :attr:`fieldnames`) of the objects with the given ``pks``. Objects
+        that do not exist are removed from the index. """
+        fieldnames = list(fieldnames or self.fieldnames)
+        pks = list(pks)
+        if not pks or not fieldnames:
+            return
+        SearchToken = _get_searchtoken_model()
+        contenttype_id = ContentType.objects.get_for_model(self.modelcls).id
+        qn = connection.ops.quote_name
+        table = qn(SearchToken._meta.db_table)
+        cursor = connection.cursor()
+        for start in xrange(0, len(pks), BATCH_SIZE):
+            batch = pks[start:start+BATCH_SIZE]
+            cursor.execute('DELETE FROM {table} WHERE {content_type} = %s '
+                           'AND {object_id} IN ({pks}) AND {fieldname} IN ({fieldnames})'.format(
+                               table=table,
+                               content_type=qn('content_type_id'),
+                               object_id=qn('object_id'),
+                               fieldname=qn('fieldname'),
+                               pks=', '.join(['%s'] * len(batch)),
+                               fieldnames=', '.join(['%s'] * len(fieldnames))),
+                           [contenttype_id] + batch + fieldnames)
+            rows = []
+            for fieldname in fieldnames:
+                seen = set()
+                qry = self.modelcls._default_manager.filter(pk__in=batch)
+                for pk, value in qry.values_list('pk', fieldname):
+                    for token in tokenize(value):
+                        if not (pk, token) in seen:
+                            seen.add((pk, token))
+                            rows.append((contenttype_id, pk, fieldname, token))
+            if rows:
+                cursor.executemany('INSERT INTO {table} ({content_type}, {object_id}, {fieldname}, {token}) '
+                                   'VALUES (%s, %s, %s, %s)'.format(
+                                       table=table,
+                                       content_type=qn('content_type_id'),
+                                       object_id=qn('object_id'),
+                                       fieldname=qn('fieldname'),
+                                       token=qn('token')),
+                                   rows)
+        transaction.commit_unless_managed()
+
+    def rebuild(self):
+        """ Re-index all objects of the model. """
+        SearchToken = _get_searchtoken_model()
+        contenttype = ContentType.objects.get_for_model(self.modelcls)
+        SearchToken.objects.filter(content_type=contenttype).delete()
+        pks = self.modelcls._default_manager.values_list('pk', flat=True).order_by('pk')
+        self.reindex(pks)
+
+
+def is_enabled():
+    return getattr(settings, 'DEVILRY_SIMPLIFIED_SEARCH_INDEX', False)
+
+def register(modelcls, fieldnames):
+    """ Index ``fieldnames`` on ``modelcls`` when the search index is
+    enabled. """
+    if not modelcls in _searchindexes:
+        _searchindexes[modelcls] = SearchIndex(modelcls)
+    searchindex = _searchindexes[modelcls]
+    for fieldname in fieldnames:
+        searchindex.add_fieldname(fieldname)
+
+def get_searchindex(modelcls):
+    """ Get the :class:`SearchIndex` for ``modelcls``, or ``None`` if it is
+    not indexed. """
+    if not is_enabled():
+        return None
+    return _searchindexes.get(modelcls)
+
+def iter_searchindexes():
+    return _searchindexes.itervalues()
+
+def autodiscover():
+    """ Import the ``simplified`` module of each app in ``INSTALLED_APPS``,
+    which registers the searchfields of the simplified classes defined
+    there. """
+    for appname in settings.INSTALLED_APPS:
+        app = import_module(appname)
+        if module_has_submodule(app, 'simplified'):
+            import_module('{0}.simplified'.format(appname))
+
+
+def _add_dependency(dependency):
+    modelcls = dependency.modelcls
+    if not modelcls in _dependencies_by_model:
+        _dependencies_by_model[modelcls] = []
+        uid = 'devilry.simplified.searchindex.{0}.{1}'.format(modelcls._meta.app_label,
+                                                              modelcls._meta.object_name)
+        post_init.connect(_on_post_init, sender=modelcls, dispatch_uid=uid)
+        pre_save.connect(_on_pre_save, sender=modelcls, dispatch_uid=uid)
+        post_save.connect(_on_post_save, sender=modelcls, dispatch_uid=uid)
+        pre_delete.connect(_on_pre_delete, sender=modelcls, dispatch_uid=uid)
+        post_delete.connect(_on_post_delete, sender=modelcls, dispatch_uid=uid)
+    _dependencies_by_model[modelcls].append(dependency)
+
+
+def _get_columns(sender):
+    columns = {}
+    for dependency in _dependencies_by_model[sender]:
+        columns.update(dependency.columns)
+    return columns
+
+def _remember_values(sender, instance):
+    """ Remember the values of the indexed columns of ``instance``, which
+    are compared with the values when it is saved. """
+    instance._searchindex_values = dict((name, getattr(instance, attname)) \
+                                        for name, attname in _get_columns(sender).iteritems())
+
+def _get_old_values(sender, instance, columns):
+    """ Get the stored values of the indexed columns of ``instance``, or
+    ``None`` if it is not stored. Instances that are not loaded from (or
+    saved to) the database, but have a pk, are queried. """
+    if instance.pk is None:
+        return None
+    if not instance._state.adding and hasattr(instance, '_searchindex_values'):
+        return instance._searchindex_values
+    rows = list(sender._default_manager.filter(pk=instance.pk).values('pk', *columns.keys()))
+    if rows:
+        return rows[0]
+    return None
+
+def _get_changed_dependencies(sender, instance):
+    """ Get the dependencies affected by saving ``instance``. """
+    dependencies = _dependencies_by_model[sender]
+    columns = _get_columns(sender)
+    oldvalues = _get_old_values(sender, instance, columns)
+    if oldvalues is None: # Created
+        return [dependency for dependency in dependencies \
+                if dependency.affected_by_create()]
+    changed = set(name for name, attname in columns.iteritems() \
+                  if oldvalues[name] != getattr(instance, attname))
+    return [dependency for dependency in dependencies \
+            if changed.intersection(dependency.columns)]
+
+def _on_post_init(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    if instance.pk is not None:
+        _remember_values(sender, instance)
+
+def _on_pre_save(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    pending = []
+    for dependency in _get_changed_dependencies(sender, instance):
+        oldroots = set()
+        if instance.pk is not None and dependency.prefix is not None:
+            oldroots = dependency.get_root_pks(instance.pk)
+        pending.append((dependency, oldroots))
+    instance._searchindex_pending = pending
+
+def _on_post_save(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    pending = getattr(instance, '_searchindex_pending', [])
+    instance._searchindex_pending = []
+    for dependency, oldroots in pending:
+        roots = oldroots.union(dependency.get_root_pks(instance.pk))
+        dependency.searchindex.reindex(roots, dependency.fieldnames)
+    _remember_values(sender, instance)
+
+def _on_pre_delete(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    instance._searchindex_pending = [(dependency, dependency.get_root_pks(instance.pk)) \
+                                     for dependency in _dependencies_by_model[sender]]
+
+def _on_post_delete(sender, instance, **kwargs):
+    if not is_enabled():
+        return
+    pending = getattr(instance, '_searchindex_pending', [])
+    instance._searchindex_pending = []
+    for dependency, roots in pending:
+        dependency.searchindex.reindex(roots, dependency.fieldnames)
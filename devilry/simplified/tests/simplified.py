@@ -1,6 +1,16 @@
 from django.test import TestCase
 from devilry.apps.core import testhelper
+from django.db.models import Count, Max
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from devilry.apps.core.models import AssignmentGroup, Period, SearchToken
 from ..utils import modelinstance_to_dict
+from ..resultplanner import ResultPlanner
+from ..exceptions import InvalidCursor, PermissionDenied
+from ..cursor import encode_cursor
+from .. import searchindex
+from ..searchindex import tokenize, get_searchindex
 
 from ..fieldspec import FieldSpec, OneToMany
 from ..filterspec import FilterSpecs, FilterSpec, PatternFilterSpec
@@ -77,6 +87,204 @@ class TestSimplifiedUtils(TestCase, testhelper.TestHelper):
         self.assertEquals(modeldict['candidates'], [{'student__username': u'stud1', 'student__devilryuserprofile__full_name': None},
                                                     {'student__username': u' stud2', 'student__devilryuserprofile__full_name': None}])
 
+    def _get_groupqry(self):
+        return AssignmentGroup.objects.all().annotate(max_delivery_id=Max('deadlines__deliveries__id'),
+                                                      deliverycount=Count('deadlines__deliveries')).order_by('id')
+
+    def test_resultplanner_assignmentgroup(self):
+        resultfields = FieldSpec('id', 'name', 'parentnode', 'feedback',
+                                 'latest_delivery_id', 'number_of_deliveries', 'latest_deadline_id',
+                                 'max_delivery_id', 'deliverycount', 'min_delivery_id',
+                                 OneToMany('candidates', fields=['identifier', 'student__username']),
+                                 'candidates__student__username', 'candidates__identifier',
+                                 'examiners__user__username', 'tags__tag',
+                                 'feedback__points', 'parentnode__short_name',
+                                 'parentnode__parentnode__parentnode__short_name').aslist()
+        self.add_to_path('uni;inf101.fall11.a1.g1:candidate(stud4)')
+        self.inf101_fall11_a1_g1.tags.create(tag='good')
+        planner = ResultPlanner.from_qryset(self._get_groupqry(), resultfields)
+        self.assertFalse(planner.fallback)
+        self.assertEquals(set(planner.relations.keys()), set(['candidates', 'examiners', 'tags']))
+
+        expected = [modelinstance_to_dict(group, resultfields) for group in self._get_groupqry()]
+        self.assertEquals(len(expected), 16)
+        with self.assertNumQueries(4):
+            result = planner.get_dicts(self._get_groupqry())
+        self.assertEquals(result, expected)
+        self.assertEquals(result[0]['candidates__student__username'][-1], 'stud4')
+        self.assertEquals(result[0]['tags__tag'], ['good'])
+        self.assertFalse('min_delivery_id' in result[0])
+        for row in result:
+            self.assertEquals(row['max_delivery_id'], row['latest_delivery_id'])
+            self.assertEquals(row['deliverycount'], row['number_of_deliveries'])
+
+    def test_resultplanner_manytomany(self):
+        resultfields = ['id', 'parentnode__short_name', 'admins__username']
+        self.inf101_fall11.admins.add(self.admin)
+        planner = ResultPlanner(Period, resultfields)
+        with self.assertNumQueries(2):
+            result = planner.get_dicts(Period.objects.all().order_by('id'))
+        self.assertEquals(result, [modelinstance_to_dict(period, resultfields) \
+                                   for period in Period.objects.all().order_by('id')])
+        self.assertEquals(result[0]['admins__username'], ['admin'])
+
+    def test_resultplanner_fallback(self):
+        resultfields = ['id', 'short_name', 'get_path']
+        planner = ResultPlanner(Period, resultfields)
+        self.assertTrue(planner.fallback)
+        self.assertEquals(planner.get_dicts(Period.objects.all().order_by('id')),
+                          [modelinstance_to_dict(period, resultfields) \
+                           for period in Period.objects.all().order_by('id')])
+
+    def _page_with_cursor(self, **kwargs):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        ids = []
+        cursor = None
+        while True:
+            result = SimplifiedAssignmentGroup.search(self.admin, limit=5, cursor=cursor,
+                                                      count_total=False, **kwargs)
+            self.assertEquals(result.total, None)
+            ids.extend(item['id'] for item in result)
+            cursor = result.get_next_cursor()
+            if not cursor:
+                break
+        expected = SimplifiedAssignmentGroup.search(self.admin, limit=100, **kwargs)
+        self.assertEquals(expected.total, 16)
+        self.assertEquals(ids, [item['id'] for item in expected])
+        return result
+
+    def test_read_projection(self):
+        from django.db import connection
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        delivery = self.add_delivery(self.inf101_fall11_a1_g1)
+        self.add_feedback(delivery)
+        group = AssignmentGroup.objects.get(id=self.inf101_fall11_a1_g1.id)
+        fieldgroups = [fieldgroup for fieldgroup in SimplifiedAssignmentGroup._meta.resultfields.additional_aslist() \
+                       if fieldgroup != 'feedback_rendered_view']
+        resultfields = SimplifiedAssignmentGroup._meta.resultfields.aslist(fieldgroups)
+        expected = modelinstance_to_dict(group, resultfields)
+        self.assertEquals(expected['feedback__grade'], 'A')
+
+        old_use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            startindex = len(connection.queries)
+            result = SimplifiedAssignmentGroup.read(self.admin, group.id, result_fieldgroups=fieldgroups)
+            sqls = [query['sql'] for query in connection.queries[startindex:]]
+        finally:
+            connection.use_debug_cursor = old_use_debug_cursor
+        self.assertEquals(result, expected)
+        self.assertFalse([sql for sql in sqls if 'rendered_view' in sql])
+
+        result = SimplifiedAssignmentGroup.read(self.admin, group.id,
+                                                result_fieldgroups=['feedback_rendered_view'])
+        self.assertEquals(result['feedback__rendered_view'], 'This is a default static feedback')
+
+    def test_model_to_dict_foreignkey(self):
+        group = AssignmentGroup.objects.get(id=self.inf101_fall11_a1_g1.id)
+        with self.assertNumQueries(0):
+            self.assertEquals(modelinstance_to_dict(group, ['parentnode', 'feedback']),
+                              {'parentnode': self.inf101_fall11_a1.id, 'feedback': None})
+
+    def test_search_cursor_keyset(self):
+        result = self._page_with_cursor(orderby=['-parentnode__short_name', 'is_open'])
+        self.assertTrue(result._supports_keyset())
+
+    def test_search_cursor_from_results(self):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        result = SimplifiedAssignmentGroup.search(self.admin, limit=5, orderby=['name'])
+        list(result)
+        with self.assertNumQueries(0):
+            cursor = result.get_next_cursor()
+        queried = SimplifiedAssignmentGroup.search(self.admin, limit=5, orderby=['name'])
+        self.assertEquals(queried.get_next_cursor(), cursor)
+
+        result = SimplifiedAssignmentGroup.search(self.admin, limit=100)
+        list(result)
+        with self.assertNumQueries(0):
+            self.assertEquals(result.get_next_cursor(), None)
+
+    def test_search_cursor_offset(self):
+        # Annotated fields can not be compared in keyset lookups
+        result = self._page_with_cursor(orderby=['-latest_deadline_deadline'])
+        self.assertFalse(result._supports_keyset())
+
+    def test_search_invalid_cursor(self):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        with self.assertRaises(InvalidCursor):
+            SimplifiedAssignmentGroup.search(self.admin, cursor='invalid')
+        with self.assertRaises(InvalidCursor):
+            SimplifiedAssignmentGroup.search(self.admin, orderby=['name'],
+                                             cursor=encode_cursor(['-name'], offset=5))
+
+    def test_search_count(self):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        result = SimplifiedAssignmentGroup.search(self.admin, limit=5)
+        self.assertEquals(result.total, 16)
+        with self.assertNumQueries(1):
+            self.assertEquals(len(result), 5)
+        with self.assertNumQueries(0):
+            self.assertEquals(result.count(), 5)
+        # Other databases than PostgreSQL count instead of estimating
+        result = SimplifiedAssignmentGroup.search(self.admin, estimate_total=True)
+        self.assertEquals(result.total, 16)
+
+    def test_search_count_cache(self):
+        from django.conf import settings
+        from django.core.cache import cache
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        settings.DEVILRY_SEARCH_COUNT_CACHE_TIMEOUT = 60
+        try:
+            cache.clear()
+            self.assertEquals(SimplifiedAssignmentGroup.search(self.admin).total, 16)
+            self.inf101_fall11_a1_g1.delete()
+            self.assertEquals(SimplifiedAssignmentGroup.search(self.admin).total, 16) # Cached
+        finally:
+            settings.DEVILRY_SEARCH_COUNT_CACHE_TIMEOUT = 0
+            cache.clear()
+        self.assertEquals(SimplifiedAssignmentGroup.search(self.admin).total, 15)
+
+    def test_result_cache(self):
+        from django.conf import settings
+        from django.core.cache import cache
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        settings.DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT = 60
+        try:
+            cache.clear()
+            group = self.inf101_fall11_a1_g1
+            result = SimplifiedAssignmentGroup.search(self.admin, limit=5, orderby=['id'])
+            expected = list(result)
+            next_cursor = result.get_next_cursor()
+            with self.assertNumQueries(0):
+                result = SimplifiedAssignmentGroup.search(self.admin, limit=5, orderby=('id',))
+                self.assertEquals(list(result), expected)
+                self.assertEquals(result.total, 16)
+                self.assertEquals(len(result), 5)
+                self.assertEquals(result[0]['id'], group.id)
+                self.assertEquals(result.get_next_cursor(), next_cursor)
+
+            self.assertEquals(SimplifiedAssignmentGroup.read(self.admin, group.id)['name'], 'g1')
+            with self.assertNumQueries(0):
+                self.assertEquals(SimplifiedAssignmentGroup.read(self.admin, group.id)['name'], 'g1')
+
+            group.name = 'renamed'
+            group.save()
+            self.assertEquals(SimplifiedAssignmentGroup.read(self.admin, group.id)['name'], 'renamed')
+            result = SimplifiedAssignmentGroup.search(self.admin, limit=5, orderby=['id'])
+            self.assertEquals(result[0]['name'], 'renamed')
+
+            # Changed by another model (see Meta.cache_dependencies)
+            self.add_delivery(group)
+            self.assertEquals(SimplifiedAssignmentGroup.read(self.admin, group.id)['number_of_deliveries'], 1)
+
+            # Changed roles
+            self.uni.admins.clear()
+            self.assertRaises(PermissionDenied, SimplifiedAssignmentGroup.read, self.admin, group.id)
+            self.assertEquals(SimplifiedAssignmentGroup.search(self.admin).total, 0)
+        finally:
+            settings.DEVILRY_SIMPLIFIED_RESULT_CACHE_TIMEOUT = 0
+            cache.clear()
+
     def test_fieldspec(self):
         fs1 = FieldSpec('value1', 'value2', group1=['groupval1', 'groupval2'])
         fs2 = FieldSpec('value3', 'value4', group1=['groupval3', 'groupval4'])
@@ -128,3 +336,98 @@ class TestSimplifiedUtils(TestCase, testhelper.TestHelper):
             fmerge = FilterSpecs(PatternFilterSpec('hello')) + FilterSpecs(PatternFilterSpec('hello'))
         with self.assertRaises(ValueError):
             fmerge = FilterSpecs(PatternFilterSpec('hello')) + FilterSpecs(FilterSpec('hello'))
+
+
+class TestSearchIndex(TestCase, testhelper.TestHelper):
+
+    def setUp(self):
+        from django.conf import settings
+        settings.DEVILRY_SIMPLIFIED_SEARCH_INDEX = True
+        searchindex.autodiscover()
+        self.add(nodes='uni:admin(admin)',
+                 subjects=['inf101', 'inf102'],
+                 periods=['fall11', 'spring11'],
+                 assignments=['a1', 'a2'],
+                 assignmentgroups=['g1:candidate(stud1, stud2):examiner(exam1)',
+                                   'g2:candidate(stud3):examiner(exam2)'],
+                 deadlines=['d1:ends(10)'])
+
+    def tearDown(self):
+        from django.conf import settings
+        settings.DEVILRY_SIMPLIFIED_SEARCH_INDEX = False
+
+    def test_searchindex_tokenize(self):
+        self.assertEquals(tokenize(None), set())
+        self.assertEquals(tokenize(u'INF 101'), set([u'inf', u'101']))
+        self.assertEquals(tokenize(u'stud1@Example.com'),
+                          set([u'stud1@example.com', u'1@example.com', u'example.com', u'com']))
+        self.assertEquals(len(max(tokenize('x'*60), key=len)), 50)
+
+    def _search_ids(self, query):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        return sorted(item['id'] for item in SimplifiedAssignmentGroup.search(self.admin, query=query,
+                                                                             limit=100))
+
+    def test_searchindex_search(self):
+        from devilry.apps.administrator.simplified import SimplifiedAssignmentGroup
+        result = SimplifiedAssignmentGroup.search(self.admin, query='stud3')
+        index = get_searchindex(AssignmentGroup)
+        self.assertTrue(index.can_search(result.searchfields, 'stud3'))
+        self.assertFalse(index.can_search(result.searchfields, 'x'*51))
+        queries = ('stud3', 'STUD', 'stud1 101', 'spring11 a2', 'nomatch', 'x'*51)
+        indexed = [self._search_ids(query) for query in queries]
+        del searchindex._searchindexes[AssignmentGroup] # Use icontains
+        try:
+            self.assertEquals(indexed, [self._search_ids(query) for query in queries])
+        finally:
+            searchindex._searchindexes[AssignmentGroup] = index
+        self.assertEquals(len(indexed[0]), 8)
+        self.assertEquals(self._search_ids('tud3'), []) # Not the start of a segment
+
+    def test_searchindex_update(self):
+        self.assertEquals(len(self._search_ids('exam2')), 8)
+        user = User.objects.get(username='exam2')
+        user.username = 'renamed'
+        user.save()
+        self.assertEquals(len(self._search_ids('exam2')), 0)
+        self.assertEquals(len(self._search_ids('renamed')), 8)
+
+        self.inf101_fall11_a1_g1.examiners.create(user=user)
+        self.assertEquals(len(self._search_ids('renamed')), 9)
+        self.inf101_fall11_a1_g1.examiners.get(user=user).delete()
+        self.assertEquals(len(self._search_ids('renamed')), 8)
+
+        self.inf101.short_name = self.inf101.long_name = 'inf999'
+        self.inf101.save()
+        self.assertEquals(len(self._search_ids('inf999')), 8)
+        self.assertEquals(len(self._search_ids('inf101')), 0)
+
+        groupid = self.inf102_spring11_a2_g2.id
+        self.inf102_spring11_a2_g2.delete()
+        self.assertEquals(SearchToken.objects.filter(object_id=groupid,
+                                                     content_type=ContentType.objects.get_for_model(AssignmentGroup)).count(), 0)
+
+    def test_searchindex_unchanged_save(self):
+        tokenids = list(SearchToken.objects.values_list('id', flat=True).order_by('id'))
+        self.inf101_fall11_a1_g1.is_open = False
+        self.inf101_fall11_a1_g1.save()
+        self.inf101_fall11_a1_g1.candidates.all()[0].save()
+        self.assertEquals(list(SearchToken.objects.values_list('id', flat=True).order_by('id')), tokenids)
+
+    def test_searchindex_changes_without_query(self):
+        from devilry.apps.core.models import Candidate
+        candidate = Candidate.objects.get(id=self.inf101_fall11_a1_g1.candidates.all()[0].id)
+        with self.assertNumQueries(0):
+            self.assertEquals(searchindex._get_changed_dependencies(Candidate, candidate), [])
+        candidate.student = User.objects.get(username='stud3')
+        with self.assertNumQueries(0):
+            self.assertNotEquals(searchindex._get_changed_dependencies(Candidate, candidate), [])
+        candidate.save()
+        with self.assertNumQueries(0):
+            self.assertEquals(searchindex._get_changed_dependencies(Candidate, candidate), [])
+
+    def test_searchindex_rebuild(self):
+        SearchToken.objects.all().delete()
+        self.assertEquals(len(self._search_ids('stud3')), 0)
+        call_command('devilry_rebuild_search_index', verbosity=0)
+        self.assertEquals(len(self._search_ids('stud3')), 8)
@@ -29,15 +29,15 @@ def get_field_from_fieldname(modelcls, fieldname, fkfield_as_idfield=False):
 
 
 def _get_instanceattr(instance, fieldname):
-    fieldvalue = getattr(instance, fieldname)
-    field = instance.__class__._meta.get_field_by_name(fieldname)[0]
+    try:
+        field = instance.__class__._meta.get_field_by_name(fieldname)[0]
+    except FieldDoesNotExist:
+        return getattr(instance, fieldname)
     if isinstance(field, ForeignKey):
-        if fieldvalue == None: # If the foreign key is null
-            return None
-        else:
-            return fieldvalue.pk
+        # Use the id instead of loading the related object
+        return getattr(instance, field.attname)
     else:
-        return fieldvalue
+        return getattr(instance, fieldname)
 
 def _recurse_getmodelattr(instance, path):
     pathseg = path.pop(0)
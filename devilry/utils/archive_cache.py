@@ -0,0 +1,237 @@
+"""
+Cache of pre-built assignment archives.
+
+When the deadlines of an assignment expire, many examiners download the
+archive with all deliveries on the assignment within a short time. Instead
+of generating the same archive for each of them, archives are stored in
+the ``DEVILRY_ARCHIVE_CACHE_ROOT`` directory (the cache is disabled when
+this is ``None``) like this::
+
+    <root>/<assignment id>/<groups key>-<fingerprint>.<archive type>
+
+``groups key`` identifies the set of groups in the archive. Administrators
+get all the groups on the assignment, while each examiner gets the groups
+where they are examiner, so an assignment may have many cached archives.
+``fingerprint`` is made from the number, the highest id and the total size
+of the files in those groups, and from the identifiers of their candidates
+(used in the directory names in the archive). Adding a file, or making the
+assignment anonymous, gives a new fingerprint, so a stale archive is never
+served, even if it was being built during the change.
+
+Archives are built by the ``devilry_build_archive_cache`` management
+command (run it from cron), and by the first download of an archive that is
+not in the cache. A lock file in the ``tmp`` directory makes sure only one
+process builds each archive. Downloads starting while the archive is being
+built get an archive generated without the cache. The signal handlers in this module (connected in
+:mod:`devilry.apps.examiner.models`) remove the cached archives of an
+assignment when a delivery, file, deadline or candidate on the assignment
+changes.
+"""
+import os
+import errno
+import time
+from os.path import join, exists, getmtime
+from shutil import rmtree
+from hashlib import sha1
+from tempfile import mkstemp
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse
+
+from devilry.apps.core.models import FileMeta, AssignmentGroup, Candidate
+
+from delivery_collection import (create_archive_from_assignment,
+                                 get_archive_from_archive_type,
+                                 get_assignment_entries, iter_archive_entries)
+from sendfile import create_path_response
+
+
+TMP_DIRNAME = 'tmp'
+
+#: Number of seconds before a build lock is considered left behind by a
+#: build that was killed, and is replaced.
+BUILD_LOCK_TIMEOUT = 3600
+
+
+def get_cache_root():
+    """ Get the cache directory, or ``None`` if the cache is disabled. """
+    return getattr(settings, 'DEVILRY_ARCHIVE_CACHE_ROOT', None)
+
+
+class CachedArchive(object):
+    """
+    An archive of all files delivered by ``assignmentgroups`` (a queryset)
+    on ``assignment``, in the cache directory ``root``. The constructor
+    runs three queries: one for the group ids, and two for the fingerprint.
+    """
+    def __init__(self, root, assignment, assignmentgroups, archive_type):
+        self.root = root
+        self.assignment = assignment
+        self.assignmentgroups = assignmentgroups
+        self.archive_type = archive_type
+        groupids = sorted(set(assignmentgroups.values_list('id', flat=True)))
+        self.key = sha1(','.join(str(groupid) for groupid in groupids)).hexdigest()
+        self.fingerprint = self._get_fingerprint()
+        self.dirpath = join(root, str(assignment.id))
+        self.filename = '{0}-{1}.{2}'.format(self.key, self.fingerprint, archive_type)
+        self.filepath = join(self.dirpath, self.filename)
+        self.tmpdir = join(root, TMP_DIRNAME)
+        self.lockpath = join(self.tmpdir, '{0}-{1}.lock'.format(assignment.id, self.filename))
+
+    def _get_fingerprint(self):
+        groupids = self.assignmentgroups.values('id')
+        stats = FileMeta.objects.filter(delivery__deadline__assignment_group__in=groupids)\
+                .aggregate(count=Count('id'), maxid=Max('id'), size=Sum('size'))
+        candidates = Candidate.objects.filter(assignment_group__in=groupids)\
+                .order_by('id').values_list('assignment_group', 'identifier')
+        candidates_key = sha1(repr(list(candidates))).hexdigest()[:12]
+        return '{0}-{1}-{2}-{3}'.format(stats['count'], stats['maxid'] or 0,
+                                        stats['size'] or 0, candidates_key)
+
+    def exists(self):
+        return exists(self.filepath)
+
+    def get_etag(self):
+        return '{0}-{1}-{2}'.format(self.key, self.fingerprint, int(getmtime(self.filepath)))
+
+    def iter_build(self):
+        """ Generate the archive, and return an iterator yielding the data
+        while it is written to a temporary file. The file is moved into the
+        cache when the archive is complete, and removed if the iterator is
+        not consumed to the end (typically because the client disconnected).
+        The database is queried here, and not while the iterator is
+        consumed.
+
+        If another process is building the archive when the iterator
+        starts, the archive is generated without the cache. """
+        entries = get_assignment_entries(self.assignment.get_path(), self.assignmentgroups)
+        return self._iter_build(entries)
+
+    def _lock(self):
+        """ Create the lock file held while the archive is built. Returns
+        ``False`` if another build holds the lock. """
+        if not exists(self.tmpdir):
+            os.makedirs(self.tmpdir)
+        for attempt in xrange(2):
+            try:
+                os.close(os.open(self.lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+            try:
+                if time.time() - getmtime(self.lockpath) < BUILD_LOCK_TIMEOUT:
+                    return False
+                os.remove(self.lockpath)
+            except OSError:
+                pass # Removed by the build holding it
+        return False
+
+    def _unlock(self):
+        try:
+            os.remove(self.lockpath)
+        except OSError:
+            pass # Removed with the cache directory
+
+    def _iter_build(self, entries, uncached_if_locked=True):
+        # The lock is taken when the iterator starts, since the finally
+        # clause releasing it does not run if it never starts.
+        if not self._lock():
+            if uncached_if_locked:
+                archive = get_archive_from_archive_type(self.archive_type)
+                for bytes in iter_archive_entries(archive, entries):
+                    yield bytes
+            return
+        try:
+            archive = get_archive_from_archive_type(self.archive_type)
+            fd, tmppath = mkstemp(dir=self.tmpdir)
+            tmpfile = os.fdopen(fd, 'wb')
+            try:
+                for bytes in iter_archive_entries(archive, entries):
+                    tmpfile.write(bytes)
+                    yield bytes
+                tmpfile.close()
+                self._install(tmppath)
+            finally:
+                tmpfile.close()
+                if exists(tmppath):
+                    os.remove(tmppath)
+        finally:
+            self._unlock()
+
+    def build(self):
+        """ Build the archive and put it in the cache. Does nothing if
+        another process is building it. """
+        entries = get_assignment_entries(self.assignment.get_path(), self.assignmentgroups)
+        for bytes in self._iter_build(entries, uncached_if_locked=False):
+            pass
+
+    def _install(self, tmppath):
+        if not exists(self.dirpath):
+            os.makedirs(self.dirpath)
+        os.chmod(tmppath, 0644)
+        os.rename(tmppath, self.filepath)
+        # Remove archives of the same groups with an older fingerprint
+        prefix = self.key + '-'
+        for filename in os.listdir(self.dirpath):
+            if filename.startswith(prefix) and filename != self.filename:
+                try:
+                    os.remove(join(self.dirpath, filename))
+                except OSError:
+                    pass # Removed by someone else
+
+    def create_response(self, request):
+        """ Create a response sending the archive. Serves the cached archive
+        if it exists, and builds it while sending it if it does not. """
+        content_type = "application/%s" % self.archive_type
+        if self.exists():
+            response = create_path_response(request, self.filepath,
+                                            content_type, self.get_etag())
+        else:
+            response = HttpResponse(self.iter_build(), mimetype=content_type)
+        response["Content-Disposition"] = "attachment; filename=%s.%s" % \
+                (self.assignment.get_path().encode("ascii", 'replace'), self.archive_type)
+        return response
+
+
+def create_cached_archive_from_assignment(request, assignment, assignmentgroups, archive_type):
+    """
+    Same as :func:`devilry.utils.delivery_collection.create_archive_from_assignment`,
+    but the archive is served from the cache if the cache is enabled.
+    """
+    root = get_cache_root()
+    if not root:
+        return create_archive_from_assignment(assignment, assignmentgroups, archive_type,
+                                              request=request)
+    return CachedArchive(root, assignment, assignmentgroups, archive_type).create_response(request)
+
+
+def invalidate_assignment(assignmentid):
+    """ Remove all cached archives for the assignment with the given id. """
+    root = get_cache_root()
+    if root:
+        rmtree(join(root, str(assignmentid)), ignore_errors=True)
+
+
+def _invalidate_assignments_for_groups(groupqry):
+    if not get_cache_root():
+        return
+    for assignmentid in set(groupqry.values_list('parentnode', flat=True)):
+        invalidate_assignment(assignmentid)
+
+
+def invalidate_on_filemeta_change(sender, instance, created=True, **kwargs):
+    # FileMetas are saved again when the upload is complete, but changes
+    # in size are covered by the fingerprint.
+    if created:
+        _invalidate_assignments_for_groups(
+            AssignmentGroup.objects.filter(deadlines__deliveries=instance.delivery_id))
+
+def invalidate_on_delivery_change(sender, instance, **kwargs):
+    _invalidate_assignments_for_groups(
+        AssignmentGroup.objects.filter(deadlines=instance.deadline_id))
+
+def invalidate_on_deadline_or_candidate_change(sender, instance, **kwargs):
+    _invalidate_assignments_for_groups(
+        AssignmentGroup.objects.filter(id=instance.assignment_group_id))
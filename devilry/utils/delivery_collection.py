@@ -1,20 +1,81 @@
+from datetime import datetime, timedelta
+from time import mktime
+from zipfile import ZIP_STORED
+
 from django.utils.formats import date_format
 from django.http import HttpResponse  
 from django.conf import settings
 
-from stream_archives import StreamableZip, StreamableTar
+from devilry.apps.core.models import FileMeta, Candidate, Delivery
+from devilry.defaults.encoding import ZIPFILE_FILENAME_CHARSET
+
+from stream_archives import (StreamableZip, StreamableTar, CompressionPolicy,
+                             ZipStreamWriter, SegmentedFile)
+from sendfile import create_fileobj_response
+from prefetch import iter_prefetched_files
 
 class ArchiveException(Exception):
     "Archive exceptions"
 
 
-def create_archive_from_assignmentgroups(assignmentgroups, file_name, archive_type):
+#: Response header with the token for the next incremental archive
+ARCHIVE_TOKEN_HEADER = 'X-Devilry-Archive-Token'
+ARCHIVE_TOKEN_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+#: Deliveries that are not marked as successful within this time after they
+#: were created are assumed to be abandoned by :func:`get_archive_token`.
+UPLOAD_TIMEOUT = timedelta(hours=1)
+
+
+def get_archive_token(assignmentgroups):
+    """
+    Get a token for the next incremental archive of the given
+    assignmentgroups (a queryset). Give the token to
+    :func:`parse_archive_token`, and the result as ``delivered_after`` to the
+    archive functions, to get the deliveries made after this call.
+
+    Files are uploaded to a delivery after it is created, and incremental
+    archives only include successful deliveries. The token is therefore the
+    time of the oldest delivery that is still being uploaded, if any, so the
+    delivery is included in the next archive when it is complete.
+    """
+    now = datetime.now()
+    uploading = Delivery.objects.filter(deadline__assignment_group__in=assignmentgroups.values('id'),
+                                        successful=False,
+                                        time_of_delivery__gt=now - UPLOAD_TIMEOUT)
+    oldest = uploading.order_by('time_of_delivery').values_list('time_of_delivery', flat=True)[:1]
+    if oldest:
+        now = min(now, oldest[0] - timedelta(microseconds=1))
+    return now.strftime(ARCHIVE_TOKEN_FORMAT)
+
+
+def parse_archive_token(token):
+    """
+    Parse a token from :func:`get_archive_token`, or a timestamp in ISO
+    format (``YYYY-MM-DDThh:mm:ss`` or ``YYYY-MM-DD``).
+
+    :return: The token as a datetime.
+    :raise ValueError: If ``token`` is invalid.
+    """
+    for format in (ARCHIVE_TOKEN_FORMAT, '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(token, format)
+        except ValueError:
+            pass
+    raise ValueError('Invalid archive token: {0!r}'.format(token))
+
+
+def create_archive_from_assignmentgroups(assignmentgroups, file_name, archive_type,
+                                         delivered_after=None):
     """
     Creates an archive of type archive_type, named file_name, containing all the 
     deliveries in each of the assignmentgroups in the list assignmentgroups. 
+    If ``delivered_after`` is given, only the successful deliveries made
+    after that time are included (see :func:`get_archive_token`).
     """
     archive = get_archive_from_archive_type(archive_type)
-    it = iter_archive_assignmentgroups(archive, assignmentgroups)
+    entries = _iter_assignmentgroup_entries(assignmentgroups, delivered_after)
+    it = iter_archive_entries(archive, entries)
     response = HttpResponse(it, mimetype="application/%s" % archive_type)
     response["Content-Disposition"] = "attachment; filename=%s.%s" % \
                                       (file_name, archive_type)  
@@ -37,21 +98,152 @@ def create_archive_from_delivery(delivery, archive_type):
     return response
 
 
+def create_archive_from_assignment(assignment, assignmentgroups, archive_type,
+                                   delivered_after=None, request=None):
+    """
+    Creates an archive of type archive_type, named assignment.get_path(),
+    containing all files delivered by the given assignmentgroups (a
+    queryset), organized by group, deadline and delivery. The archive is
+    streamed, so nothing is written to disk and sending starts right away.
+    See :func:`get_assignment_entries` for ``delivered_after``.
+
+    If the ``request`` is given, and ``DEVILRY_ARCHIVE_RESUMABLE_DOWNLOADS``
+    is enabled, ZIP archives are created with
+    :func:`create_resumable_zip_response` when all the files have a CRC-32.
+    """
+    rootdir_name = assignment.get_path()
+    entries = get_assignment_entries(rootdir_name, assignmentgroups, delivered_after)
+    if request is not None and archive_type == 'zip' \
+            and settings.DEVILRY_ARCHIVE_RESUMABLE_DOWNLOADS \
+            and all(filemeta.crc32 is not None for key, filemeta in entries if filemeta):
+        response = create_resumable_zip_response(request, entries)
+    else:
+        archive = get_archive_from_archive_type(archive_type)
+        it = iter_archive_entries(archive, entries)
+        response = HttpResponse(it, mimetype="application/%s" % archive_type)
+    response["Content-Disposition"] = "attachment; filename=%s.%s" % \
+                                      (rootdir_name.encode("ascii", 'replace'), archive_type)
+    return response
+
+
+def create_resumable_zip_response(request, entries):
+    """
+    Create a response with a ZIP archive of the given entries (see
+    :func:`iter_archive_entries`), where files are stored without
+    compression, with the time of delivery as timestamp. The archive is
+    the same byte for byte every time it is created from the same entries,
+    and its size and the position of each file are computed from the size
+    and CRC-32 stored on the FileMetas, without reading any files. This
+    gives a response with ``Content-Length``, ``ETag`` and support for
+    ``Range`` requests, where only the files in the range are read, so
+    interrupted downloads can be resumed.
+    """
+    layout = SegmentedFile()
+    writer = ZipStreamWriter(layout, compression=ZIP_STORED)
+    last_modified = 0
+    for (filename, bytes), filemeta in entries:
+        if filemeta is None:
+            writer.add_file(filename, bytes, compression=ZIP_STORED, timestamp=last_modified)
+        else:
+            timestamp = int(mktime(filemeta.delivery.time_of_delivery.timetuple()))
+            last_modified = max(last_modified, timestamp)
+            writer.add_file_reference(filename, filemeta.size, filemeta.crc32,
+                                      filemeta, timestamp)
+    writer.close()
+    return create_fileobj_response(request, lambda: layout.open(_read_open_filemeta),
+                                   layout.size, "application/zip",
+                                   layout.get_digest(), last_modified)
+
+
+def _read_open_filemeta(filemeta):
+    return filemeta.deliverystore.read_open(filemeta)
+
+
+def get_assignment_entries(rootdir_name, assignmentgroups, delivered_after=None):
+    """
+    Get the archive entries (see :func:`iter_archive_entries`) for all files
+    delivered by the given assignmentgroups (a queryset), named like this::
+
+        <rootdir_name>/<candidates>_group-<groupid>/deadline-<deadline>/delivery-<number>/<filename>
+
+    Uses one query for all the FileMetas, and one for all the candidates, no
+    matter how many groups, deadlines and deliveries there are. The queries
+    are evaluated here, and not while the archive is streamed.
+
+    If ``delivered_after`` (a datetime) is given, only the successful
+    deliveries with ``time_of_delivery`` after it are included.
+    """
+    groupids = assignmentgroups.values('id')
+    candidates = {}
+    for groupid, identifier in Candidate.objects.filter(assignment_group__in=groupids)\
+            .order_by('id').values_list('assignment_group', 'identifier'):
+        candidates.setdefault(groupid, []).append(identifier)
+
+    filemetas = FileMeta.objects.filter(delivery__deadline__assignment_group__in=groupids)
+    if delivered_after:
+        filemetas = filemetas.filter(delivery__time_of_delivery__gt=delivered_after,
+                                     delivery__successful=True)
+    filemetas = filemetas.select_related('delivery__deadline')\
+            .order_by('delivery__deadline__assignment_group',
+                      '-delivery__deadline__deadline',
+                      'delivery__number', 'filename')
+    filenametpl = u'{zip_rootdir_name}/{candidates}_group-{groupid}/deadline-{deadline}/delivery-{delivery_number}/{filename}'
+    entries = []
+    for filemeta in filemetas:
+        delivery = filemeta.delivery
+        deadline = delivery.deadline
+        groupid = deadline.assignment_group_id
+        filename = filenametpl.format(zip_rootdir_name=rootdir_name,
+                                      groupid=groupid,
+                                      candidates='-'.join(candidates.get(groupid, [])),
+                                      deadline=deadline.deadline.strftime("%Y-%m-%dT%H_%M_%S"),
+                                      delivery_number="%.3d" % delivery.number,
+                                      filename=filemeta.filename)
+        entries.append(((filename.encode(ZIPFILE_FILENAME_CHARSET), None), filemeta))
+    return entries
+
+
+def iter_archive_entries(archive, entries):
+    """
+    Adds the given entries to the archive, closes it, and yields the data.
+    ``entries`` is an iterable of ``((filename, None), filemeta)`` for files,
+    and ``((filename, bytes), None)`` for generated files.
+    """
+    try:
+        for bytes in _iter_write_entries(archive, entries):
+            yield bytes
+        archive.close()
+    finally:
+        archive.terminate()
+    yield archive.read()
+
+
 def iter_archive_deliveries(archive, group_name, directory_prefix, deliveries):
     """
-    Adds files one by one from the list of deliveries into the archive. 
-    After writing each file to the archive, the new bytes in the archive
-    is yielded. If a file is bigger than DEVILRY_MAX_ARCHIVE_CHUNK_SIZE,
-    only DEVILRY_MAX_ARCHIVE_CHUNK_SIZE bytes are written before it's yielded.
+    Adds files one by one from the list of deliveries into the archive,
+    closes it, and yields the data (see :func:`iter_archive_entries`).
+    Files are read and written to the archive in chunks of
+    DEVILRY_MAX_ARCHIVE_CHUNK_SIZE bytes, and the new bytes in the archive
+    are yielded whenever the archive passes its high water mark (see
+    :meth:`StreamableArchive.above_high_water_mark`).
     The returned object is an iterator.
     """
+    entries = _iter_delivery_entries(group_name, directory_prefix, deliveries)
+    return iter_archive_entries(archive, entries)
+
+
+def _iter_delivery_entries(group_name, directory_prefix, deliveries):
+    """
+    Iterate over the entries to add to the archive for the given deliveries.
+    See :func:`iter_archive_entries` for the format of the entries.
+    """
     include_delivery_explanation = False
     if len(deliveries) > 1:
         include_delivery_explanation = True
         multiple_deliveries_content = "Delivery-ID    File count    Total size"\
                                       "     Delivery time  \r\n"
     for delivery in deliveries:
-        metas = delivery.filemetas.all()
+        metas = list(delivery.filemetas.select_related('delivery'))
         delivery_size = 0
         for f in metas:
             delivery_size += f.size
@@ -60,29 +252,7 @@ def iter_archive_deliveries(archive, group_name, directory_prefix, deliveries):
             if include_delivery_explanation:
                 filename = "%s/%s/%d/%s" % (directory_prefix, group_name,
                                                 delivery.number, f.filename)
-            # File size is greater than DEVILRY_MAX_ARCHIVE_CHUNK_SIZE bytes
-            # Write only chunks of size DEVILRY_MAX_ARCHIVE_CHUNK_SIZE to the archive
-            if f.size > settings.DEVILRY_MAX_ARCHIVE_CHUNK_SIZE:
-                if not archive.can_write_chunks():
-                    raise ArchiveException("The size of file %s is greater than "\
-                                            "the maximum allowed size. Download "\
-                                            "stream aborted.")
-                chunk_size = settings.DEVILRY_MAX_ARCHIVE_CHUNK_SIZE
-                # Open file stream for reading
-                file_to_stream = f.read_open()
-                # Open a filestream in the archive
-                archive.open_filestream(filename, f.size)
-                for i in inclusive_range(chunk_size, f.size, chunk_size):
-                    bytes = file_to_stream.read(chunk_size)
-                    archive.append_file_chunk(bytes, len(bytes))
-                    # Read the chunk from the archive and yield the data
-                    yield archive.read()
-                archive.close_filestream()
-            else:
-                bytes = f.read_open().read(f.size)
-                archive.add_file(filename, bytes)
-                # Read the content from the streamable archive and yield the data
-                yield archive.read()            
+            yield (filename, None), f
         if include_delivery_explanation:
             multiple_deliveries_content += "  %3d            %3d          %5d"\
                                            "%s\r\n" % \
@@ -92,10 +262,42 @@ def iter_archive_deliveries(archive, group_name, directory_prefix, deliveries):
                                            "DATETIME_FORMAT"))
     # Adding file explaining multiple deliveries
     if include_delivery_explanation:
-        archive.add_file("%s/%s/%s" %
-                         (directory_prefix, group_name,
-                          "Deliveries.txt"),
-                         multiple_deliveries_content.encode("ascii"))
+        filename = "%s/%s/%s" % (directory_prefix, group_name, "Deliveries.txt")
+        yield (filename, multiple_deliveries_content.encode("ascii")), None
+
+
+def _iter_write_entries(archive, entries):
+    """
+    Write the entries (see :func:`iter_archive_entries`) to the archive.
+    The files are read ahead by :func:`devilry.utils.prefetch.iter_prefetched_files`
+    while the current file is compressed.
+    """
+    chunk_size = settings.DEVILRY_MAX_ARCHIVE_CHUNK_SIZE
+    prefetched_entries = iter_prefetched_files(entries, chunk_size,
+                                               settings.DEVILRY_ARCHIVE_PREFETCH_MAX_BYTES,
+                                               settings.DEVILRY_ARCHIVE_PREFETCH_THREADS)
+    for (filename, bytes), prefetched in prefetched_entries:
+        if prefetched is None:
+            archive.add_file(filename, bytes)
+        # Write only chunks of size DEVILRY_MAX_ARCHIVE_CHUNK_SIZE to the archive
+        elif archive.can_write_chunks():
+            # Open a filestream in the archive
+            archive.open_filestream(filename, prefetched.filemeta.size)
+            for bytes in prefetched.iter_chunks():
+                archive.append_file_chunk(bytes, len(bytes))
+                if archive.above_high_water_mark():
+                    yield archive.read()
+            archive.close_filestream()
+        else:
+            if prefetched.filemeta.size > chunk_size:
+                prefetched.close()
+                raise ArchiveException("The size of file %s is greater than "\
+                                        "the maximum allowed size. Download "\
+                                        "stream aborted." % filename)
+            archive.add_file(filename, ''.join(prefetched.iter_chunks()))
+        # Read the content from the streamable archive and yield the data
+        if archive.above_high_water_mark():
+            yield archive.read()
 
 
 def iter_archive_assignmentgroups(archive, assignmentgroups):
@@ -103,6 +305,10 @@ def iter_archive_assignmentgroups(archive, assignmentgroups):
     Creates an archive, adds files delivered by the assignmentgroups
     and yields the data.
     """
+    return iter_archive_entries(archive, _iter_assignmentgroup_entries(assignmentgroups))
+
+
+def _iter_assignmentgroup_entries(assignmentgroups, delivered_after=None):
     name_matches = _get_dictionary_with_name_matches(assignmentgroups)
     for group in assignmentgroups:
         group_name = _get_assignmentgroup_name(group)
@@ -110,13 +316,15 @@ def iter_archive_assignmentgroups(archive, assignmentgroups):
         # postfix the name with assignmentgroup ID.
         if name_matches[group_name] > 1:
             group_name = "%s+%d" % (group_name, group.id)
-        deliveries = group.deliveries.all()
-        for bytes in iter_archive_deliveries(archive, group_name,
-                                             group.parentnode.get_path(),
-                                             deliveries):
-            yield bytes
-    archive.close()
-    yield archive.read()
+        deliveries = Delivery.objects.filter(deadline__assignment_group=group)
+        if delivered_after:
+            deliveries = deliveries.filter(time_of_delivery__gt=delivered_after,
+                                           successful=True)
+        deliveries = list(deliveries)
+        for entry in _iter_delivery_entries(group_name,
+                                            group.parentnode.get_path(),
+                                            deliveries):
+            yield entry
 
 
 def get_archive_from_archive_type(archive_type):
@@ -125,10 +333,16 @@ def get_archive_from_archive_type(archive_type):
     and return the correct archive class.
     """
     archive = None
+    high_water_mark = settings.DEVILRY_ARCHIVE_HIGH_WATER_MARK
+    threads = settings.DEVILRY_ARCHIVE_COMPRESSION_THREADS
     if archive_type == 'zip':
-        archive = StreamableZip()
+        compression_policy = None
+        if settings.DEVILRY_ARCHIVE_STORE_COMPRESSED_FILES:
+            compression_policy = CompressionPolicy()
+        archive = StreamableZip(high_water_mark=high_water_mark, threads=threads,
+                                compression_policy=compression_policy)
     elif archive_type == 'tar' or archive_type == 'tgz' or archive_type == 'tar.gz':
-        archive = StreamableTar(archive_type)
+        archive = StreamableTar(archive_type, high_water_mark=high_water_mark, threads=threads)
     else:
         raise ArchiveException("archive_type is invalid:%s" % archive_type)
     return archive
@@ -0,0 +1,112 @@
+"""
+Read ahead in the deliverystore while the current file is processed.
+
+Generating an archive reads files one after another. When the deliverystore
+is slow to open and read files (typically on a network filesystem), most of
+the time is spent waiting for I/O between files. :func:`iter_prefetched_files`
+opens and reads the start of the next files on a small thread pool while the
+caller works on the current one.
+"""
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+class PrefetchedFile(object):
+    """
+    A file from the deliverystore where the first ``prefetch_size`` bytes
+    are read in advance. Use :meth:`iter_chunks` to read the file.
+    """
+    def __init__(self, filemeta, chunk_size):
+        self.filemeta = filemeta
+        self.chunk_size = chunk_size
+        self.prefetch_size = min(filemeta.size, chunk_size)
+        self.fileobj = None
+        self.first_chunk = None
+
+        # Make sure the delivery is loaded here, and not by the deliverystore
+        # in a pool thread (database connections are per thread).
+        filemeta.delivery
+
+    def prefetch(self):
+        """ Open the file and read the first chunk. Runs in a pool thread. """
+        self.fileobj = self.filemeta.deliverystore.read_open(self.filemeta)
+        self.first_chunk = self.fileobj.read(self.chunk_size)
+
+    def iter_chunks(self):
+        """ Iterate over the file in chunks of at most ``chunk_size`` bytes,
+        and close the file when done. """
+        if self.fileobj is None:
+            self.prefetch()
+        try:
+            if self.first_chunk:
+                yield self.first_chunk
+            self.first_chunk = None
+            while True:
+                bytes = self.fileobj.read(self.chunk_size)
+                if not bytes:
+                    break
+                yield bytes
+        finally:
+            self.close()
+
+    def close(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+
+
+def iter_prefetched_files(items, chunk_size, max_bytes, threads):
+    """
+    Iterate over ``items``, a iterable of ``(key, filemeta)`` tuples, and
+    yield ``(key, prefetchedfile)`` tuples in the same order. The
+    :class:`PrefetchedFile` for upcoming items are prefetched on a pool with
+    ``threads`` threads, as long as the prefetched data does not exceed
+    ``max_bytes`` (one file is always prefetched).
+
+    ``filemeta`` may be ``None``, which gives ``None`` for ``prefetchedfile``.
+    This lets callers mix files with other entries without losing the order.
+
+    If ``threads`` is ``0``, files are read when they are consumed.
+    """
+    if threads < 1:
+        for key, filemeta in items:
+            if filemeta is None:
+                yield key, None
+            else:
+                yield key, PrefetchedFile(filemeta, chunk_size)
+        return
+
+    pool = ThreadPool(threads)
+    pending = deque()
+    bytes_in_flight = 0
+    items = iter(items)
+    next_item = next(items, None)
+    try:
+        while next_item is not None or pending:
+            while next_item is not None and len(pending) < threads * 2:
+                key, filemeta = next_item
+                if filemeta is None:
+                    pending.append((key, None, None))
+                else:
+                    prefetched = PrefetchedFile(filemeta, chunk_size)
+                    if pending and bytes_in_flight + prefetched.prefetch_size > max_bytes:
+                        break
+                    result = pool.apply_async(prefetched.prefetch)
+                    pending.append((key, prefetched, result))
+                    bytes_in_flight += prefetched.prefetch_size
+                next_item = next(items, None)
+
+            key, prefetched, result = pending.popleft()
+            if prefetched is not None:
+                result.get() # Re-raises any exception from prefetch()
+                bytes_in_flight -= prefetched.prefetch_size
+            yield key, prefetched
+    finally:
+        # Close the files that were prefetched but never consumed (the
+        # consumer stopped early, or something failed).
+        for key, prefetched, result in pending:
+            if prefetched is not None:
+                result.wait()
+                prefetched.close()
+        pool.close()
+        pool.join()
@@ -0,0 +1,282 @@
+"""
+Let the web server send delivery files instead of streaming every byte
+through a Django worker.
+
+The ``DEVILRY_SENDFILE_BACKEND`` setting selects how files are sent:
+
+``None`` (the default)
+    Stream the file through Django.
+``'xsendfile'``
+    Respond with an ``X-Sendfile`` header containing the path to the file.
+    Supported by Apache with mod_xsendfile, and by lighttpd.
+``'xaccelredirect'``
+    Respond with an ``X-Accel-Redirect`` header for nginx. The path of the
+    file relative to ``DEVILRY_XACCELREDIRECT_ROOT`` is appended to
+    ``DEVILRY_XACCELREDIRECT_LOCATION``, which must be an ``internal``
+    location in nginx with ``DEVILRY_XACCELREDIRECT_ROOT`` as its alias.
+``'wsgi'``
+    Hand the open file to the ``wsgi.file_wrapper`` of the WSGI server, which
+    normally uses the ``sendfile`` system call (mod_wsgi, gunicorn, ...).
+    Requires that the WSGI application is :class:`WSGIHandler` from this
+    module instead of the one in Django.
+
+Files are only offloaded when the deliverystore can give us a path on the
+filesystem (see
+:meth:`devilry.apps.core.deliverystore.DeliveryStoreInterface.get_filesystem_path`).
+All permission checks are done by the view before any of this happens.
+
+Conditional requests (``If-None-Match`` and ``If-Modified-Since``) are
+answered with ``304 Not Modified`` here, and ``Range`` requests are answered
+here unless the web server sends the file (X-Sendfile and X-Accel-Redirect
+handle ranges themselves).
+"""
+from os import stat
+from os.path import relpath, pardir
+from urllib import quote
+from time import mktime
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.core.servers.basehttp import FileWrapper
+from django.core.handlers.wsgi import WSGIHandler as DjangoWSGIHandler
+from django.utils.http import http_date, parse_http_date_safe, parse_etags, quote_etag
+
+
+class WSGIHandler(DjangoWSGIHandler):
+    """ Django WSGI handler that returns ``wsgi.file_wrapper`` for responses
+    created with ``DEVILRY_SENDFILE_BACKEND='wsgi'``. Use this as your WSGI
+    application::
+
+        from devilry.utils.sendfile import WSGIHandler
+        application = WSGIHandler()
+    """
+    def __call__(self, environ, start_response):
+        response = super(WSGIHandler, self).__call__(environ, start_response)
+        fileobj = getattr(response, 'devilry_sendfile_fileobj', None)
+        if fileobj is not None and 'wsgi.file_wrapper' in environ:
+            return environ['wsgi.file_wrapper'](fileobj, 65536)
+        return response
+
+
+def _get_backend():
+    return getattr(settings, 'DEVILRY_SENDFILE_BACKEND', None)
+
+
+def _can_offload(filepath):
+    if _get_backend() == 'xaccelredirect':
+        # nginx can only send files below DEVILRY_XACCELREDIRECT_ROOT
+        path = relpath(filepath, settings.DEVILRY_XACCELREDIRECT_ROOT)
+        return path != pardir and not path.startswith(pardir + '/')
+    return True
+
+
+def _create_offloaded_response(filepath, size, content_type):
+    backend = _get_backend()
+    if backend == 'xsendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = filepath
+    elif backend == 'xaccelredirect':
+        location = settings.DEVILRY_XACCELREDIRECT_LOCATION.rstrip('/')
+        path = relpath(filepath, settings.DEVILRY_XACCELREDIRECT_ROOT)
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote('{0}/{1}'.format(location, path))
+    elif backend == 'wsgi':
+        fileobj = open(filepath, 'rb')
+        response = HttpResponse(FileWrapper(fileobj), content_type=content_type)
+        response.devilry_sendfile_fileobj = fileobj
+        response['Content-Length'] = size
+    else:
+        raise ValueError('Invalid DEVILRY_SENDFILE_BACKEND: {0!r}'.format(backend))
+    return response
+
+
+class HttpResponsePartialContent(HttpResponse):
+    status_code = 206
+
+
+class HttpResponseRequestedRangeNotSatisfiable(HttpResponse):
+    status_code = 416
+
+
+def parse_range_header(header, size):
+    """ Parse a HTTP ``Range`` header for a resource of ``size`` bytes.
+
+    Only single byte ranges are supported. We are allowed to ignore a range
+    header we do not understand, so multiple ranges give a full response.
+
+    :return:
+        ``None`` if the whole resource should be sent, ``(start, stop)``
+        (``stop`` not included) for a satisfiable range, or ``False`` if the
+        range is not satisfiable.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, sep, stop = header[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start == '':
+            # Suffix range: the last N bytes
+            length = int(stop)
+            if length <= 0:
+                return False
+            return max(0, size - length), size
+        start = int(start)
+        if stop == '':
+            stop = size
+        else:
+            stop = min(int(stop) + 1, size)
+    except ValueError:
+        return None
+    if start >= size or start >= stop:
+        return False
+    return start, stop
+
+
+def iter_file_range(fileobj, start, stop, blksize=65536):
+    """ Iterate over the bytes from ``start`` to ``stop`` in ``fileobj``, and
+    close ``fileobj`` when done. Seeks to ``start`` if ``fileobj`` supports
+    it, and reads past the first ``start`` bytes if it does not. """
+    try:
+        try:
+            fileobj.seek(start)
+        except (AttributeError, IOError):
+            skip = start
+            while skip > 0:
+                data = fileobj.read(min(blksize, skip))
+                if not data:
+                    return
+                skip -= len(data)
+        remaining = stop - start
+        while remaining > 0:
+            data = fileobj.read(min(blksize, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        fileobj.close()
+
+
+def get_filemeta_etag(filemeta):
+    """ Get the ETag of the file belonging to ``filemeta``. Uses the digest
+    if it is set, and the FileMeta id and size if it is not. Files are never
+    changed after they are added to a delivery, so this never gets stale. """
+    if filemeta.digest:
+        return filemeta.digest
+    else:
+        return '{0}-{1}'.format(filemeta.id, filemeta.size)
+
+
+def _is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return etag in etags or '*' in etags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    if if_modified_since is not None:
+        return last_modified <= if_modified_since
+    return False
+
+
+def _get_range(request, etag, last_modified, size):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            if parse_etags(if_range) != [etag]:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+    return parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+
+def create_filemeta_response(request, filemeta, content_type):
+    """ Create a response sending the file belonging to the given
+    :class:`devilry.apps.core.models.FileMeta`.
+
+    The response is offloaded as configured by ``DEVILRY_SENDFILE_BACKEND``
+    if the deliverystore of the filemeta can give us a filesystem path.
+    Otherwise the file is streamed through Django. Conditional and range
+    requests are supported (see the module docs). The caller is responsible
+    for checking permissions, and for setting ``Content-Disposition``.
+    """
+    etag = get_filemeta_etag(filemeta)
+    last_modified = int(mktime(filemeta.delivery.time_of_delivery.timetuple()))
+    if _is_not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        response = _create_file_response(request, filemeta, content_type,
+                                         etag, last_modified)
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _create_file_response(request, filemeta, content_type, etag, last_modified):
+    store = filemeta.deliverystore
+    backend = _get_backend()
+    byterange = _get_range(request, etag, last_modified, filemeta.size)
+    if backend and (byterange is None or backend != 'wsgi'):
+        filepath = store.get_filesystem_path(filemeta)
+        if filepath and _can_offload(filepath):
+            return _create_offloaded_response(filepath, filemeta.size, content_type)
+    return _create_streamed_response(lambda: store.read_open(filemeta),
+                                     filemeta.size, content_type, byterange)
+
+
+def _create_streamed_response(read_open, size, content_type, byterange):
+    if byterange is False:
+        response = HttpResponseRequestedRangeNotSatisfiable()
+        response['Content-Range'] = 'bytes */{0}'.format(size)
+    elif byterange is None:
+        response = HttpResponse(FileWrapper(read_open()),
+                                content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, stop = byterange
+        response = HttpResponsePartialContent(
+            iter_file_range(read_open(), start, stop),
+            content_type=content_type)
+        response['Content-Length'] = stop - start
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, stop - 1, size)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def create_fileobj_response(request, read_open, size, content_type, etag, last_modified):
+    """ Create a response streaming ``size`` bytes from the file-like object
+    returned by ``read_open()``, with conditional and range requests
+    handled like in :func:`create_filemeta_response`. ``last_modified`` is a
+    timestamp (seconds since the epoch). The file-like object should support
+    ``seek()`` to make ranges efficient. """
+    if _is_not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        byterange = _get_range(request, etag, last_modified, size)
+        response = _create_streamed_response(read_open, size, content_type, byterange)
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def create_path_response(request, filepath, content_type, etag):
+    """ Create a response sending the file at ``filepath``, which must not
+    change while the response is sent (write a new file and rename it into
+    place instead). Works like :func:`create_filemeta_response`, with
+    ``etag`` as the ETag and the modification time of the file as the
+    ``Last-Modified`` time. """
+    filestat = stat(filepath)
+    last_modified = int(filestat.st_mtime)
+    if _is_not_modified(request, etag, last_modified):
+        response = HttpResponseNotModified()
+    else:
+        backend = _get_backend()
+        byterange = _get_range(request, etag, last_modified, filestat.st_size)
+        if backend and (byterange is None or backend != 'wsgi') and _can_offload(filepath):
+            response = _create_offloaded_response(filepath, filestat.st_size, content_type)
+        else:
+            response = _create_streamed_response(lambda: open(filepath, 'rb'),
+                                                 filestat.st_size, content_type, byterange)
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    return response
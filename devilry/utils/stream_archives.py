@@ -1,18 +1,45 @@
-from zipfile import ZipFile, ZIP_DEFLATED
+from zipfile import ZIP_STORED, ZIP_DEFLATED
 import tarfile, copy
+import struct
+import zlib
+import time
+import math
+from os.path import splitext
+from collections import deque, Counter
+from bisect import bisect_right
+from hashlib import sha1
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
+
+#: Size of the blocks compressed in parallel. Each block is compressed on
+#: its own, so smaller blocks give worse compression.
+PARALLEL_BLOCKSIZE = 262144
+
 
 class MemoryIO(object):
     """
     An in-memory file like IO implementation with read, write,
     seek and tell implemented. Content read is deleted from
     memory to keep the memory consumption a a minimum.
+
+    Written data is kept as a queue of chunks, so both :meth:`write` and
+    :meth:`read` take time proportional to the data written or read, not
+    to the amount of data in the buffer.
+
+    :param high_water_mark:
+        Optional number of bytes. :meth:`above_high_water_mark` returns
+        ``True`` when at least this many bytes are buffered, which tells
+        producers that it is time to :meth:`read`.
     """
-    def __init__(self, initial_bytes=None):
-        self.buffer = str()
+    def __init__(self, initial_bytes=None, high_water_mark=None):
+        self.chunks = deque()
+        self.size = 0 # Number of bytes in the buffer
+        self.head_offset = 0 # Number of bytes already read from chunks[0]
         self.pos = 0
+        self.high_water_mark = high_water_mark
         if not initial_bytes == None:
-            self.buffer = str(initial_bytes)
-            self.pos = len(initial_bytes)
+            self.write(initial_bytes)
             
     def tell(self):
         """Returns the current position"""
@@ -26,41 +53,287 @@ class MemoryIO(object):
         """Does nothing"""
         pass
 
+    def above_high_water_mark(self):
+        """ Returns ``True`` if a high water mark is set, and at least that
+        many bytes are buffered. """
+        return self.high_water_mark is not None and self.size >= self.high_water_mark
+
     def read(self, n = -1):
         """
         Read n bytes from the buffer. If n is not used, the entire
         content is returned.
         The pos variable is deliberately not updated.
         """
-        if len(self.buffer) == 0:
+        if self.size == 0:
             return str()
-        buf = None
-        if n == -1:
-            buf = self.buffer
-            self.buffer = str()
-        else:
-            buf = self.buffer[:n]
-            self.buffer = self.buffer[n:]
-        return buf
+        if n < 0 or n > self.size:
+            n = self.size
+        parts = []
+        remaining = n
+        while remaining > 0:
+            chunk = self.chunks[0]
+            available = len(chunk) - self.head_offset
+            if available <= remaining:
+                if self.head_offset:
+                    chunk = chunk[self.head_offset:]
+                parts.append(chunk)
+                self.chunks.popleft()
+                self.head_offset = 0
+                remaining -= available
+            else:
+                parts.append(chunk[self.head_offset:self.head_offset+remaining])
+                self.head_offset += remaining
+                remaining = 0
+        self.size -= n
+        if len(parts) == 1:
+            return parts[0]
+        return ''.join(parts)
 
     def write(self, bytes):
         """
         Append the bytes to the in-memory buffer.
         """
-        self.buffer += str(bytes)
+        bytes = str(bytes)
+        if bytes:
+            self.chunks.append(bytes)
+            self.size += len(bytes)
         self.pos += len(bytes)
         return len(bytes)
 
 class UnsupportedOperation(ValueError, IOError):
     pass
 
+
+def estimate_entropy(bytes):
+    """ Get the Shannon entropy of ``bytes`` in bits per byte, from ``0.0``
+    (all bytes are equal) to ``8.0`` (random data). """
+    if not bytes:
+        return 0.0
+    size = float(len(bytes))
+    entropy = 0.0
+    for count in Counter(bytes).itervalues():
+        p = count / size
+        entropy -= p * math.log(p, 2)
+    return entropy
+
+
+class CompressionPolicy(object):
+    """
+    Choose ``ZIP_STORED`` or ``ZIP_DEFLATED`` for each file in a ZIP
+    archive. Deflating files that are already compressed (images, PDFs,
+    archives, office documents, ...) takes a lot of time and saves next to
+    nothing, so they are stored as they are.
+
+    The decision is made by the file extension if it is in
+    :attr:`STORED_EXTENSIONS` or :attr:`DEFLATED_EXTENSIONS`. Other files are
+    deflated unless the entropy of the first ``sample_size`` bytes is above
+    ``max_entropy`` bits per byte.
+    """
+    STORED_EXTENSIONS = frozenset([
+        # Archives and compressed files
+        'zip', 'gz', 'tgz', 'bz2', 'tbz', 'tbz2', 'xz', 'txz', 'lz', 'lzma',
+        'z', '7z', 'rar', 'jar', 'war', 'ear', 'apk', 'deb', 'rpm', 'dmg',
+        # Documents stored as compressed containers
+        'pdf', 'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'odg', 'epub',
+        # Images, audio and video
+        'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'jp2',
+        'mp3', 'ogg', 'oga', 'flac', 'aac', 'm4a', 'wma', 'opus',
+        'mp4', 'm4v', 'mov', 'avi', 'mkv', 'webm', 'wmv', 'flv', 'mpg', 'mpeg'])
+    DEFLATED_EXTENSIONS = frozenset([
+        'txt', 'text', 'md', 'rst', 'tex', 'csv', 'tsv', 'log', 'xml', 'html',
+        'htm', 'css', 'js', 'json', 'yaml', 'yml', 'svg', 'rtf', 'ps', 'eps',
+        'doc', 'xls', 'ppt', 'bmp', 'tif', 'tiff', 'wav', 'sql', 'tar',
+        'py', 'java', 'c', 'h', 'cc', 'cpp', 'hpp', 'cs', 'rb', 'pl', 'php',
+        'sh', 'scala', 'hs', 'ml', 'lisp', 'scm', 'erl', 'go', 'm', 'r', 'asm',
+        's', 'class', 'o'])
+
+    def __init__(self, sample_size=8192, max_entropy=7.5):
+        self.sample_size = sample_size
+        self.max_entropy = max_entropy
+
+    def choose(self, filename, sample=None):
+        """ Choose the compression for ``filename``. ``sample`` should be the
+        start of the file. If it is ``None``, files with unknown extensions
+        are deflated. """
+        extension = splitext(filename)[1][1:].lower()
+        if extension in self.STORED_EXTENSIONS:
+            return ZIP_STORED
+        if extension in self.DEFLATED_EXTENSIONS or sample is None:
+            return ZIP_DEFLATED
+        if estimate_entropy(sample[:self.sample_size]) > self.max_entropy:
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+
+def deflate_block(bytes, compresslevel, last):
+    """
+    Compress ``bytes`` to raw deflate data on its own. Unless ``last`` is
+    ``True``, the output ends with a sync flush instead of the end of the
+    stream, so the output of several calls can be concatenated to one
+    deflate stream. This is how pigz compresses in parallel.
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    bytes = compressor.compress(bytes)
+    if last:
+        return bytes + compressor.flush(zlib.Z_FINISH)
+    else:
+        return bytes + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class LazyThreadPool(object):
+    """
+    A :class:`multiprocessing.pool.ThreadPool` with ``processes`` threads
+    that is not started until the first :meth:`apply_async`. Archives are
+    created before the response is sent, and may never be written to (HEAD
+    requests, clients disconnecting), so the threads are only started when
+    there is something to compress.
+    """
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool = None
+
+    def apply_async(self, function, args=()):
+        if self.pool is None:
+            self.pool = ThreadPool(self.processes)
+        return self.pool.apply_async(function, args)
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class OrderedBlockWriter(object):
+    """
+    Write blocks of bytes with ``write`` in the order they are added, while
+    some of them are still being compressed in a pool. A block is either
+    ready bytes (:meth:`add_bytes`), an ``AsyncResult`` from a pool
+    (:meth:`add_async`), or a function returning the bytes that is called
+    when all earlier blocks are written (:meth:`add_deferred`).
+
+    Blocks are written as soon as they, and all blocks before them, are
+    ready. When more than ``max_pending`` blocks are waiting for the pool,
+    adding a block waits for the oldest one.
+    """
+    def __init__(self, write, max_pending):
+        self.write = write
+        self.max_pending = max_pending
+        self.blocks = deque()
+        self.pending = 0
+
+    def add_bytes(self, bytes):
+        self.blocks.append((bytes, None, None))
+        self.write_ready()
+
+    def add_async(self, result, callback=None):
+        """ Add the bytes returned by ``result``. ``callback`` is called
+        with the bytes before they are written. """
+        self.blocks.append((None, result, callback))
+        self.pending += 1
+        self.write_ready()
+
+    def add_deferred(self, function):
+        self.blocks.append((None, None, function))
+        self.write_ready()
+
+    def write_ready(self, wait=False):
+        """ Write the blocks that are ready. Waits for all blocks if
+        ``wait`` is ``True``. """
+        while self.blocks:
+            bytes, result, callback = self.blocks[0]
+            if result is not None:
+                if not (wait or result.ready() or self.pending > self.max_pending):
+                    break
+                bytes = result.get() # Re-raises any exception from the pool
+                self.pending -= 1
+                if callback:
+                    callback(bytes)
+            elif callback:
+                bytes = callback()
+            self.blocks.popleft()
+            if bytes:
+                self.write(bytes)
+
+    def flush(self):
+        """ Wait for all blocks, and write them. """
+        self.write_ready(wait=True)
+
+
+class ParallelGzipWriter(object):
+    """
+    A write-only file-like object that writes gzip compressed data to
+    ``fileobj``. The data is split in blocks of ``blocksize`` bytes that are
+    compressed in parallel on ``pool`` (a
+    :class:`multiprocessing.pool.ThreadPool`) with :func:`deflate_block`.
+    zlib releases the GIL while compressing, so the threads use all cores.
+    """
+    def __init__(self, fileobj, pool, compresslevel=9, blocksize=PARALLEL_BLOCKSIZE,
+                 max_pending=4):
+        self.pool = pool
+        self.compresslevel = compresslevel
+        self.blocksize = blocksize
+        self.output = OrderedBlockWriter(fileobj.write, max_pending)
+        self.buffer = []
+        self.buffersize = 0
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        if compresslevel == 9:
+            xfl = 2
+        elif compresslevel == 1:
+            xfl = 4
+        else:
+            xfl = 0
+        self.output.add_bytes(struct.pack('<BBBBIBB', 0x1f, 0x8b, 8, 0,
+                                          int(time.time()), xfl, 255))
+
+    def _submit_block(self, last):
+        bytes = ''.join(self.buffer)
+        self.buffer = []
+        self.buffersize = 0
+        self.output.add_async(self.pool.apply_async(deflate_block,
+                                                    (bytes, self.compresslevel, last)))
+
+    def write(self, bytes):
+        bytes = str(bytes)
+        self.crc = zlib.crc32(bytes, self.crc) & 0xffffffff
+        self.size += len(bytes)
+        self.buffer.append(bytes)
+        self.buffersize += len(bytes)
+        if self.buffersize >= self.blocksize:
+            self._submit_block(last=False)
+
+    def tell(self):
+        """ The number of uncompressed bytes written. """
+        return self.size
+
+    def flush(self):
+        """ Does nothing. Use :meth:`close` to write all data. """
+        pass
+
+    def close(self):
+        """ Compress the remaining data, and write it with the gzip
+        trailer. Waits for the pool. """
+        if self.closed:
+            return
+        self._submit_block(last=True)
+        self.output.add_bytes(struct.pack('<II', self.crc, self.size & 0xffffffff))
+        self.output.flush()
+        self.closed = True
+
+
 class StreamableArchive(object):
     """
     Base class for streamable archives using the MemoryIO class.
     """
-    def __init__(self):
-        self.in_memory = MemoryIO()
+    def __init__(self, high_water_mark=None, threads=0):
+        self.in_memory = MemoryIO(high_water_mark=high_water_mark)
         self.archive = None
+        self.threads = threads
+        if threads > 0:
+            self.pool = LazyThreadPool(threads)
+        else:
+            self.pool = None
     
     def add_file(self, filename, bytes):
         raise UnsupportedOperation("%s.%s() not supported" %
@@ -96,35 +369,510 @@ class StreamableArchive(object):
     def read(self):
         return self.in_memory.read()
 
+    def above_high_water_mark(self):
+        """
+        If the data written to the archive, and not yet read, has reached
+        the high water mark.
+        """
+        return self.in_memory.above_high_water_mark()
+
     def close(self):
         self.archive.close()
+        self.terminate()
+
+    def terminate(self):
+        """
+        Stop the compression threads, if any. This is done by :meth:`close`,
+        but must also be done if the archive is abandoned before it is
+        closed.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
 
 
 class StreamableZip(StreamableArchive):
     """
-    Stream archive in ZIP format. The zip supports compression.
+    Stream archive in ZIP format. The zip supports compression, and files
+    can be written in chunks, so memory usage does not depend on the size
+    of the files. If ``threads`` is more than 0, files are compressed on
+    that many threads (see :class:`ZipStreamWriter`).
+
+    If a :class:`CompressionPolicy` is given, and ``compression`` is
+    ``ZIP_DEFLATED``, the policy chooses the compression of each file from
+    its name and first chunk. The local header of a file stream is
+    therefore not written until the first chunk arrives.
     """
-    def __init__(self):
-        super(StreamableZip, self).__init__()
-        self.archive = ZipFile(self.in_memory, "w", compression=ZIP_DEFLATED)
+    def __init__(self, compression=ZIP_DEFLATED, high_water_mark=None, threads=0,
+                 compression_policy=None):
+        super(StreamableZip, self).__init__(high_water_mark, threads)
+        self.archive = ZipStreamWriter(self.in_memory, compression=compression,
+                                       pool=self.pool, max_pending=threads*2)
+        if compression != ZIP_DEFLATED:
+            compression_policy = None
+        self.compression_policy = compression_policy
+        self.pending_filestream = None
         
     def add_file(self, filename, bytes):
-         self.archive.writestr(filename, bytes)
+        if self.compression_policy:
+            compression = self.compression_policy.choose(filename, bytes)
+        else:
+            compression = None
+        self.archive.add_file(filename, bytes, compression=compression)
+
+    def open_filestream(self, filename, filesize):
+        if self.compression_policy:
+            if self.pending_filestream or self.archive.filestream_active:
+                raise FileStreamException("Cannot start a new filestream with "\
+                                          "another file stream currently active."\
+                                          "Close active stream before start a new.")
+            self.pending_filestream = (filename, filesize)
+        else:
+            self.archive.open_filestream(filename, filesize)
+
+    def _open_pending_filestream(self, sample):
+        filename, filesize = self.pending_filestream
+        self.pending_filestream = None
+        self.archive.open_filestream(filename, filesize,
+                                     compression=self.compression_policy.choose(filename, sample))
+
+    def append_file_chunk(self, bytes, chunk_size):
+        if self.pending_filestream:
+            self._open_pending_filestream(bytes)
+        self.archive.append_file_chunk(bytes)
+
+    def close_filestream(self):
+        if self.pending_filestream:
+            self._open_pending_filestream('')
+        self.archive.close_filestream()
+
+    def can_write_chunks(self):
+        return True
 
 class FileStreamException(Exception):
     pass
 
+
+class ZipStreamWriter(object):
+    """
+    Writes a ZIP archive to a file-like object that only needs to support
+    ``write()``. Unlike :class:`zipfile.ZipFile`, this never seeks back to
+    update a header, so the archive can be sent while it is written.
+
+    Each entry has a local header without sizes and CRC, followed by the
+    data deflated chunk by chunk, followed by a data descriptor with the
+    sizes and CRC. ZIP64 records are used for files, offsets and entry
+    counts that do not fit in the original 32-bit (16-bit for counts) fields.
+
+    If a ``pool`` (a :class:`multiprocessing.pool.ThreadPool`) is given,
+    deflated data is split in blocks of ``blocksize`` bytes that are
+    compressed on the pool with :func:`deflate_block`, and written in order
+    with a :class:`OrderedBlockWriter`. Since the sizes are written after the
+    data, the writer does not wait for one entry to be compressed before the
+    next is started, so many small files are compressed at once just like
+    the blocks of a large file. At most ``max_pending`` blocks are compressed
+    at a time.
+    """
+    ZIP64_LIMIT = 0xffffffff
+    ZIP64_COUNT_LIMIT = 0xffff
+
+    FLAG_DATA_DESCRIPTOR = 0x08
+    FLAG_UTF8 = 0x800
+
+    def __init__(self, fileobj, compression=ZIP_DEFLATED, compresslevel=6,
+                 pool=None, blocksize=PARALLEL_BLOCKSIZE, max_pending=4):
+        self.fileobj = fileobj
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.pool = pool
+        self.blocksize = blocksize
+        if pool is None:
+            self.output = None
+        else:
+            self.output = OrderedBlockWriter(self._write, max_pending)
+        self.offset = 0
+        self.entries = []
+        self.filestream_active = False
+        self.closed = False
+
+    def _write(self, bytes):
+        self.fileobj.write(bytes)
+        self.offset += len(bytes)
+
+    def _write_deferred(self, function):
+        """ Write the bytes returned by ``function`` after everything
+        written before it. """
+        if self.output is None:
+            self._write(function())
+        else:
+            self.output.add_deferred(function)
+
+    def _count_compressed(self, entry, bytes):
+        entry['compress_size'] += len(bytes)
+
+    def _write_compressed(self, entry, bytes):
+        self._count_compressed(entry, bytes)
+        if self.output is None:
+            self._write(bytes)
+        else:
+            self.output.add_bytes(bytes)
+
+    def _submit_block(self, last):
+        bytes = ''.join(self.filestream_buffer)
+        self.filestream_buffer = []
+        self.filestream_buffersize = 0
+        result = self.pool.apply_async(deflate_block, (bytes, self.compresslevel, last))
+        self.output.add_async(result, partial(self._count_compressed, self.filestream_entry))
+
+    def _encode_filename(self, filename):
+        if isinstance(filename, unicode):
+            return filename.encode('utf-8'), self.FLAG_UTF8
+        return filename, 0
+
+    def _get_dostime(self, timestamp=None):
+        t = time.localtime(timestamp)
+        dosdate = (max(t[0], 1980) - 1980) << 9 | t[1] << 5 | t[2]
+        dostime = t[3] << 11 | t[4] << 5 | (t[5] // 2)
+        return dosdate, dostime
+
+    def open_filestream(self, filename, filesize, compression=None, timestamp=None):
+        """
+        Write the local header of a new entry. ``filesize`` is the
+        uncompressed size of the file, and it is only used to decide if the
+        entry needs ZIP64. Data is added with :meth:`append_file_chunk`, and
+        the entry must be closed with :meth:`close_filestream`.
+        """
+        if self.filestream_active:
+            raise FileStreamException("Cannot start a new filestream with "\
+                                      "another file stream currently active."\
+                                      "Close active stream before start a new.")
+        if compression is None:
+            compression = self.compression
+        filename, flags = self._encode_filename(filename)
+        flags |= self.FLAG_DATA_DESCRIPTOR
+        # Deflate may grow incompressible data slightly, so give it some room
+        zip64 = filesize + (filesize >> 8) + 1024 >= self.ZIP64_LIMIT
+        dosdate, dostime = self._get_dostime(timestamp)
+        entry = dict(filename=filename, flags=flags, compression=compression,
+                     dosdate=dosdate, dostime=dostime, zip64=zip64,
+                     header_offset=None, crc=0, compress_size=0,
+                     file_size=0)
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+            sizes = self.ZIP64_LIMIT
+            version = 45
+        else:
+            extra = ''
+            sizes = 0
+            version = 20
+        entry['version'] = version
+        header = struct.pack('<4sHHHHHIIIHH', 'PK\x03\x04', version, flags,
+                             compression, dostime, dosdate, 0, sizes, sizes,
+                             len(filename), len(extra))
+        def local_header():
+            # The offset is not known until earlier entries are compressed
+            entry['header_offset'] = self.offset
+            return header + filename + extra
+        self._write_deferred(local_header)
+        self.compressor = None
+        self.filestream_buffer = []
+        self.filestream_buffersize = 0
+        if compression == ZIP_DEFLATED and self.pool is None:
+            self.compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        self.filestream_entry = entry
+        self.filestream_active = True
+
+    def append_file_chunk(self, bytes):
+        """ Add ``bytes`` to the currently open entry. """
+        if not self.filestream_active:
+            raise FileStreamException("Cannot append file chunk without an "\
+                                      "active filestream. Start a filestream "\
+                                      "first.")
+        bytes = str(bytes)
+        entry = self.filestream_entry
+        entry['crc'] = zlib.crc32(bytes, entry['crc']) & 0xffffffff
+        entry['file_size'] += len(bytes)
+        if self.compressor:
+            bytes = self.compressor.compress(bytes)
+        elif entry['compression'] == ZIP_DEFLATED:
+            self.filestream_buffer.append(bytes)
+            self.filestream_buffersize += len(bytes)
+            if self.filestream_buffersize >= self.blocksize:
+                self._submit_block(last=False)
+            return
+        if bytes:
+            self._write_compressed(entry, bytes)
+
+    def close_filestream(self):
+        """ Finish the currently open entry by writing its data descriptor. """
+        if not self.filestream_active:
+            raise FileStreamException("Cannot close a file stream when no "\
+                                      "file stream is active.")
+        entry = self.filestream_entry
+        if self.compressor:
+            self._write_compressed(entry, self.compressor.flush())
+            self.compressor = None
+        elif entry['compression'] == ZIP_DEFLATED:
+            self._submit_block(last=True)
+        if not entry['zip64'] and entry['file_size'] >= self.ZIP64_LIMIT:
+            raise FileStreamException("File %s is larger than the size given "\
+                                      "to open_filestream." % entry['filename'])
+        def data_descriptor():
+            if entry['zip64']:
+                return struct.pack('<4sIQQ', 'PK\x07\x08', entry['crc'],
+                                   entry['compress_size'], entry['file_size'])
+            if entry['compress_size'] >= self.ZIP64_LIMIT:
+                raise FileStreamException("File %s is larger than the size given "\
+                                          "to open_filestream." % entry['filename'])
+            return struct.pack('<4sIII', 'PK\x07\x08', entry['crc'],
+                               entry['compress_size'], entry['file_size'])
+        self._write_deferred(data_descriptor)
+        self.entries.append(entry)
+        self.filestream_active = False
+
+    def add_file(self, filename, bytes, **kwargs):
+        """ Add a file with the given contents. """
+        self.open_filestream(filename, len(bytes), **kwargs)
+        self.append_file_chunk(bytes)
+        self.close_filestream()
+
+    def add_file_reference(self, filename, filesize, crc, reference, timestamp=None):
+        """
+        Add a stored (uncompressed) file with a known size and CRC-32
+        without reading it. The local header is written as usual, and then
+        ``fileobj.write_reference(reference, filesize)`` is called instead
+        of writing the data. See :class:`SegmentedFile`.
+        """
+        if self.filestream_active:
+            raise FileStreamException("Cannot add a file with a file stream "\
+                                      "currently active.")
+        if self.output is not None:
+            raise FileStreamException("Cannot add file references when "\
+                                      "compressing on a pool.")
+        filename, flags = self._encode_filename(filename)
+        zip64 = filesize >= self.ZIP64_LIMIT
+        dosdate, dostime = self._get_dostime(timestamp)
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, filesize, filesize)
+            sizes = self.ZIP64_LIMIT
+            version = 45
+        else:
+            extra = ''
+            sizes = filesize
+            version = 20
+        entry = dict(filename=filename, flags=flags, compression=ZIP_STORED,
+                     dosdate=dosdate, dostime=dostime, zip64=zip64,
+                     header_offset=self.offset, crc=crc, compress_size=filesize,
+                     file_size=filesize, version=version)
+        header = struct.pack('<4sHHHHHIIIHH', 'PK\x03\x04', version, flags,
+                             ZIP_STORED, dostime, dosdate, crc, sizes, sizes,
+                             len(filename), len(extra))
+        self._write(header + filename + extra)
+        self.fileobj.write_reference(reference, filesize)
+        self.offset += filesize
+        self.entries.append(entry)
+
+    def _central_directory_record(self, entry):
+        extra_values = []
+        file_size = entry['file_size']
+        compress_size = entry['compress_size']
+        header_offset = entry['header_offset']
+        if file_size >= self.ZIP64_LIMIT:
+            extra_values.append(file_size)
+            file_size = self.ZIP64_LIMIT
+        if compress_size >= self.ZIP64_LIMIT:
+            extra_values.append(compress_size)
+            compress_size = self.ZIP64_LIMIT
+        if header_offset >= self.ZIP64_LIMIT:
+            extra_values.append(header_offset)
+            header_offset = self.ZIP64_LIMIT
+        if extra_values:
+            extra = struct.pack('<HH' + 'Q'*len(extra_values), 0x0001,
+                                8*len(extra_values), *extra_values)
+            version = 45
+        else:
+            extra = ''
+            version = entry['version']
+        filename = entry['filename']
+        record = struct.pack('<4sBBHHHHHIIIHHHHHII', 'PK\x01\x02',
+                             version, 3, # Made by version and Unix
+                             version, entry['flags'], entry['compression'],
+                             entry['dostime'], entry['dosdate'], entry['crc'],
+                             compress_size, file_size, len(filename),
+                             len(extra), 0, 0, 0,
+                             0644 << 16, # External attributes (-rw-r--r--)
+                             header_offset)
+        return record + filename + extra
+
+    def close(self):
+        """ Write the central directory. Nothing can be added after this. """
+        if self.closed:
+            return
+        if self.filestream_active:
+            raise FileStreamException("Cannot close the archive while a "\
+                                      "file stream is active.")
+        if self.output is not None:
+            self.output.flush()
+        centraldir_offset = self.offset
+        for entry in self.entries:
+            self._write(self._central_directory_record(entry))
+        centraldir_size = self.offset - centraldir_offset
+        count = len(self.entries)
+        if count >= self.ZIP64_COUNT_LIMIT or centraldir_offset >= self.ZIP64_LIMIT \
+                or centraldir_size >= self.ZIP64_LIMIT:
+            zip64_endrecord_offset = self.offset
+            self._write(struct.pack('<4sQHHIIQQQQ', 'PK\x06\x06', 44, 45, 45, 0, 0,
+                                    count, count, centraldir_size, centraldir_offset))
+            self._write(struct.pack('<4sIQI', 'PK\x06\x07', 0, zip64_endrecord_offset, 1))
+            count = min(count, self.ZIP64_COUNT_LIMIT)
+            centraldir_size = min(centraldir_size, self.ZIP64_LIMIT)
+            centraldir_offset = min(centraldir_offset, self.ZIP64_LIMIT)
+        self._write(struct.pack('<4sHHHHIIH', 'PK\x05\x06', 0, 0, count, count,
+                                centraldir_size, centraldir_offset, 0))
+        self.closed = True
+
+class SegmentedFile(object):
+    """
+    A write-only file-like object that records the data written to it as
+    a list of segments instead of storing it. A segment is either bytes,
+    or a reference to a file of a known size that is not read until it is
+    needed (see :meth:`ZipStreamWriter.add_file_reference`).
+
+    Since the size and position of every segment is known, :meth:`open`
+    can read any part of the data without reading what comes before it.
+    """
+    def __init__(self):
+        self.offsets = []
+        self.segments = [] # (bytes, reference, size)
+        self.size = 0
+
+    def _append(self, bytes, reference, size):
+        if size:
+            self.offsets.append(self.size)
+            self.segments.append((bytes, reference, size))
+            self.size += size
+
+    def write(self, bytes):
+        self._append(str(bytes), None, len(bytes))
+
+    def write_reference(self, reference, size):
+        self._append(None, reference, size)
+
+    def get_digest(self):
+        """ Get the hex encoded SHA-1 digest of the bytes segments, and the
+        positions of the references. This identifies the data if the
+        referenced files never change. """
+        checksum = sha1()
+        for offset, (bytes, reference, size) in zip(self.offsets, self.segments):
+            if reference is None:
+                checksum.update(bytes)
+            else:
+                checksum.update('%d:%d' % (offset, size))
+        return checksum.hexdigest()
+
+    def open(self, read_open):
+        """ Get a :class:`SegmentedFileReader` for the data. ``read_open``
+        is called with a reference to open the referenced file. """
+        return SegmentedFileReader(self, read_open)
+
+
+class SegmentedFileReader(object):
+    """
+    A read-only file-like object supporting ``seek()``, reading the data
+    recorded by a :class:`SegmentedFile`. Referenced files are opened when
+    they are needed, one at a time.
+    """
+    def __init__(self, segmentedfile, read_open):
+        self.segmentedfile = segmentedfile
+        self.read_open = read_open
+        self.pos = 0
+        self.fileobj = None
+        self.fileobj_index = None
+        self.fileobj_pos = None
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, n=-1):
+        remaining = self.segmentedfile.size - self.pos
+        if n < 0 or n > remaining:
+            n = remaining
+        offsets = self.segmentedfile.offsets
+        segments = self.segmentedfile.segments
+        parts = []
+        while n > 0:
+            index = bisect_right(offsets, self.pos) - 1
+            bytes, reference, size = segments[index]
+            offset = self.pos - offsets[index]
+            length = min(n, size - offset)
+            if reference is None:
+                bytes = bytes[offset:offset+length]
+            else:
+                bytes = self._read_reference(index, reference, offset, length)
+            parts.append(bytes)
+            self.pos += length
+            n -= length
+        return ''.join(parts)
+
+    def _read_reference(self, index, reference, offset, length):
+        if self.fileobj_index != index or self.fileobj_pos != offset:
+            self._close_fileobj()
+            self.fileobj = self.read_open(reference)
+            self.fileobj_index = index
+            try:
+                self.fileobj.seek(offset)
+            except (AttributeError, IOError):
+                skip = offset
+                while skip > 0:
+                    skipped = len(self.fileobj.read(min(65536, skip)))
+                    if not skipped:
+                        break
+                    skip -= skipped
+            self.fileobj_pos = offset
+        parts = []
+        remaining = length
+        while remaining > 0:
+            bytes = self.fileobj.read(remaining)
+            if not bytes:
+                raise IOError('%r is smaller than its recorded size.' % (reference,))
+            parts.append(bytes)
+            remaining -= len(bytes)
+        self.fileobj_pos += length
+        return ''.join(parts)
+
+    def _close_fileobj(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
+            self.fileobj_index = None
+
+    def close(self):
+        self._close_fileobj()
+
+
 class StreamableTar(StreamableArchive):
     """
     Stream archive in TAR format. The archive can be compressed with
-    gzip by setting archive_format to tgz or tar.gz
+    gzip by setting archive_format to tgz or tar.gz. If ``threads`` is more
+    than 0, gzip compression is done on that many threads (see
+    :class:`ParallelGzipWriter`).
     """
-    def __init__(self, archive_type=None):
-        super(StreamableTar, self).__init__()
+    def __init__(self, archive_type=None, high_water_mark=None, threads=0):
+        super(StreamableTar, self).__init__(high_water_mark, threads)
         mode = "w"
+        self.gzipfile = None
+        fileobj = self.in_memory
         if archive_type == "tgz" or archive_type == "tar.gz":
-            mode += ":gz"
-        self.archive = FileStreamTar.open(name=None, mode=mode, fileobj=self.in_memory)
+            if self.pool is None:
+                mode += ":gz"
+            else:
+                self.gzipfile = ParallelGzipWriter(self.in_memory, self.pool,
+                                                   max_pending=threads*2)
+                fileobj = self.gzipfile
+        self.archive = FileStreamTar.open(name=None, mode=mode, fileobj=fileobj)
     
     def add_file(self, filename, bytes):
         if self.archive.filestream_active:
@@ -148,6 +896,12 @@ class StreamableTar(StreamableArchive):
     def read(self):
         self.in_memory.seek(0)
         return super(StreamableTar, self).read()        
+
+    def close(self):
+        self.archive.close()
+        if self.gzipfile is not None:
+            self.gzipfile.close()
+        self.terminate()
     
     def can_write_chunks(self):
         return True
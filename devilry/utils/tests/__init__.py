@@ -1,2 +1,5 @@
 from streamable_archive_tests import * 
 from delivery_collection_tests import * 
+from sendfile_tests import * 
+from prefetch_tests import * 
+from archive_cache_tests import *
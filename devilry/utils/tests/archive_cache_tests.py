@@ -0,0 +1,119 @@
+from os import listdir
+from os.path import exists, join
+from tempfile import mkdtemp
+from shutil import rmtree
+from zipfile import ZipFile
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.conf import settings
+from django.core.management import call_command
+
+from devilry.apps.core.models import FileMeta, AssignmentGroup
+from devilry.apps.core.testhelper import TestHelper
+from devilry.apps.core.deliverystore import MemoryDeliveryStore
+from ..archive_cache import CachedArchive, TMP_DIRNAME
+
+
+class TestArchiveCache(TestCase, TestHelper):
+
+    def setUp(self):
+        self.orig_deliverystore = FileMeta.deliverystore
+        FileMeta.deliverystore = MemoryDeliveryStore()
+        self.root = mkdtemp()
+        self.orig_root = settings.DEVILRY_ARCHIVE_CACHE_ROOT
+        settings.DEVILRY_ARCHIVE_CACHE_ROOT = self.root
+        self.add(nodes="uio",
+                 subjects=["inf1100"],
+                 periods=["period1:begins(-1)"],
+                 assignments=["assignment1"],
+                 assignmentgroups=["g1:candidate(student1):examiner(examiner1)",
+                                   "g2:candidate(student2):examiner(examiner2)"],
+                 deadlines=['d1:ends(1)'])
+        self.assignment = self.inf1100_period1_assignment1
+        self.add_delivery("inf1100.period1.assignment1.g1", {"a.txt": "a"*100})
+        self.add_delivery("inf1100.period1.assignment1.g2", {"b.txt": "b"*100})
+        self.request = RequestFactory().get('/')
+
+    def tearDown(self):
+        FileMeta.deliverystore = self.orig_deliverystore
+        settings.DEVILRY_ARCHIVE_CACHE_ROOT = self.orig_root
+        rmtree(self.root)
+
+    def _create_cachedarchive(self):
+        groups = AssignmentGroup.objects.filter(parentnode=self.assignment)
+        return CachedArchive(self.root, self.assignment, groups, 'zip')
+
+    def test_build_on_download(self):
+        cached = self._create_cachedarchive()
+        self.assertFalse(cached.exists())
+        response = cached.create_response(self.request)
+        self.assertFalse(response.has_header('ETag'))
+        output = ''.join(response)
+        self.assertTrue(cached.exists())
+        self.assertEquals(open(cached.filepath, 'rb').read(), output)
+        self.assertEquals(listdir(join(self.root, TMP_DIRNAME)), [])
+
+        cached = self._create_cachedarchive()
+        response = cached.create_response(self.request)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertEquals(''.join(response), output)
+        zfile = ZipFile(StringIO(output), "r")
+        self.assertEquals(len(zfile.namelist()), 2)
+
+    def test_aborted_build(self):
+        cached = self._create_cachedarchive()
+        iterator = cached.iter_build()
+        iterator.next()
+        iterator.close()
+        self.assertFalse(cached.exists())
+        self.assertEquals(listdir(join(self.root, TMP_DIRNAME)), [])
+
+    def test_fingerprint_and_invalidate(self):
+        cached = self._create_cachedarchive()
+        cached.build()
+        self.assertTrue(exists(cached.dirpath))
+        self.add_delivery("inf1100.period1.assignment1.g1", {"c.txt": "c"})
+        self.assertFalse(exists(cached.dirpath))
+        newcached = self._create_cachedarchive()
+        self.assertEquals(newcached.key, cached.key)
+        self.assertNotEquals(newcached.fingerprint, cached.fingerprint)
+
+    def test_fingerprint_anonymous(self):
+        cached = self._create_cachedarchive()
+        self.assignment.anonymous = True
+        self.assignment.save()
+        self.assertNotEquals(self._create_cachedarchive().fingerprint, cached.fingerprint)
+
+    def test_build_locked(self):
+        cached = self._create_cachedarchive()
+        self.assertTrue(cached._lock())
+        try:
+            other = self._create_cachedarchive()
+            output = ''.join(other.create_response(self.request))
+            self.assertFalse(other.exists())
+            self.assertEquals(len(ZipFile(StringIO(output), "r").namelist()), 2)
+            other.build()
+            self.assertFalse(other.exists())
+        finally:
+            cached._unlock()
+        self.assertEquals(listdir(join(self.root, TMP_DIRNAME)), [])
+        cached.build()
+        self.assertTrue(cached.exists())
+        self.assertEquals(listdir(join(self.root, TMP_DIRNAME)), [])
+
+    def test_replace_older_fingerprint(self):
+        cached = self._create_cachedarchive()
+        cached.build()
+        settings.DEVILRY_ARCHIVE_CACHE_ROOT = None # Disable invalidation
+        self.add_delivery("inf1100.period1.assignment1.g1", {"c.txt": "c"})
+        newcached = self._create_cachedarchive()
+        newcached.build()
+        self.assertEquals(listdir(cached.dirpath), [newcached.filename])
+
+    def test_build_command(self):
+        call_command('devilry_build_archive_cache', str(self.assignment.id), verbosity=0)
+        # All groups, and one subset for each examiner
+        self.assertEquals(len(listdir(join(self.root, str(self.assignment.id)))), 3)
+        self.assertTrue(self._create_cachedarchive().exists())
@@ -1,40 +1,149 @@
 #!/usr/bin/env python
 """
-Tests the StreamableZip and StreamableTar implementations.
+Tests the archive generators in delivery_collection.
 """
+from zipfile import ZipFile
+from StringIO import StringIO
+from datetime import datetime, timedelta
 
 from django.test import TestCase
-from django.contrib.auth.models import User
-
-from devilry.apps.core.models import (Node, Subject, Period, Assignment, AssignmentGroup,
-                                      Delivery, Candidate)
-
-#class TestDeliveryCollection(TestCase):
-    #fixtures = ['core/deprecated_users.json', 'core/core.json']
-
-    #def setUp(self):
-        #self.thesuperuser= User.objects.get(username='thesuperuser')
-        #self.ifi = Node.objects.get(short_name='ifi')
-        #self.ifiadmin = User.objects.get(username='ifiadmin') # admin on the ifi node
-        #self.inf1100 = Subject.get_by_path('inf1100')
-        
-        #self.inf1100_long = Period.get_by_path('inf1100.looong')
-        #self.assignment = Assignment.get_by_path("inf1100.looong.oblig1")
-
-        #self.userobj = User.objects.get(username="student0")
-        #self.ag = AssignmentGroup()
-        #self.ag.parentnode = self.assignment
-        #cand = Candidate()
-        #cand.student = self.userobj
-        #cand.assignment_group = self.ag
-        #cand.save()
-        #self.ag.candidates.add(cand)
-        #self.ag.save()
-        #
-
-    #def test_something(self):
-        #pass
-        #delivery = Delivery.begin(self.ag, self.userobj)
-        #delivery.add_file("Testfile", f.chunks())
-        #delivery.finish()
+from django.test.client import RequestFactory
 
+from devilry.apps.core.models import FileMeta, AssignmentGroup, Delivery
+from devilry.apps.core.testhelper import TestHelper
+from devilry.apps.core.deliverystore import MemoryDeliveryStore
+from ..stream_archives import StreamableZip
+from ..delivery_collection import (iter_archive_deliveries, iter_archive_entries,
+                                   get_assignment_entries, get_archive_token,
+                                   parse_archive_token, create_resumable_zip_response,
+                                   create_archive_from_assignmentgroups)
+
+
+class TestDeliveryCollection(TestCase, TestHelper):
+
+    def setUp(self):
+        self.orig_deliverystore = FileMeta.deliverystore
+        FileMeta.deliverystore = MemoryDeliveryStore()
+        self.add(nodes="uio",
+                 subjects=["inf1100"],
+                 periods=["period1"],
+                 assignments=["assignment1"],
+                 assignmentgroups=["g1:candidate(student1)",
+                                   "g2:candidate(student2,student3)"],
+                 deadlines=['d1:ends(1)'])
+        self.delivery = self.add_delivery("inf1100.period1.assignment1.g1",
+                                          {"a.txt": "a"*100, "b.txt": "b"*3000})
+
+    def tearDown(self):
+        FileMeta.deliverystore = self.orig_deliverystore
+
+    def test_iter_archive_deliveries_high_water_mark(self):
+        archive = StreamableZip(high_water_mark=1000)
+        output = list(iter_archive_deliveries(archive, "student1", "inf1100",
+                                              [self.delivery]))
+        zfile = ZipFile(StringIO(''.join(output)), "r")
+        self.assertEquals(zfile.read("inf1100/student1/a.txt"), "a"*100)
+        self.assertEquals(zfile.read("inf1100/student1/b.txt"), "b"*3000)
+
+    def test_iter_archive_deliveries_below_high_water_mark(self):
+        archive = StreamableZip()
+        output = ''.join(iter_archive_deliveries(archive, "student1", "inf1100",
+                                                 [self.delivery]))
+        zfile = ZipFile(StringIO(output), "r")
+        self.assertEquals(zfile.read("inf1100/student1/a.txt"), "a"*100)
+        self.assertEquals(zfile.read("inf1100/student1/b.txt"), "b"*3000)
+
+    def test_create_archive_from_assignmentgroups_lazy(self):
+        groups = AssignmentGroup.objects.filter(parentnode=self.inf1100_period1_assignment1)
+        with self.assertNumQueries(0):
+            response = create_archive_from_assignmentgroups(groups, 'assignment1', 'zip')
+        zfile = ZipFile(StringIO(''.join(response)), "r")
+        self.assertEquals(len(zfile.namelist()), 2)
+
+    def test_iter_archive_deliveries_multiple(self):
+        delivery2 = self.add_delivery("inf1100.period1.assignment1.g1", {"a.txt": "second"})
+        archive = StreamableZip()
+        output = list(iter_archive_deliveries(archive, "student1", "inf1100",
+                                              [self.delivery, delivery2]))
+        zfile = ZipFile(StringIO(''.join(output)), "r")
+        self.assertEquals(zfile.read("inf1100/student1/%d/a.txt" % self.delivery.number), "a"*100)
+        self.assertEquals(zfile.read("inf1100/student1/%d/b.txt" % self.delivery.number), "b"*3000)
+        self.assertEquals(zfile.read("inf1100/student1/%d/a.txt" % delivery2.number), "second")
+        self.assertTrue("Delivery-ID" in zfile.read("inf1100/student1/Deliveries.txt"))
+
+    def test_assignment_archive(self):
+        delivery2 = self.add_delivery("inf1100.period1.assignment1.g1", {"a.txt": "second"})
+        delivery3 = self.add_delivery("inf1100.period1.assignment1.g2", {"c.txt": "third"})
+        groups = AssignmentGroup.objects.filter(parentnode=self.inf1100_period1_assignment1)
+        with self.assertNumQueries(2):
+            entries = get_assignment_entries("inf1100.period1.assignment1", groups)
+        archive = StreamableZip()
+        with self.assertNumQueries(0):
+            output = ''.join(iter_archive_entries(archive, entries))
+        zfile = ZipFile(StringIO(output), "r")
+        deadline = self.delivery.deadline.deadline.strftime("%Y-%m-%dT%H_%M_%S")
+        prefix = "inf1100.period1.assignment1/student1_group-%d/deadline-%s/" % (
+            self.inf1100_period1_assignment1_g1.id, deadline)
+        self.assertEquals(zfile.read(prefix + "delivery-001/a.txt"), "a"*100)
+        self.assertEquals(zfile.read(prefix + "delivery-001/b.txt"), "b"*3000)
+        self.assertEquals(zfile.read(prefix + "delivery-002/a.txt"), "second")
+        prefix = "inf1100.period1.assignment1/student2-student3_group-%d/deadline-%s/" % (
+            self.inf1100_period1_assignment1_g2.id, deadline)
+        self.assertEquals(zfile.read(prefix + "delivery-001/c.txt"), "third")
+        self.assertEquals(len(zfile.namelist()), 4)
+
+    def test_assignment_entries_delivered_after(self):
+        Delivery.objects.filter(id=self.delivery.id).update(time_of_delivery=datetime(2000, 1, 1))
+        self.add_delivery("inf1100.period1.assignment1.g1", {"a.txt": "second"})
+        self.add_delivery("inf1100.period1.assignment1.g2", {"c.txt": "third"},
+                          successful=False)
+        groups = AssignmentGroup.objects.filter(parentnode=self.inf1100_period1_assignment1)
+        entries = get_assignment_entries("inf1100.period1.assignment1", groups,
+                                         delivered_after=datetime(2010, 1, 1))
+        self.assertEquals([filemeta.filename for key, filemeta in entries], ["a.txt"])
+        self.assertTrue(entries[0][0][0].endswith("delivery-002/a.txt"))
+
+    def test_archive_token(self):
+        groups = AssignmentGroup.objects.filter(parentnode=self.inf1100_period1_assignment1)
+        before = datetime.now()
+        token = parse_archive_token(get_archive_token(groups))
+        self.assertTrue(before <= token <= datetime.now())
+
+        # The token does not pass deliveries that are still being uploaded
+        uploading = self.add_delivery("inf1100.period1.assignment1.g2", {"c.txt": "third"},
+                                      successful=False)
+        uploading = Delivery.objects.get(id=uploading.id)
+        token = parse_archive_token(get_archive_token(groups))
+        self.assertTrue(token < uploading.time_of_delivery)
+        self.assertTrue(token > uploading.time_of_delivery - timedelta(seconds=1))
+
+    def test_parse_archive_token(self):
+        self.assertEquals(parse_archive_token('2011-10-01T12:30:00'), datetime(2011, 10, 1, 12, 30))
+        self.assertEquals(parse_archive_token('2011-10-01'), datetime(2011, 10, 1))
+        self.assertRaises(ValueError, parse_archive_token, 'yesterday')
+
+    def test_resumable_zip(self):
+        self.add_delivery("inf1100.period1.assignment1.g2", {"c.txt": "third"})
+        groups = AssignmentGroup.objects.filter(parentnode=self.inf1100_period1_assignment1)
+        entries = get_assignment_entries("inf1100.period1.assignment1", groups)
+        entries.append((("inf1100.period1.assignment1/README.txt", "generated"), None))
+        with self.assertNumQueries(0):
+            response = create_resumable_zip_response(RequestFactory().get('/'), entries)
+            output = ''.join(response)
+        self.assertEquals(int(response['Content-Length']), len(output))
+        zfile = ZipFile(StringIO(output), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals(len(zfile.namelist()), 4)
+        self.assertEquals(zfile.read("inf1100.period1.assignment1/README.txt"), "generated")
+
+        # The same archive every time
+        response2 = create_resumable_zip_response(RequestFactory().get('/'), entries)
+        self.assertEquals(''.join(response2), output)
+        self.assertEquals(response2['ETag'], response['ETag'])
+
+        # Resume from the middle of the first file
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=150-',
+                                       HTTP_IF_RANGE=response['ETag'])
+        response = create_resumable_zip_response(request, entries)
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(''.join(response), output[150:])
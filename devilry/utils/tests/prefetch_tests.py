@@ -0,0 +1,62 @@
+from StringIO import StringIO
+import threading
+
+from django.test import TestCase
+
+from ..prefetch import iter_prefetched_files
+
+
+class FakeStore(object):
+    def __init__(self):
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def read_open(self, filemeta):
+        if filemeta.data is None:
+            raise IOError('Not found')
+        with self.lock:
+            self.opened.append(filemeta.name)
+        return StringIO(filemeta.data)
+
+
+class FakeFileMeta(object):
+    delivery = None
+
+    def __init__(self, store, name, data):
+        self.deliverystore = store
+        self.name = name
+        self.data = data
+        self.size = len(data or '')
+
+
+class TestPrefetch(TestCase):
+    def setUp(self):
+        self.store = FakeStore()
+        self.items = [(i, FakeFileMeta(self.store, str(i), 'x'*i*10)) for i in xrange(1, 20)]
+        self.items.insert(5, ('extra', None))
+
+    def read_all(self, threads, max_bytes=1000, chunk_size=7):
+        result = []
+        for key, prefetched in iter_prefetched_files(self.items, chunk_size, max_bytes, threads):
+            if prefetched is None:
+                result.append((key, None))
+            else:
+                result.append((key, ''.join(prefetched.iter_chunks())))
+        return result
+
+    def test_order_and_content(self):
+        expected = [(key, filemeta and filemeta.data) for key, filemeta in self.items]
+        self.assertEquals(self.read_all(threads=0), expected)
+        self.assertEquals(self.read_all(threads=3), expected)
+        self.assertEquals(self.read_all(threads=3, max_bytes=1), expected)
+        self.assertEquals(self.read_all(threads=3, chunk_size=1000), expected)
+
+    def test_error(self):
+        self.items[3] = ('error', FakeFileMeta(self.store, 'error', None))
+        self.assertRaises(IOError, self.read_all, threads=3)
+
+    def test_stop_early(self):
+        it = iter_prefetched_files(self.items, 7, 1000, 3)
+        key, prefetched = it.next()
+        self.assertEquals(key, 1)
+        it.close()
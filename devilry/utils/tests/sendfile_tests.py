@@ -0,0 +1,121 @@
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.conf import settings
+
+from devilry.apps.core.models import FileMeta
+from devilry.apps.core.testhelper import TestHelper
+from devilry.apps.core.deliverystore import FsHierDeliveryStore, MemoryDeliveryStore
+from ..sendfile import create_filemeta_response, parse_range_header
+
+
+class TestSendfile(TestCase, TestHelper):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.orig_deliverystore = FileMeta.deliverystore
+        self.orig_backend = settings.DEVILRY_SENDFILE_BACKEND
+        FileMeta.deliverystore = FsHierDeliveryStore(self.root, interval=10)
+        self.add(nodes="uio",
+                 subjects=["inf1100"],
+                 periods=["period1"],
+                 assignments=["assignment1"],
+                 assignmentgroups=["g1:candidate(student1)"],
+                 deadlines=['d1:ends(1)'])
+        delivery = self.add_delivery("inf1100.period1.assignment1.g1", {"hello.txt": "hello"})
+        self.filemeta = delivery.filemetas.all()[0]
+        self.filepath = FileMeta.deliverystore.get_filesystem_path(self.filemeta)
+
+    def get(self, **headers):
+        return RequestFactory().get('/', **headers)
+
+    def tearDown(self):
+        FileMeta.deliverystore = self.orig_deliverystore
+        settings.DEVILRY_SENDFILE_BACKEND = self.orig_backend
+        rmtree(self.root)
+
+    def test_no_backend(self):
+        settings.DEVILRY_SENDFILE_BACKEND = None
+        response = create_filemeta_response(self.get(), self.filemeta, 'text/plain')
+        self.assertEquals(''.join(response), 'hello')
+        self.assertEquals(response['Content-Length'], '5')
+
+    def test_xsendfile(self):
+        settings.DEVILRY_SENDFILE_BACKEND = 'xsendfile'
+        response = create_filemeta_response(self.get(), self.filemeta, 'text/plain')
+        self.assertEquals(response['X-Sendfile'], self.filepath)
+        self.assertEquals(response.content, '')
+
+    def test_xaccelredirect(self):
+        settings.DEVILRY_SENDFILE_BACKEND = 'xaccelredirect'
+        settings.DEVILRY_XACCELREDIRECT_ROOT = self.root
+        response = create_filemeta_response(self.get(), self.filemeta, 'text/plain')
+        self.assertEquals(response['X-Accel-Redirect'],
+                          '/devilry-deliverystore/' + self.filepath[len(self.root)+1:])
+
+    def test_wsgi(self):
+        settings.DEVILRY_SENDFILE_BACKEND = 'wsgi'
+        response = create_filemeta_response(self.get(), self.filemeta, 'text/plain')
+        self.assertEquals(response.devilry_sendfile_fileobj.name, self.filepath)
+        self.assertEquals(''.join(response), 'hello')
+
+    def test_not_on_filesystem(self):
+        settings.DEVILRY_SENDFILE_BACKEND = 'xsendfile'
+        FileMeta.deliverystore = MemoryDeliveryStore()
+        filemeta = self.filemeta.delivery.add_file('other.txt', ['world'])
+        response = create_filemeta_response(self.get(), filemeta, 'text/plain')
+        self.assertFalse(response.has_header('X-Sendfile'))
+        self.assertEquals(''.join(response), 'world')
+
+    def test_parse_range_header(self):
+        self.assertEquals(parse_range_header('bytes=0-9', 100), (0, 10))
+        self.assertEquals(parse_range_header('bytes=10-', 100), (10, 100))
+        self.assertEquals(parse_range_header('bytes=-10', 100), (90, 100))
+        self.assertEquals(parse_range_header('bytes=90-200', 100), (90, 100))
+        self.assertEquals(parse_range_header('bytes=-200', 100), (0, 100))
+        self.assertEquals(parse_range_header('bytes=100-', 100), False)
+        self.assertEquals(parse_range_header('bytes=5-2', 100), False)
+        self.assertEquals(parse_range_header('bytes=0-1,5-6', 100), None)
+        self.assertEquals(parse_range_header('bytes=a-b', 100), None)
+        self.assertEquals(parse_range_header('items=0-1', 100), None)
+        self.assertEquals(parse_range_header(None, 100), None)
+
+    def test_range(self):
+        settings.DEVILRY_SENDFILE_BACKEND = None
+        response = create_filemeta_response(self.get(HTTP_RANGE='bytes=1-3'),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 206)
+        self.assertEquals(''.join(response), 'ell')
+        self.assertEquals(response['Content-Range'], 'bytes 1-3/5')
+        self.assertEquals(response['Content-Length'], '3')
+
+        response = create_filemeta_response(self.get(HTTP_RANGE='bytes=5-'),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 416)
+        self.assertEquals(response['Content-Range'], 'bytes */5')
+
+    def test_if_range(self):
+        settings.DEVILRY_SENDFILE_BACKEND = None
+        response = create_filemeta_response(self.get(HTTP_RANGE='bytes=1-3', HTTP_IF_RANGE='"other"'),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+        response = create_filemeta_response(self.get(HTTP_RANGE='bytes=1-3', HTTP_IF_RANGE=etag),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 206)
+
+    def test_conditional(self):
+        settings.DEVILRY_SENDFILE_BACKEND = None
+        response = create_filemeta_response(self.get(), self.filemeta, 'text/plain')
+        self.assertEquals(response['ETag'], '"{0}"'.format(self.filemeta.digest))
+        response = create_filemeta_response(self.get(HTTP_IF_NONE_MATCH=response['ETag']),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 304)
+        response = create_filemeta_response(self.get(HTTP_IF_NONE_MATCH='"other"'),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 200)
+        lastmodified = response['Last-Modified']
+        response = create_filemeta_response(self.get(HTTP_IF_MODIFIED_SINCE=lastmodified),
+                                            self.filemeta, 'text/plain')
+        self.assertEquals(response.status_code, 304)
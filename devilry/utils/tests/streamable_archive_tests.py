@@ -7,10 +7,17 @@ from django.test import TestCase
 
 #from devilry.apps.core.models import (Assignment, AssignmentGroup)
 #from ..delivery_collection import create_archive_from_assignmentgroups
-from ..stream_archives import StreamableZip, StreamableTar, \
-                                               UnsupportedOperation, FileStreamException
+from ..stream_archives import StreamableZip, StreamableTar, MemoryIO, \
+                                               UnsupportedOperation, FileStreamException, \
+                                               ZipStreamWriter, ParallelGzipWriter, \
+                                               CompressionPolicy, estimate_entropy, \
+                                               SegmentedFile
 
-from zipfile import ZipFile
+from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+from multiprocessing.pool import ThreadPool
+import gzip
+import zlib
+from StringIO import StringIO
 import tarfile
 
 import os
@@ -47,9 +54,6 @@ class TestStreamableArchive(TestCase):
         self.stream_file_to_archive(archive, self.file1_name, self.file1_content)
         self.stream_file_to_archive(archive, self.file2_name, self.file2_content)
     
-    def do_zip_filestream(self):
-        self.stream_files_to_archive(StreamableZip())
-
     def tar_add_file_with_active_file_stream(self):
         """
         Open a StreamableTar, and add a file after opening a filestream. 
@@ -137,10 +141,59 @@ class TestStreamableArchive(TestCase):
     
     def test_zip_filestream(self):
         """
-        Test that attempting to open a filestream on a StreamableZip
-        produces a UnsupportedOpertation exception.
+        Test file stream functionality on a StreamableZip file.
+        """
+        archive = StreamableZip()
+        self.assertTrue(archive.can_write_chunks())
+        self.stream_files_to_archive(archive)
+        archive.close()
+        self.to_file(self.testfile, archive.read())
+
+        zfile = ZipFile(open(self.testfile, "r"), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals(self.file1_content, zfile.read(self.file1_name))
+        self.assertEquals(self.file2_content, zfile.read(self.file2_name))
+        os.remove(self.testfile)
+
+    def test_zip_filestream_read_while_writing(self):
+        """
+        Test that the data written so far can be read while streaming, and
+        that the concatenated output is a valid zip.
+        """
+        archive = StreamableZip()
+        output = []
+        archive.open_filestream(self.file1_name, len(self.file1_content))
+        for i in xrange(100):
+            archive.append_file_chunk(self.file1_content, len(self.file1_content))
+            output.append(archive.read())
+        archive.close_filestream()
+        archive.close()
+        output.append(archive.read())
+        zfile = ZipFile(StringIO(''.join(output)), "r")
+        self.assertEquals(self.file1_content*100, zfile.read(self.file1_name))
+
+    def test_zip64_local_header(self):
         """
-        self.assertRaises(UnsupportedOperation, self.do_zip_filestream) 
+        Test that a file stream opened with a size requiring ZIP64 produces
+        a valid zip.
+        """
+        archive = StreamableZip()
+        archive.open_filestream(self.file1_name, 5*1024*1024*1024)
+        archive.append_file_chunk(self.file1_content, len(self.file1_content))
+        archive.close_filestream()
+        archive.add_file(self.file2_name, self.file2_content)
+        archive.close()
+        zfile = ZipFile(StringIO(archive.read()), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals(self.file1_content, zfile.read(self.file1_name))
+        self.assertEquals(self.file2_content, zfile.read(self.file2_name))
+
+    def test_zip_unicode_filename(self):
+        archive = StreamableZip()
+        archive.add_file(u"bl\xe5b\xe6r.txt", "content")
+        archive.close()
+        zfile = ZipFile(StringIO(archive.read()), "r")
+        self.assertEquals(zfile.read(u"bl\xe5b\xe6r.txt"), "content")
 
     def test_zip_archive(self):
         """
@@ -195,6 +248,177 @@ class TestStreamableArchive(TestCase):
         #self.assertEquals(self.file3_content, content3)        
         os.remove(self.testfile)
 
+
+class TestParallelCompression(TestCase):
+    def setUp(self):
+        self.pool = ThreadPool(3)
+        self.files = [("file%d.txt" % i, os.urandom(10) + "abc"*random.randint(0, 3000))
+                      for i in xrange(20)]
+
+    def tearDown(self):
+        self.pool.terminate()
+
+    def test_zip(self):
+        """ Many members, some larger than the blocksize, compressed at once
+        must be written in order. """
+        output = MemoryIO()
+        writer = ZipStreamWriter(output, pool=self.pool, blocksize=1000, max_pending=4)
+        for index, (filename, content) in enumerate(self.files):
+            if index == 5:
+                writer.add_file(filename, content, compression=ZIP_STORED)
+                continue
+            writer.open_filestream(filename, len(content))
+            for start in xrange(0, len(content), 700):
+                writer.append_file_chunk(content[start:start+700])
+            writer.close_filestream()
+        writer.close()
+        zfile = ZipFile(StringIO(output.read()), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals(zfile.namelist(), [filename for filename, content in self.files])
+        for filename, content in self.files:
+            self.assertEquals(zfile.read(filename), content)
+
+    def test_streamable_zip(self):
+        archive = StreamableZip(threads=2)
+        for filename, content in self.files:
+            archive.add_file(filename, content)
+        archive.close()
+        self.assertEquals(archive.pool, None)
+        zfile = ZipFile(StringIO(archive.read()), "r")
+        self.assertEquals(zfile.read(self.files[3][0]), self.files[3][1])
+
+    def test_streamable_zip_lazy_pool(self):
+        archive = StreamableZip(threads=2)
+        self.assertEquals(archive.pool.pool, None)
+        archive.terminate()
+        self.assertEquals(archive.pool, None)
+
+    def test_gzip(self):
+        output = MemoryIO()
+        writer = ParallelGzipWriter(output, self.pool, blocksize=1000)
+        for filename, content in self.files:
+            writer.write(content)
+        self.assertEquals(writer.tell(), sum(len(content) for filename, content in self.files))
+        writer.close()
+        data = gzip.GzipFile(fileobj=StringIO(output.read())).read()
+        self.assertEquals(data, ''.join(content for filename, content in self.files))
+
+    def test_streamable_tgz(self):
+        archive = StreamableTar("tgz", threads=2)
+        for filename, content in self.files:
+            archive.open_filestream(filename, len(content))
+            archive.append_file_chunk(content, len(content))
+            archive.close_filestream()
+        archive.close()
+        tfile = tarfile.open(fileobj=StringIO(archive.read()), mode="r:gz")
+        self.assertEquals(tfile.getnames(), [filename for filename, content in self.files])
+        self.assertEquals(tfile.extractfile(self.files[7][0]).read(), self.files[7][1])
+
+
+class TestCompressionPolicy(TestCase):
+    def test_estimate_entropy(self):
+        self.assertEquals(estimate_entropy(''), 0.0)
+        self.assertEquals(estimate_entropy('aaaa'), 0.0)
+        self.assertEquals(estimate_entropy('abab'), 1.0)
+        self.assertTrue(estimate_entropy(os.urandom(8192)) > 7.9)
+
+    def test_choose(self):
+        policy = CompressionPolicy()
+        self.assertEquals(policy.choose('report.PDF', 'a'*100), ZIP_STORED)
+        self.assertEquals(policy.choose('a.tar.gz'), ZIP_STORED)
+        self.assertEquals(policy.choose('Main.java', os.urandom(8192)), ZIP_DEFLATED)
+        self.assertEquals(policy.choose('data.bin', os.urandom(8192)), ZIP_STORED)
+        self.assertEquals(policy.choose('data.bin', 'hello world'*1000), ZIP_DEFLATED)
+        self.assertEquals(policy.choose('data.bin'), ZIP_DEFLATED)
+
+    def test_streamable_zip(self):
+        archive = StreamableZip(compression_policy=CompressionPolicy())
+        random_content = os.urandom(10000)
+        archive.add_file('image.jpg', 'jpeg'*100)
+        archive.open_filestream('random.bin', len(random_content))
+        archive.append_file_chunk(random_content, len(random_content))
+        archive.close_filestream()
+        archive.open_filestream('empty.bin', 0)
+        archive.close_filestream()
+        archive.add_file('text.txt', 'text'*100)
+        archive.close()
+        zfile = ZipFile(StringIO(archive.read()), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals([info.compress_type for info in zfile.infolist()],
+                          [ZIP_STORED, ZIP_STORED, ZIP_DEFLATED, ZIP_DEFLATED])
+        self.assertEquals(zfile.read('random.bin'), random_content)
+        self.assertEquals(zfile.read('empty.bin'), '')
+
+
+class TestSegmentedFile(TestCase):
+    def setUp(self):
+        self.files = {'a': 'a'*1000, 'b': '', 'c': os.urandom(3000)}
+        self.layout = SegmentedFile()
+        writer = ZipStreamWriter(self.layout, compression=ZIP_STORED)
+        for name in sorted(self.files):
+            content = self.files[name]
+            writer.add_file_reference(name, len(content),
+                                      zlib.crc32(content) & 0xffffffff, name, timestamp=0)
+        writer.add_file('d', 'ddd', compression=ZIP_STORED, timestamp=0)
+        writer.close()
+
+    def read_open(self, name):
+        return StringIO(self.files[name])
+
+    def test_zip(self):
+        data = self.layout.open(self.read_open).read()
+        self.assertEquals(len(data), self.layout.size)
+        zfile = ZipFile(StringIO(data), "r")
+        self.assertEquals(zfile.testzip(), None)
+        self.assertEquals(zfile.read('c'), self.files['c'])
+        self.assertEquals(zfile.read('b'), '')
+        self.assertEquals(zfile.read('d'), 'ddd')
+
+    def test_seek(self):
+        data = self.layout.open(self.read_open).read()
+        reader = self.layout.open(self.read_open)
+        for start, length in ((0, 10), (500, 2000), (1100, 1), (3000, 10000)):
+            reader.seek(start)
+            self.assertEquals(reader.read(length), data[start:start+length])
+        reader.close()
+
+    def test_short_reference(self):
+        reader = self.layout.open(lambda name: StringIO('short'))
+        self.assertRaises(IOError, reader.read)
+
+
+class TestMemoryIO(TestCase):
+    def test_read_write(self):
+        m = MemoryIO()
+        self.assertEquals(m.read(), '')
+        m.write('hello')
+        m.write(' ')
+        m.write('world')
+        self.assertEquals(m.size, 11)
+        self.assertEquals(m.tell(), 11)
+        self.assertEquals(m.read(3), 'hel')
+        self.assertEquals(m.read(4), 'lo w')
+        self.assertEquals(m.size, 4)
+        m.write('!')
+        self.assertEquals(m.read(), 'orld!')
+        self.assertEquals(m.size, 0)
+        self.assertEquals(m.read(10), '')
+
+    def test_initial_bytes(self):
+        m = MemoryIO('hello')
+        self.assertEquals(m.tell(), 5)
+        self.assertEquals(m.read(100), 'hello')
+
+    def test_high_water_mark(self):
+        m = MemoryIO(high_water_mark=5)
+        m.write('abcd')
+        self.assertFalse(m.above_high_water_mark())
+        m.write('e')
+        self.assertTrue(m.above_high_water_mark())
+        m.read(1)
+        self.assertFalse(m.above_high_water_mark())
+        self.assertFalse(MemoryIO('hello').above_high_water_mark())
+
     
 if __name__ == '__main__':
 